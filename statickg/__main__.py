@@ -9,6 +9,7 @@ from loguru import logger
 
 from statickg.main import ETLPipelineRunner
 from statickg.models.prelude import GitRepository
+from statickg.store import prune_content_stores, serve_content_store
 
 app = typer.Typer(pretty_exceptions_short=True, pretty_exceptions_enable=False)
 
@@ -68,5 +69,39 @@ def deploy_loop(
             time.sleep(refresh)
 
 
+@app.command()
+def serve_cache(
+    root: Annotated[
+        Path,
+        typer.Argument(
+            help="A directory for storing the entries of the shared content store"
+        ),
+    ],
+    hostname: Annotated[str, typer.Option(help="Hostname to listen on")] = "127.0.0.1",
+    port: Annotated[int, typer.Option(help="Port to listen on")] = 8080,
+):
+    serve_content_store(root, hostname, port)
+
+
+@app.command()
+def prune_cache(
+    workdir: Annotated[
+        Path,
+        typer.Argument(
+            help="A directory for storing intermediate ETL results",
+            exists=True,
+            file_okay=False,
+        ),
+    ],
+    max_age: Annotated[
+        float,
+        typer.Option(
+            help="Remove content store entries that have not been used in this number of days"
+        ),
+    ] = 30.0,
+):
+    prune_content_stores(workdir, max_age * 86400)
+
+
 if __name__ == "__main__":
     app()
@@ -1,38 +1,76 @@
 from __future__ import annotations
 
 import glob
+import gzip
+import hashlib
 import importlib
+import inspect
+import io
+import os
 import pickle
 import re
 import socket
 import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import (
+    IO,
     Any,
     Callable,
     Generic,
     Iterable,
+    Iterator,
+    Literal,
+    NotRequired,
     Optional,
     Protocol,
     Sequence,
     Type,
+    TypeAlias,
+    TypedDict,
     TypeVar,
 )
 
 import orjson
-from hugedict.sqlite import SqliteDict
-from joblib import Parallel, delayed
+from hugedict.sqlite import SqliteDict, SqliteDictFieldType
+from joblib import Parallel, cpu_count, delayed
+from joblib.externals.loky import ProcessPoolExecutor
 from libactor.cache import Backend, SqliteBackend
-from libactor.typing import Compression
+from libactor.cache.cache_args import CacheArgsHelper
+from libactor.misc import identity, orjson_dumps
+from libactor.typing import ArgSer, Compression
 from loguru import logger
 
-from statickg.models.file_and_path import ProcessStatus, RelPath, RelPathRefStr
+from statickg.models.file_and_path import (
+    CompressionArgs,
+    InputFile,
+    ManifestEntry,
+    ProcessStatus,
+    RelPath,
+    RelPathRefStr,
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 TYPE_ALIASES = {"typing.List": "list", "typing.Dict": "dict", "typing.Set": "set"}
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
 T = TypeVar("T")
 CB = TypeVar("CB", bound=Callable)
 
+# a cache entry written by a FileSqliteBackend: (dbfile, key, serialized value)
+CacheWrite: TypeAlias = tuple[Path, str, bytes]
+# when it is not None, FileSqliteBackend appends new cache entries to this object instead of
+# writing them to the database, and cache layers record their counters in it (see `defer_cache_writes`)
+_deferred_cache_writes: Optional[DeferredCacheWrites] = None
+# counters of the cache layers used in the current process, keyed by the name of the layers
+_cache_stats: dict[str, CacheStats] = {}
+
 
 def get_classpath(type: Type | Callable) -> str:
     if type.__module__ == "builtins":
@@ -125,7 +163,73 @@ def json_ser_default_object(obj: Any):
     raise TypeError
 
 
+def get_compression_ext(compression: Optional[CompressionArgs]) -> str:
+    """Get the extension appended to the name of files compressed with the given compression"""
+    if compression is None:
+        return ""
+    return COMPRESSION_EXTENSIONS[compression["format"]]
+
+
+def strip_compression_ext(file: Path) -> Path:
+    """Remove the compression extension of a file (e.g., data.ttl.gz -> data.ttl)"""
+    if file.suffix in (".gz", ".zst"):
+        return file.with_suffix("")
+    return file
+
+
+def open_file(
+    file: Path,
+    mode: Literal["rb", "wb", "rt", "wt"] = "rb",
+    compression_level: Optional[int] = None,
+    newline: Optional[str] = None,
+) -> IO:
+    """Open a file that may be compressed with gzip (.gz) or zstd (.zst) based on its extension.
+
+    The compressed output is deterministic (e.g., gzip does not store the modification time
+    and the file name) so that files with the same content have the same key. `newline` has the
+    same meaning as in `open` for text modes (e.g., CSV files must be opened with newline="").
+    """
+    if file.suffix == ".gz":
+        if mode[0] == "r":
+            f = gzip.open(file, "rb")
+        else:
+            f = gzip.GzipFile(
+                filename="",
+                mode="wb",
+                compresslevel=6 if compression_level is None else compression_level,
+                fileobj=open(file, "wb"),
+                mtime=0,
+            )
+            # GzipFile does not close the file object it is given
+            f.myfileobj = f.fileobj  # type: ignore
+    elif file.suffix == ".zst":
+        if zstandard is None:
+            raise ImportError(f"zstandard is required to read/write {file}")
+        if mode[0] == "r":
+            f = io.BufferedReader(zstandard.open(file, "rb"))
+        else:
+            f = zstandard.open(
+                file,
+                "wb",
+                cctx=zstandard.ZstdCompressor(
+                    level=3 if compression_level is None else compression_level
+                ),
+            )
+    else:
+        f = open(file, mode[0] + "b")
+
+    if mode[1] == "t":
+        return io.TextIOWrapper(f, encoding="utf-8", newline=newline)
+    return f
+
+
 def remove_deleted_files(new_filenames: set[str], outdir: RelPath):
+    """Deprecated: use `OutputManifest`, which does not scan the output directory"""
+    warnings.warn(
+        "remove_deleted_files is deprecated, use OutputManifest instead",
+        DeprecationWarning,
+        stacklevel=2,
+    )
     for file in outdir.get_path().iterdir():
         if file.is_file() and file.name not in new_filenames:
             file.unlink()
@@ -133,6 +237,12 @@ def remove_deleted_files(new_filenames: set[str], outdir: RelPath):
 
 
 def remove_deleted_2nested_files(new_relpaths: set[str], outdir: Path):
+    """Deprecated: use `OutputManifest`, which does not scan the output directory and supports any nesting depth"""
+    warnings.warn(
+        "remove_deleted_2nested_files is deprecated, use OutputManifest instead",
+        DeprecationWarning,
+        stacklevel=2,
+    )
     for file in outdir.iterdir():
         if file.is_dir():
             for subfile in file.iterdir():
@@ -150,9 +260,174 @@ def remove_deleted_2nested_files(new_relpaths: set[str], outdir: Path):
             logger.info("Remove deleted file {}", file)
 
 
+class OutputManifest:
+    """The output files that a service wrote to an output directory, persisted in the workdir of the
+    service. Stale outputs are the files of the previous manifest that are not in the current outputs, so
+    they are found without scanning the output directory, regardless of how deep the files are nested.
+
+    If the manifest does not exist yet (e.g., the outputs were written by an older version), the output
+    directory is scanned once instead.
+    """
+
+    def __init__(self, workdir: Path, outdir: Path):
+        self.outdir = outdir
+        dbfile = (
+            workdir
+            / "manifests"
+            / f"{hashlib.sha256(str(outdir).encode()).hexdigest()[:16]}.sqlite"
+        )
+        self.is_new = not dbfile.exists()
+        self.db = SqliteDict.str(
+            dbfile,
+            ser_value=lambda x: orjson.dumps(x.to_dict()),
+            deser_value=lambda x: ManifestEntry.from_dict(orjson.loads(x)),
+        )
+
+    def update(
+        self, entries: dict[str, ManifestEntry], patterns: Sequence[str] = ("**/*",)
+    ) -> list[str]:
+        """Replace the manifest with the current output files and remove the stale files.
+
+        Args:
+            entries: the current output files, keyed by their paths relative to the output directory
+            patterns: glob patterns of the output files, used to find the stale files when the manifest
+                does not exist yet
+
+        Returns:
+            paths of the removed files relative to the output directory
+        """
+        if self.is_new:
+            previous = {}
+            stale = {
+                str(file.relative_to(self.outdir))
+                for pattern in patterns
+                for file in self.outdir.glob(pattern)
+                if file.is_file()
+            }.difference(entries)
+        else:
+            previous = dict(self.db.items())
+            stale = set(previous).difference(entries)
+
+        for relpath in sorted(stale):
+            file = self.outdir / relpath
+            file.unlink(missing_ok=True)
+            logger.info("Remove deleted file {}", file)
+            # remove the folders that are empty after removing the file
+            parent = file.parent
+            while parent != self.outdir and parent.is_relative_to(self.outdir):
+                try:
+                    parent.rmdir()
+                except OSError:
+                    break
+                logger.info("Remove empty folder {}", parent)
+                parent = parent.parent
+
+        with self.db.db:
+            self.db.db.executemany(
+                f"DELETE FROM {self.db.table_name} WHERE key = ?",
+                [(relpath,) for relpath in stale if relpath in previous],
+            )
+        self.db.batch_insert(
+            [
+                (relpath, entry)
+                for relpath, entry in entries.items()
+                if previous.get(relpath) != entry
+            ]
+        )
+        self.is_new = False
+        return sorted(stale)
+
+
+@dataclass
+class CacheStats:
+    """Counters of a cache layer.
+
+    Attributes:
+        hits: number of lookups that can reuse the cached results
+        misses: number of lookups that need to recompute the results, grouped by the reason:
+            `new_key` (never computed), `changed_key` (computed with a different key), `missing_output`
+            (the output files are deleted), `modified_output` (the output files are changed), or
+            `failed` (the previous computation failed)
+        lookup_time: time (in seconds) spent in looking up the cache
+        compute_time: time (in seconds) spent in computing the results of the misses
+        saved_time: compute time (in seconds) saved by the hits, estimated from the compute time
+            recorded when the cached results were created
+    """
+
+    hits: int = 0
+    misses: dict[str, int] = field(default_factory=dict)
+    lookup_time: float = 0.0
+    compute_time: float = 0.0
+    saved_time: float = 0.0
+
+    @property
+    def n_misses(self) -> int:
+        return sum(self.misses.values())
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.n_misses
+        return self.hits / total if total > 0 else 0.0
+
+    def add_miss(self, reason: str):
+        self.misses[reason] = self.misses.get(reason, 0) + 1
+
+    def merge(self, other: CacheStats):
+        self.hits += other.hits
+        for reason, count in other.misses.items():
+            self.misses[reason] = self.misses.get(reason, 0) + count
+        self.lookup_time += other.lookup_time
+        self.compute_time += other.compute_time
+        self.saved_time += other.saved_time
+
+    def to_dict(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio,
+            "lookup_time": self.lookup_time,
+            "compute_time": self.compute_time,
+            "saved_time": self.saved_time,
+        }
+
+
+def get_cache_stats(name: str) -> CacheStats:
+    """Get the counters of a cache layer in the current process (or of the current job in a parallel
+    worker, which are sent back to the parent process by `defer_cache_writes`)."""
+    registry = (
+        _deferred_cache_writes.stats
+        if _deferred_cache_writes is not None
+        else _cache_stats
+    )
+    if name not in registry:
+        registry[name] = CacheStats()
+    return registry[name]
+
+
+def collect_cache_stats(reset: bool = False) -> dict[str, CacheStats]:
+    """Get the counters of all cache layers used in the current process, including the counters
+    sent back by parallel workers.
+
+    Args:
+        reset: whether to reset the counters after collecting them
+    """
+    global _cache_stats
+    if reset:
+        stats = _cache_stats
+        _cache_stats = {}
+        return stats
+
+    stats = {}
+    for name, layer_stats in _cache_stats.items():
+        stats[name] = CacheStats()
+        stats[name].merge(layer_stats)
+    return stats
+
+
 class CacheProcess:
-    def __init__(self, dbpath: Path):
+    def __init__(self, dbpath: Path, name: Optional[str] = None):
         dbpath.parent.mkdir(parents=True, exist_ok=True)
+        self.name = name or f"{dbpath.parent.name}/{dbpath.stem}"
         self.db = SqliteDict.str(
             dbpath,
             ser_value=lambda x: orjson.dumps(x.to_dict()),
@@ -162,23 +437,41 @@ class CacheProcess:
     @contextmanager
     def auto(self, filepath: str, key: str, outfile: Optional[Path] = None):
         notfound = not self.has_cache(filepath, key, outfile)
+        start = time.perf_counter()
 
         yield notfound
 
         if notfound:
-            self.mark_compute_success(filepath, key)
+            self.mark_compute_success(filepath, key, time.perf_counter() - start)
 
     def has_cache(self, filepath: str, key: str, outfile: Optional[Path] = None):
+        start = time.perf_counter()
+        stats = get_cache_stats(self.name)
+
         notfound = True
-        if (outfile is None or outfile.exists()) and filepath in self.db:
+        if outfile is not None and not outfile.exists():
+            stats.add_miss("missing_output")
+        elif filepath not in self.db:
+            stats.add_miss("new_key")
+        else:
             status = self.db[filepath]
-            if status.key == key and status.is_success:
+            if status.key != key:
+                stats.add_miss("changed_key")
+            elif not status.is_success:
+                stats.add_miss("failed")
+            else:
                 notfound = False
+                stats.hits += 1
+                stats.saved_time += status.compute_time
 
+        stats.lookup_time += time.perf_counter() - start
         return not notfound
 
-    def mark_compute_success(self, filepath: str, key: str):
-        self.db[filepath] = ProcessStatus(key, is_success=True)
+    def mark_compute_success(self, filepath: str, key: str, compute_time: float = 0.0):
+        self.db[filepath] = ProcessStatus(
+            key, is_success=True, compute_time=compute_time
+        )
+        get_cache_stats(self.name).compute_time += compute_time
 
 
 class Fn(Generic[T]):
@@ -210,23 +503,41 @@ class FileSqliteBackend(Backend):
     """This backend caches the process that returns a file or a list of files, which
     stores the results of the process. If the file is missing, then the cache is considered
     invalid and the process will be re-executed.
+
+    Together with the output paths, the backend records the size and modification time (ns)
+    of each output file, so an output that is truncated or overwritten after the process
+    finished also invalidates the cache. Use `has_keys` to validate many keys at once with
+    a single sqlite query and a single stat pass.
+
+    The backend also records the compute time of each entry and counts hits/misses in
+    `get_cache_stats(backend.name)`.
     """
 
+    # maximum number of keys in a single sqlite query (sqlite limits the number of variables)
+    query_batch_size = 500
+
     def __init__(
         self,
         dbfile: Path,
         multi_files: bool = False,
         compression: Optional[Compression] = None,
         verbose: Optional[str] = None,
+        name: Optional[str] = None,
     ):
         self.multi_files = multi_files
         self.verbose = verbose
+        self.name = name or f"{dbfile.parent.name}/{dbfile.stem}"
         self.db = SqliteBackend(
             dbfile=dbfile,
             ser=pickle.dumps,
             deser=pickle.loads,
             compression=compression,
         )
+        # the last value found by `has_key`, so that the following `get` (called by the
+        # cache decorator) does not need to query & deserialize the record again
+        self.last_found: Optional[tuple[str, Any]] = None
+        # start time of computing the keys that are not found, to record the compute time in `set`
+        self.compute_start: dict[str, float] = {}
 
     @staticmethod
     def factory(
@@ -237,7 +548,7 @@ class FileSqliteBackend(Backend):
     ):
         def constructor(self: InstanceWorkdir, func, cache_args_helper):
             return FileSqliteBackend(
-                dbfile=self.workdir / (filename or (func.__name__ + ".sqlite")),
+                dbfile=FileSqliteBackend.get_dbfile(self.workdir, func, filename),
                 multi_files=multi_files,
                 compression=compression,
                 verbose=verbose,
@@ -245,60 +556,295 @@ class FileSqliteBackend(Backend):
 
         return constructor
 
-    def has_key(self, key: bytes) -> bool:
-        if self.verbose is not None:
-            if not self.db.has_key(key):
-                logger.info("[{}] Key not found: {}", self.verbose, key)
+    @staticmethod
+    def get_dbfile(workdir: Path, func: Callable, filename: Optional[str] = None):
+        """Get the database file of the backend created by `FileSqliteBackend.factory` for a function"""
+        return workdir / (filename or (func.__name__ + ".sqlite"))
+
+    def has_key(self, key: str) -> bool:
+        return self.has_keys([key])[0]
+
+    def has_keys(self, keys: Sequence[str], count_misses: bool = True) -> list[bool]:
+        """Check if the keys are in the cache and their output files are unchanged.
+
+        Args:
+            keys: the keys to check
+            count_misses: whether to count the misses in the cache stats. Set it to False
+                when the missing keys will be looked up again by the cache decorator
+                (e.g., pre-filtering jobs before dispatching them) so they are not counted twice.
+        """
+        start = time.perf_counter()
+        cache_stats = get_cache_stats(self.name)
+        records = self.get_records(keys)
+
+        # stat all output files in one pass
+        filestats: dict[Path, Optional[tuple[int, int]]] = {}
+        for value, _, _ in records.values():
+            for file in self.get_files(value):
+                filestats[file] = None
+        for file in filestats:
+            try:
+                stat = os.stat(file)
+            except FileNotFoundError:
+                continue
+            filestats[file] = (stat.st_size, stat.st_mtime_ns)
+
+        output = []
+        for key in keys:
+            if key not in records:
+                if self.verbose is not None:
+                    logger.info("[{}] Key not found: {}", self.verbose, key)
+                if count_misses:
+                    cache_stats.add_miss("new_key")
+                    self.compute_start[key] = time.perf_counter()
+                output.append(False)
+                continue
+
+            value, stats, compute_time = records[key]
+            files = self.get_files(value)
+            if any(filestats[file] is None for file in files):
                 found = False
-            elif self.multi_files:
-                found = all(val.exists() for val in self.get(key))
-                if found:
-                    logger.info(
-                        "[{}] Key found {} and can reuse the output files",
-                        self.verbose,
-                        key,
-                    )
-                else:
-                    logger.info(
-                        "[{}] Key found {} but some output files are missing",
-                        self.verbose,
-                        key,
-                    )
+                miss_reason = "missing_output"
+            elif stats is None:
+                # records created by older versions do not have file stats
+                found = True
             else:
-                found = self.get(key).exists()
+                found = len(files) == len(stats) and all(
+                    filestats[file] == stat for file, stat in zip(files, stats)
+                )
+                miss_reason = "modified_output"
+
+            if self.verbose is not None:
                 if found:
                     logger.info(
-                        "[{}] Key found {} and can reuse the output file",
+                        "[{}] Key found {} and can reuse the output files",
                         self.verbose,
                         key,
                     )
                 else:
                     logger.info(
-                        "[{}] Key found {} but some output file are missing",
+                        "[{}] Key found {} but some output files are missing or modified",
                         self.verbose,
                         key,
                     )
-            return found
 
-        if not self.db.has_key(key):
-            return False
+            if found:
+                self.last_found = (key, value)
+                cache_stats.hits += 1
+                cache_stats.saved_time += compute_time
+            elif count_misses:
+                cache_stats.add_miss(miss_reason)
+                self.compute_start[key] = time.perf_counter()
+            output.append(found)
+
+        cache_stats.lookup_time += time.perf_counter() - start
+        return output
+
+    def get_records(
+        self, keys: Sequence[str]
+    ) -> dict[str, tuple[Any, Optional[list[tuple[int, int]]], float]]:
+        """Fetch records of the given keys, each record is a tuple of the cached value, the stats (size, mtime_ns)
+        of the output files (None if the record was created by an older version), and the compute time in seconds
+        (0 if the record was created by an older version)."""
+        dbconn = self.db.dbconn
+        records = {}
+        for i in range(0, len(keys), self.query_batch_size):
+            batch = keys[i : i + self.query_batch_size]
+            for key, rawvalue in dbconn.db.execute(
+                f"SELECT key, value FROM {dbconn.table_name} WHERE key IN ({','.join('?' * len(batch))})",
+                batch,
+            ):
+                records[key] = self.normalize_record(self.db.deser(rawvalue))
+
+        if _deferred_cache_writes is not None:
+            # entries written by the current job have not been committed to the database yet
+            dbfile = self.db.dbfile
+            keyset = set(keys)
+            for write_dbfile, key, rawvalue in _deferred_cache_writes.writes:
+                if write_dbfile == dbfile and key in keyset:
+                    records[key] = self.normalize_record(self.db.deser(rawvalue))
+        return records
+
+    def normalize_record(
+        self, record: Any
+    ) -> tuple[Any, Optional[list[tuple[int, int]]], float]:
+        """Convert records created by older versions, which store only the value or (value, stats)."""
+        if not isinstance(record, tuple):
+            return (record, None, 0.0)
+        if len(record) == 2:
+            return (record[0], record[1], 0.0)
+        return record
+
+    def get_files(
+        self, value: Path | InputFile | list[Path] | list[InputFile]
+    ) -> list[Path]:
         if self.multi_files:
-            return all(val.exists() for val in self.get(key))
-        return self.get(key).exists()
+            return [
+                file.path if isinstance(file, InputFile) else file
+                for file in value  # type: ignore
+            ]
+        return [value.path if isinstance(value, InputFile) else value]  # type: ignore
+
+    def get(self, key: str) -> Any:
+        if self.last_found is not None and self.last_found[0] == key:
+            return self.last_found[1]
+        return self.get_records([key])[key][0]
+
+    def set(
+        self, key: str, value: Path | InputFile | list[Path] | list[InputFile]
+    ) -> None:
+        compute_start = self.compute_start.pop(key, None)
+        compute_time = (
+            time.perf_counter() - compute_start if compute_start is not None else 0.0
+        )
+        get_cache_stats(self.name).compute_time += compute_time
 
-    def get(self, key: bytes) -> Any:
-        return self.db.get(key)
+        stats = []
+        for file in self.get_files(value):
+            stat = os.stat(file)
+            stats.append((stat.st_size, stat.st_mtime_ns))
 
-    def set(self, key: bytes, value: Path | list[Path]) -> None:
-        self.db.set(key, value)
+        # the memoized value of `has_key` is outdated once the key is overwritten
+        if self.last_found is not None and self.last_found[0] == key:
+            self.last_found = None
+
+        if _deferred_cache_writes is not None:
+            _deferred_cache_writes.writes.append(
+                (self.db.dbfile, key, self.db.ser((value, stats, compute_time)))
+            )
+        else:
+            self.db.set(key, (value, stats, compute_time))
+
+    def clear(self) -> None:
+        """Remove all entries of the cache"""
+        self.db.dbconn.clear()
+        self.last_found = None
+        self.compute_start.clear()
 
     def __reduce__(self) -> str | tuple[Any, ...]:
         return (
             FileSqliteBackend,
-            (self.db.dbfile, self.multi_files, self.db.compression),
+            (
+                self.db.dbfile,
+                self.multi_files,
+                self.db.compression,
+                self.verbose,
+                self.name,
+            ),
         )
 
 
+def get_cache_keyfn(
+    func: Callable,
+    cache_args: Optional[list[str]] = None,
+    cache_ser_args: Optional[dict[str, ArgSer]] = None,
+) -> Callable[..., str]:
+    """Create a function that computes the same cache key as `libactor.cache.cache` for
+    a cached method (without `self`), so that callers can look up the cache in bulk (e.g., in the parent
+    process before dispatching jobs) without invoking the method.
+
+    Args:
+        func: the cached method
+        cache_args: the same `cache_args` passed to the cache decorator
+        cache_ser_args: the same `cache_ser_args` passed to the cache decorator
+    """
+    helper = CacheArgsHelper.from_func(
+        inspect.unwrap(func),
+        cache_ser_args=dict(cache_ser_args) if cache_ser_args is not None else None,
+    )
+    if cache_args is not None:
+        helper.keep_args(cache_args)
+
+    def keyfn(*args, **kwargs) -> str:
+        return orjson_dumps(helper.get_method_args(None, *args, **kwargs)).decode()
+
+    return keyfn
+
+
+@dataclass
+class DeferredCacheWrites:
+    """Cache entries and counters of cache layers collected by a job (see `defer_cache_writes`)"""
+
+    writes: list[CacheWrite] = field(default_factory=list)
+    stats: dict[str, CacheStats] = field(default_factory=dict)
+
+
+@contextmanager
+def defer_cache_writes():
+    """Collect new entries of FileSqliteBackend caches in the current process instead of writing them
+    to the databases. This is used in parallel workers, which return the collected entries to the parent
+    process so that only the parent writes to the databases (using `CacheWriter`), avoiding lock contention
+    between workers. The cache semantics stay the same: a worker still reads the databases and sees the
+    entries it has written itself. The counters of cache layers (see `get_cache_stats`) are collected
+    as well and merged into the counters of the parent process by `CacheWriter`.
+
+    Example:
+        >>> def job(...):
+        ...     with defer_cache_writes() as writes:
+        ...         output = Fn.get_instance(workdir).invoke(...)
+        ...     return output, writes
+    """
+    global _deferred_cache_writes
+    assert _deferred_cache_writes is None, "Nested defer_cache_writes is not supported"
+    _deferred_cache_writes = DeferredCacheWrites()
+    try:
+        yield _deferred_cache_writes
+    finally:
+        _deferred_cache_writes = None
+
+
+def write_cache_entry(db: SqliteDict, key: str, value: Any):
+    """Write an entry to a database, or collect it so that it is written by the parent process when the
+    writes are deferred (see `defer_cache_writes`)"""
+    if _deferred_cache_writes is not None:
+        _deferred_cache_writes.writes.append((db.dbfile, key, db.ser_value(value)))
+    else:
+        db[key] = value
+
+
+class CacheWriter:
+    """Write cache entries collected by workers (see `defer_cache_writes`) to the databases in batches,
+    each batch is written in a single transaction per database.
+
+    Use it as a context manager to make sure the remaining entries are written when the loop exits,
+    even if a job fails, so that the results of finished jobs are not lost.
+    """
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self.writes: list[CacheWrite] = []
+        self.dbs: dict[Path, SqliteDict] = {}
+
+    def add(self, deferred: DeferredCacheWrites):
+        for name, stats in deferred.stats.items():
+            get_cache_stats(name).merge(stats)
+        self.writes.extend(deferred.writes)
+        if len(self.writes) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        groups: dict[Path, list[tuple[str, bytes]]] = {}
+        for dbfile, key, value in self.writes:
+            groups.setdefault(dbfile, []).append((key, value))
+        for dbfile, items in groups.items():
+            if dbfile not in self.dbs:
+                self.dbs[dbfile] = SqliteDict(
+                    dbfile,
+                    keytype=SqliteDictFieldType.bytes,
+                    ser_value=identity,
+                    deser_value=identity,
+                    timeout=30,
+                )
+            self.dbs[dbfile].batch_insert(items)
+        self.writes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
 @contextmanager
 def logger_helper(alogger, verbose: int, extra_msg: str = ""):
     nprocess = 0
@@ -420,3 +966,152 @@ def get_parallel_executor(
 
 def typed_delayed(func: CB) -> CB:
     return delayed(func)  # type: ignore
+
+
+class SchedulingArgs(TypedDict):
+    # maximum estimated memory (in bytes) of the jobs dispatched at the same time, a job larger than
+    # the budget is executed alone. Default is no limit
+    memory_budget: NotRequired[int]
+    # the estimated memory of a job is the size of its inputs multiplied by this factor, default is 10
+    memory_factor: NotRequired[float]
+    # restart the workers after a worker has executed this number of jobs
+    max_tasks_per_worker: NotRequired[int]
+    # restart the workers after the memory (RSS, in bytes) of a worker exceeds this size after a job
+    max_worker_rss: NotRequired[int]
+
+
+class JobScheduler:
+    """Execute jobs in a pool of worker processes. Unlike `Parallel`, which dispatches jobs in the given order,
+    the largest jobs are dispatched first so that a large job does not run alone at the end, and jobs are only
+    dispatched while the estimated memory of the dispatched jobs is within the memory budget.
+
+    When a worker has executed `max_tasks_per_worker` jobs or its memory exceeds `max_worker_rss`, the scheduler
+    stops dispatching, waits for the dispatched jobs, and restarts the workers to release the memory they hold
+    (e.g., programs cached in the workers).
+    """
+
+    def __init__(
+        self,
+        args: Optional[SchedulingArgs] = None,
+        initializer: Optional[Callable] = None,
+        initargs: tuple = (),
+    ):
+        args = args or {}
+        self.memory_budget = args.get("memory_budget")
+        self.memory_factor = args.get("memory_factor", 10.0)
+        self.max_tasks_per_worker = args.get("max_tasks_per_worker")
+        self.max_worker_rss = args.get("max_worker_rss")
+        self.n_workers = cpu_count()
+        self.initializer = initializer
+        self.initargs = initargs
+
+        # number of jobs executed by each worker (keyed by pid) since the workers were started
+        self.worker_tasks: dict[int, int] = {}
+        # whether the workers should be restarted before dispatching the next job
+        self.need_restart = False
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        """Get the workers of this scheduler, started with its initializer. Each scheduler has its own workers
+        instead of loky's reusable executor, which is shared with `Parallel` and restarted whenever it is
+        requested with a different initializer."""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.n_workers,
+                timeout=300,
+                initializer=self.initializer,
+                initargs=self.initargs,
+            )
+        return self.executor
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers, new workers are started when the next jobs are dispatched"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, kill_workers=not wait)
+            self.executor = None
+        self.worker_tasks = {}
+        self.need_restart = False
+
+    def map_unordered(
+        self,
+        fn: Callable[..., T],
+        jobs: Sequence[tuple],
+        sizes: Sequence[int],
+    ) -> Iterator[T]:
+        """Execute `fn(*job)` for each job, yielding the results in the order they are completed.
+
+        Args:
+            fn: the function to execute, it must be picklable
+            jobs: arguments of each job
+            sizes: size (in bytes) of the inputs of each job, which is used to order and estimate the memory of the jobs
+        """
+        assert len(jobs) == len(sizes)
+        order = sorted(range(len(jobs)), key=lambda i: sizes[i], reverse=True)
+        executor = self.get_executor()
+        # estimated memory of the dispatched jobs
+        dispatched: dict[Future, int] = {}
+        dispatched_memory = 0
+        next_job = 0
+
+        try:
+            while next_job < len(order) or len(dispatched) > 0:
+                if self.need_restart and len(dispatched) == 0:
+                    self.shutdown()
+                    executor = self.get_executor()
+
+                # keep a few jobs in the queue so the workers do not wait for the next job
+                while (
+                    next_job < len(order)
+                    and not self.need_restart
+                    and len(dispatched) < 2 * self.n_workers
+                ):
+                    i = order[next_job]
+                    memory = int(sizes[i] * self.memory_factor)
+                    if (
+                        self.memory_budget is not None
+                        and len(dispatched) > 0
+                        and dispatched_memory + memory > self.memory_budget
+                    ):
+                        break
+                    dispatched[executor.submit(run_scheduled_job, fn, jobs[i])] = memory
+                    dispatched_memory += memory
+                    next_job += 1
+
+                if len(dispatched) == 0:
+                    continue
+
+                done, _ = wait(dispatched, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dispatched_memory -= dispatched.pop(future)
+                    result, pid, rss = future.result()
+                    self.worker_tasks[pid] = self.worker_tasks.get(pid, 0) + 1
+                    if (
+                        self.max_tasks_per_worker is not None
+                        and self.worker_tasks[pid] >= self.max_tasks_per_worker
+                    ) or (
+                        self.max_worker_rss is not None and rss > self.max_worker_rss
+                    ):
+                        self.need_restart = True
+                    yield result
+        except BaseException:
+            # a worker has crashed or the results are not consumed, stop the workers so the next jobs
+            # are not dispatched to a broken executor or queued behind the abandoned jobs
+            self.shutdown(wait=False)
+            raise
+
+
+def run_scheduled_job(fn: Callable[..., T], args: tuple) -> tuple[T, int, int]:
+    """Execute a job of `JobScheduler` in a worker, returning the result, the pid and the memory (RSS) of the worker"""
+    return fn(*args), os.getpid(), get_rss()
+
+
+def get_rss() -> int:
+    """Get the current memory (RSS, in bytes) of this process"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # not Linux, use the peak memory instead (ru_maxrss is in bytes on macOS)
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
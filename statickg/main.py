@@ -2,12 +2,13 @@ from __future__ import annotations
 
 import importlib
 import sys
+import time
 from pathlib import Path
 
 import serde.json
 from loguru import logger
 
-from statickg.helper import import_attr, json_ser
+from statickg.helper import collect_cache_stats, import_attr, json_ser
 from statickg.models.prelude import (
     BaseType,
     ETLConfig,
@@ -39,6 +40,9 @@ class ETLPipelineRunner:
                 self.services,
             )
 
+        # the profile of the last run: the duration and cache counters of each task
+        self.profile: list[dict] = []
+
         self.logger = logger.bind(name="statickg")
         self.logger.add(
             workdir / "logs/{time}.log",
@@ -73,12 +77,42 @@ class ETLPipelineRunner:
 
     def __call__(self):
         output = ETLOutput()
+        self.profile = []
+        collect_cache_stats(reset=True)
         for task in self.etl.pipeline:
+            start = time.time()
             output.track(
                 self.etl.services[task.service].classpath,
                 task.args,
                 self.services[task.service](self.repo, task.args, output),
             )
+            self.profile.append(
+                {
+                    "service": task.service,
+                    "time": time.time() - start,
+                    "caches": {
+                        name: stats.to_dict()
+                        for name, stats in collect_cache_stats(reset=True).items()
+                    },
+                }
+            )
+        self.report_profile()
+
+    def report_profile(self):
+        """Log the profile of the last run and save it to `logs/profile.json` in the working directory"""
+        for task in self.profile:
+            self.logger.info("Task {} took {:.2f}s", task["service"], task["time"])
+            for name, stats in task["caches"].items():
+                self.logger.info(
+                    "    cache {}: {} hits, misses {}, lookup {:.2f}s, compute {:.2f}s, saved {:.2f}s",
+                    name,
+                    stats["hits"],
+                    stats["misses"],
+                    stats["lookup_time"],
+                    stats["compute_time"],
+                    stats["saved_time"],
+                )
+        serde.json.ser(self.profile, self.workdir / "logs" / "profile.json", indent=2)
 
     def prepare_work_dir(self):
         """Prepare the working directory for the ETL process"""
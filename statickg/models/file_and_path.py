@@ -5,7 +5,7 @@ from dataclasses import dataclass
 from enum import Enum
 from functools import cached_property
 from pathlib import Path
-from typing import TypeAlias, TypedDict, Union
+from typing import Literal, NotRequired, TypeAlias, TypedDict, Union
 
 from pydantic import BaseModel
 
@@ -53,6 +53,12 @@ class FormatOutputPath(TypedDict):
     format: str
 
 
+class CompressionArgs(TypedDict):
+    format: Literal["gzip", "zstd"]
+    # compression level, default is 6 for gzip and 3 for zstd
+    level: NotRequired[int]
+
+
 class FormatOutputPathModel(BaseModel):
     outdir: Path
     outfile_fmt: str
@@ -85,11 +91,14 @@ class FormatOutputPathModel(BaseModel):
 class ProcessStatus:
     key: str
     is_success: bool
+    # time (in seconds) spent in the process, used to estimate the time saved by the cache
+    compute_time: float = 0.0
 
     def to_dict(self):
         return {
             "key": self.key,
             "is_success": self.is_success,
+            "compute_time": self.compute_time,
         }
 
     @classmethod
@@ -97,9 +106,29 @@ class ProcessStatus:
         return cls(
             key=data["key"],
             is_success=data["is_success"],
+            compute_time=data.get("compute_time", 0.0),
         )
 
 
+@dataclass
+class ManifestEntry:
+    """An output file of a service recorded in its output manifest (see `OutputManifest`)"""
+
+    # ident of the input that the file is generated from
+    input: str
+    # key of the content of the file, e.g., its sha256 or the key of the process that generates it
+    key: str
+    # size of the file in bytes
+    size: int
+
+    def to_dict(self):
+        return {"input": self.input, "key": self.key, "size": self.size}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(input=data["input"], key=data["key"], size=data["size"])
+
+
 @dataclass
 class RelPath:
     basetype: BaseType
@@ -2,6 +2,7 @@ from statickg.models.etl import ETLConfig, ETLOutput, ETLTask, Service
 from statickg.models.file_and_path import (
     BaseType,
     InputFile,
+    ManifestEntry,
     ProcessStatus,
     RelPath,
     RelPathRefStr,
@@ -15,6 +16,7 @@ __all__ = [
     "ETLOutput",
     "Service",
     "InputFile",
+    "ManifestEntry",
     "ProcessStatus",
     "Repository",
     "GitRepository",
@@ -1,13 +1,20 @@
 from __future__ import annotations
 
-from typing import TypedDict
+from pathlib import Path
+from typing import NotRequired, Optional, TypedDict
 
+from statickg.helper import get_compression_ext, open_file, strip_compression_ext
 from statickg.models.etl import ETLOutput
-from statickg.models.file_and_path import RelPath
+from statickg.models.file_and_path import CompressionArgs, RelPath
 from statickg.models.repository import Repository
 from statickg.services.interface import BaseFileService
 
 
+class ConcatTTLServiceConstructArgs(TypedDict):
+    # compress the output (the compression extension is appended to the output file if it does not have it)
+    compression: NotRequired[CompressionArgs]
+
+
 class ConcatTTLServiceInvokeArgs(TypedDict):
     input: RelPath | list[RelPath]
     output: RelPath
@@ -15,6 +22,12 @@ class ConcatTTLServiceInvokeArgs(TypedDict):
 
 
 class ConcatTTLService(BaseFileService[ConcatTTLServiceInvokeArgs]):
+    """Concatenate RDF files (which can be compressed, e.g., data.ttl.gz) into a single file.
+
+    The format of the output file is determined by its extension: Turtle (.ttl) files are merged
+    by moving their prefixes to the top, N-Triples (.nt) and N-Quads (.nq) files are line-based
+    so they are concatenated as streams of bytes.
+    """
 
     def forward(
         self, repo: Repository, args: ConcatTTLServiceInvokeArgs, tracker: ETLOutput
@@ -27,13 +40,31 @@ class ConcatTTLService(BaseFileService[ConcatTTLServiceInvokeArgs]):
             compute_missing_file_key=False,
         )
 
+        compression: CompressionArgs | None = self.args.get("compression")
         outfile = args["output"].get_path()
+        if not outfile.name.endswith(get_compression_ext(compression)):
+            outfile = outfile.parent / (outfile.name + get_compression_ext(compression))
         outfile.parent.mkdir(parents=True, exist_ok=True)
+        compression_level = (
+            compression.get("level") if compression is not None else None
+        )
+
+        format = strip_compression_ext(outfile).suffix
+        for infile in infiles:
+            assert (
+                strip_compression_ext(infile.path).suffix == format
+            ), f"Cannot concatenate {infile.path} into {outfile} as they have different formats"
+
+        if format in (".nt", ".nq"):
+            self.concat_lines(
+                [infile.path for infile in infiles], outfile, compression_level
+            )
+            return
 
         prefixes = set()
         lines = []
         for infile in infiles:
-            with open(infile.path, "r") as f:
+            with open_file(infile.path, "rt") as f:
                 for line in f:
                     if line.startswith("@prefix"):
                         prefixes.add(line.strip())
@@ -41,8 +72,22 @@ class ConcatTTLService(BaseFileService[ConcatTTLServiceInvokeArgs]):
                         lines.append(line)
             lines.append("\n")
 
-        with open(outfile, "w") as f:
+        with open_file(outfile, "wt", compression_level) as f:
             for prefix in prefixes:
                 f.write(prefix + "\n")
             for line in lines:
                 f.write(line)
+
+    def concat_lines(
+        self, infiles: list[Path], outfile: Path, compression_level: Optional[int]
+    ):
+        """Concatenate line-based files, making sure that each file ends with a new line"""
+        with open_file(outfile, "wb", compression_level) as f:
+            for infile in infiles:
+                last = b""
+                with open_file(infile, "rb") as g:
+                    while chunk := g.read(1 << 20):
+                        f.write(chunk)
+                        last = chunk[-1:]
+                if last not in (b"", b"\n"):
+                    f.write(b"\n")
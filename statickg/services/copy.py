@@ -2,15 +2,28 @@ from __future__ import annotations
 
 import shutil
 from pathlib import Path
-from typing import TypedDict
+from typing import Mapping, NotRequired, Optional, TypedDict
 
 from libactor.cache import cache
 from tqdm import tqdm
 
-from statickg.helper import FileSqliteBackend, logger_helper, remove_deleted_files
-from statickg.models.file_and_path import InputFile
+from statickg.helper import (
+    FileSqliteBackend,
+    OutputManifest,
+    get_cache_keyfn,
+    logger_helper,
+)
+from statickg.models.file_and_path import InputFile, ManifestEntry
 from statickg.models.prelude import ETLOutput, RelPath, Repository
-from statickg.services.interface import BaseFileService
+from statickg.services.interface import BaseFileService, BaseService
+from statickg.store import ContentStore
+
+
+class CopyServiceConstructArgs(TypedDict):
+    # link files with identical content from a content store instead of copying them
+    content_store: NotRequired[bool]
+    # URL of a remote store (a directory or a HTTP blob server) shared between nodes
+    remote_cache: NotRequired[str]
 
 
 class CopyServiceInvokeArgs(TypedDict):
@@ -21,6 +34,16 @@ class CopyServiceInvokeArgs(TypedDict):
 
 class CopyService(BaseFileService[CopyServiceInvokeArgs]):
 
+    def __init__(
+        self,
+        name: str,
+        workdir: Path,
+        args: CopyServiceConstructArgs,
+        services: Mapping[str, BaseService],
+    ):
+        super().__init__(name, workdir, args, services)
+        self.store = ContentStore.from_args(workdir, args)
+
     def forward(
         self,
         repo: Repository,
@@ -37,36 +60,81 @@ class CopyService(BaseFileService[CopyServiceInvokeArgs]):
         outdir = args["output"].get_path()
         outdir.mkdir(parents=True, exist_ok=True)
 
-        # detect and remove deleted files
-        remove_deleted_files({file.path.name for file in infiles}, args["output"])
+        # filter out the files that have been copied before in bulk
+        copy_fn = CopyFn.get_instance(self.workdir, self.store)
+        jobs = [(infile, outdir / infile.path.name) for infile in infiles]
+        found = copy_fn.get_invoke_cache().has_keys(
+            [copy_fn.get_invoke_key(infile, outfile) for infile, outfile in jobs],
+            count_misses=False,
+        )
+        jobs = [job for job, is_found in zip(jobs, found) if not is_found]
 
         # now loop through the input files and copy them
-        copy_fn = CopyFn.get_instance(self.workdir).invoke
-        for infile in tqdm(
-            infiles,
+        for infile, outfile in tqdm(
+            jobs,
             desc=f"Copying files {self.get_readable_patterns(args['input'])}",
         ):
-            copy_fn(infile, outdir / infile.path.name)
+            copy_fn.invoke(infile, outfile)
+
+        # detect and remove deleted files, the copies have the same content as the inputs
+        OutputManifest(self.workdir, outdir).update(
+            {
+                infile.path.name: ManifestEntry(
+                    input=infile.get_ident(),
+                    key=infile.key,
+                    size=(outdir / infile.path.name).stat().st_size,
+                )
+                for infile in infiles
+            },
+            ["*"],
+        )
+
+
+INVOKE_CACHE_SER_ARGS = {
+    "infile": lambda x: x.get_ident(),
+}
 
 
 class CopyFn:
     instances = {}
 
-    def __init__(self, workdir: Path):
+    def __init__(self, workdir: Path, store: Optional[ContentStore] = None):
         self.workdir = workdir
+        self.store = store
+        self.get_invoke_key = get_cache_keyfn(
+            CopyFn.invoke, cache_ser_args=INVOKE_CACHE_SER_ARGS
+        )
 
     @staticmethod
-    def get_instance(workdir: Path):
-        if workdir not in CopyFn.instances:
-            CopyFn.instances[workdir] = CopyFn(workdir)
-        return CopyFn.instances[workdir]
+    def get_instance(workdir: Path, store: Optional[ContentStore] = None):
+        key = (workdir, store is not None)
+        if key not in CopyFn.instances:
+            CopyFn.instances[key] = CopyFn(workdir, store)
+        return CopyFn.instances[key]
+
+    def get_invoke_cache(self) -> FileSqliteBackend:
+        """Get a backend reading the same cache as the `invoke` method"""
+        return FileSqliteBackend(
+            FileSqliteBackend.get_dbfile(self.workdir, CopyFn.invoke)
+        )
 
     @cache(
         backend=FileSqliteBackend.factory(),
-        cache_ser_args={
-            "infile": lambda x: x.get_ident(),
-        },
+        cache_ser_args=INVOKE_CACHE_SER_ARGS,
     )
     def invoke(self, infile: InputFile, outfile: Path):
+        # files without content keys (not computed) cannot be looked up in the content store
+        store_key = None
+        if self.store is not None and infile.key != "":
+            store_key = self.store.get_key("copy", infile.key)
+            if self.store.materialize(store_key, {"output": outfile}):
+                return outfile
+
+        # the output file may be a hardlink of a content store entry, remove it instead of overwriting it
+        outfile.unlink(missing_ok=True)
         shutil.copy(infile.path, outfile)
+
+        if store_key is not None:
+            assert self.store is not None
+            self.store.put(store_key, {"output": outfile})
         return outfile
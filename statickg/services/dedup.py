@@ -0,0 +1,318 @@
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+from typing import Iterable, Literal, Mapping, NotRequired, Optional, TypedDict
+
+from libactor.cache import cache
+from tqdm import tqdm
+
+from statickg.helper import (
+    COMPRESSION_EXTENSIONS,
+    CacheWriter,
+    DeferredCacheWrites,
+    FileSqliteBackend,
+    JobScheduler,
+    OutputManifest,
+    SchedulingArgs,
+    defer_cache_writes,
+    get_cache_keyfn,
+)
+from statickg.models.file_and_path import FormatOutputPath
+from statickg.models.prelude import ETLOutput, InputFile, ManifestEntry, RelPath
+from statickg.models.repository import Repository
+from statickg.services.filter import get_key_fn
+from statickg.services.interface import BaseService
+from statickg.services.split import (
+    SplitOutput,
+    get_split_output,
+    read_file,
+    write_file,
+)
+from statickg.services.split_pack import copy_bucket, get_bucket_path, get_bucket_size
+
+
+class HashDedupServiceConstructArgs(TypedDict):
+    verbose: NotRequired[int]
+    parallel: NotRequired[bool]
+    # order of jobs, memory budget & recycling of the workers (see `JobScheduler`)
+    scheduling: NotRequired[SchedulingArgs]
+
+
+class HashDedupServiceInvokeArgs(TypedDict):
+    # the key of the records, it must be the key that the records are split by so that records with
+    # the same key are in the same bucket
+    key_prop: str | list[str]
+    # output of the split (or of another partitioned service, e.g., HashJoinService) whose records are deduplicated
+    input: RelPath
+    # the output file of each file of a bucket, the format can use {bucket} (the bucket of the file, which is
+    # its directory relative to the split output), {fileparent}, {filegrandparent}, {filestem} and {fileext}.
+    # if it is a path, the format is "{bucket}/{filestem}.{fileext}" (the same layout as the split output)
+    output: RelPath | FormatOutputPath
+    # which record of a key is kept: "first" (default) or "last" in the order of files (by path) and of records
+    # in each file, or in the order of the `order_by` field if it is given
+    keep: NotRequired[Literal["first", "last"]]
+    # field to order the records of a key by, e.g., keep the last modified record with keep="last"
+    order_by: NotRequired[str]
+
+
+DEDUP_CACHE_ARGS = [
+    "bucket",
+    "outdir",
+    "outdir_fmt",
+    "key_prop",
+    "keep",
+    "order_by",
+    "files",
+]
+DEDUP_CACHE_SER_ARGS = {
+    "outdir": lambda x: x.get_ident(),
+    "key_prop": lambda x: x,
+    "files": lambda files: [file.get_ident() for file in files],
+}
+
+
+class HashDedupService(BaseService[HashDedupServiceInvokeArgs]):
+    """A service that keeps one record per key in the buckets of a split. As records with the same key are
+    in the same bucket, each bucket is deduplicated independently (in parallel) and the outputs of
+    each bucket are cached.
+
+    A record is kept in the output file of the file that contains it, files whose records are all removed
+    do not have output files. The output is a mapping from a bucket to its output files, like the output of
+    `HashSplitService`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        workdir: Path,
+        args: HashDedupServiceConstructArgs,
+        services: Mapping[str, BaseService],
+    ):
+        self.name = name
+        self.workdir = workdir
+        self.services = services
+        self.verbose = args.get("verbose", 1)
+        self.parallel = args.get("parallel", True)
+        self.scheduler = JobScheduler(args.get("scheduling"))
+        self.get_dedup_key = get_cache_keyfn(
+            DedupFn.dedup,
+            cache_args=DEDUP_CACHE_ARGS,
+            cache_ser_args=DEDUP_CACHE_SER_ARGS,
+        )
+
+    def forward(
+        self, repo: Repository, args: HashDedupServiceInvokeArgs, tracker: ETLOutput
+    ) -> dict[str, list[InputFile]]:
+        key_prop = args["key_prop"]
+        keep = args.get("keep", "first")
+        order_by = args.get("order_by")
+        assert keep in ("first", "last"), keep
+        input_output = get_split_output(tracker, args["input"])
+
+        args_output = args["output"]
+        if isinstance(args_output, RelPath):
+            outdir_base = args_output
+            outdir_fmt = "{bucket}/{filestem}.{fileext}"
+        else:
+            outdir_base = args_output["base"]
+            outdir_fmt = args_output["format"]
+        outdir_path = outdir_base.get_path()
+        outdir_path.mkdir(parents=True, exist_ok=True)
+
+        # files are deduplicated in the order of their paths
+        buckets = [
+            (bucket, sorted(files, key=get_bucket_path))
+            for bucket, files in input_output.items()
+        ]
+
+        # resolve the cache hits of all buckets first, so only buckets that are changed are read
+        dedup_cache = FileSqliteBackend(
+            FileSqliteBackend.get_dbfile(self.workdir, DedupFn.dedup),
+            multi_files=True,
+        )
+        cache_keys = [
+            self.get_dedup_key(
+                bucket, outdir_base, outdir_fmt, key_prop, keep, order_by, files
+            )
+            for bucket, files in buckets
+        ]
+        found = dedup_cache.has_keys(cache_keys, count_misses=False)
+        records = dedup_cache.get_records(
+            [key for key, is_found in zip(cache_keys, found) if is_found]
+        )
+
+        output: dict[str, list[InputFile]] = {}
+        jobs = []
+        for (bucket, files), key, is_found in zip(buckets, cache_keys, found):
+            if is_found:
+                output[bucket] = records[key][0]
+            else:
+                jobs.append((bucket, files))
+
+        if self.parallel:
+            it: Iterable[tuple[str, list[InputFile], DeferredCacheWrites]] = (
+                self.scheduler.map_unordered(
+                    dedup_bucket,
+                    [
+                        (
+                            self.workdir,
+                            bucket,
+                            outdir_base,
+                            outdir_fmt,
+                            key_prop,
+                            keep,
+                            order_by,
+                            files,
+                        )
+                        for bucket, files in jobs
+                    ],
+                    [sum(get_bucket_size(file) for file in files) for _, files in jobs],
+                )
+            )
+        else:
+            it: Iterable[tuple[str, list[InputFile], DeferredCacheWrites]] = (
+                dedup_bucket(
+                    self.workdir,
+                    bucket,
+                    outdir_base,
+                    outdir_fmt,
+                    key_prop,
+                    keep,
+                    order_by,
+                    files,
+                )
+                for bucket, files in jobs
+            )
+
+        with CacheWriter() as cache_writer:
+            for bucket, outfiles, cache_writes in tqdm(
+                it, total=len(jobs), desc="Dedup files", disable=self.verbose != 1
+            ):
+                cache_writer.add(cache_writes)
+                output[bucket] = outfiles
+
+        # remove unknown files, the outputs of a bucket are generated from all files of the bucket
+        outfiles = {}
+        for bucket, bucket_outfiles in output.items():
+            for outfile in bucket_outfiles:
+                outfiles[str(outfile.path.relative_to(outdir_path))] = ManifestEntry(
+                    input=(args["input"] / bucket).get_ident(),
+                    key=outfile.key,
+                    size=outfile.path.stat().st_size,
+                )
+        OutputManifest(self.workdir, outdir_path).update(
+            outfiles,
+            [f"**/*.json{ext}" for ext in ["", *COMPRESSION_EXTENSIONS.values()]],
+        )
+
+        output = {bucket: outfiles for bucket, outfiles in output.items() if outfiles}
+        if isinstance(input_output, SplitOutput):
+            return input_output.with_buckets(output)
+        return output
+
+
+def dedup_bucket(
+    workdir: Path,
+    bucket: str,
+    outdir: RelPath,
+    outdir_fmt: str,
+    key_prop: str | list[str],
+    keep: Literal["first", "last"],
+    order_by: Optional[str],
+    files: list[InputFile],
+) -> tuple[str, list[InputFile], DeferredCacheWrites]:
+    with defer_cache_writes() as cache_writes:
+        outfiles = DedupFn.get_instance(workdir).dedup(
+            bucket, outdir, outdir_fmt, key_prop, keep, order_by, files
+        )
+    return bucket, outfiles, cache_writes
+
+
+class DedupFn:
+    instances = {}
+
+    def __init__(self, workdir: Path):
+        self.workdir = workdir
+
+    @staticmethod
+    def get_instance(workdir: Path):
+        if workdir not in DedupFn.instances:
+            DedupFn.instances[workdir] = DedupFn(workdir)
+        return DedupFn.instances[workdir]
+
+    @cache(
+        backend=FileSqliteBackend.factory(multi_files=True),
+        cache_args=DEDUP_CACHE_ARGS,
+        cache_ser_args=DEDUP_CACHE_SER_ARGS,  # type: ignore
+    )
+    def dedup(
+        self,
+        bucket: str,
+        outdir: RelPath,
+        outdir_fmt: str,
+        key_prop: str | list[str],
+        keep: str,
+        order_by: Optional[str],
+        files: list[InputFile],
+    ) -> list[InputFile]:
+        """Keep one record per key in the files of a bucket, returning the output files"""
+        get_key = get_key_fn(key_prop)
+        file_records = [read_file(file) for file in files]
+
+        # the kept record of each key: (order value, file index, record index)
+        kept: dict = {}
+        for i, records in enumerate(file_records):
+            for j, record in enumerate(records):
+                key = get_key(record)
+                value = record[order_by] if order_by is not None else None
+                if key not in kept:
+                    kept[key] = (value, i, j)
+                elif order_by is None:
+                    if keep == "last":
+                        kept[key] = (value, i, j)
+                elif (keep == "first" and value < kept[key][0]) or (
+                    keep == "last" and value >= kept[key][0]
+                ):
+                    kept[key] = (value, i, j)
+
+        kept_records: list[set[int]] = [set() for _ in files]
+        for _, i, j in kept.values():
+            kept_records[i].add(j)
+
+        outfiles = []
+        for file, records, kept_idx in zip(files, file_records, kept_records):
+            if len(kept_idx) == 0:
+                continue
+
+            path = get_bucket_path(file)
+            outfile_relpath = outdir / outdir_fmt.format(
+                bucket=bucket,
+                fileparent=path.parent.name,
+                filegrandparent=path.parent.parent.name,
+                filestem=path.name.split(".", 1)[0],
+                fileext=path.name.split(".", 1)[1],
+            )
+            outfile = outfile_relpath.get_path()
+            outfile.parent.mkdir(parents=True, exist_ok=True)
+            # the output file may be a hardlink of a content store entry, remove it instead of overwriting it
+            outfile.unlink(missing_ok=True)
+            if len(kept_idx) == len(records):
+                copy_bucket(file, outfile)
+            else:
+                write_file(
+                    [record for j, record in enumerate(records) if j in kept_idx],
+                    outfile,
+                )
+
+            with open(outfile, "rb") as f:
+                key = hashlib.file_digest(f, "sha256").hexdigest()
+            outfiles.append(
+                InputFile(
+                    basetype=outfile_relpath.basetype,
+                    key=key,
+                    relpath=outfile_relpath.relpath,
+                    path=outfile,
+                )
+            )
+        return outfiles
@@ -3,6 +3,7 @@ from __future__ import annotations
 import hashlib
 import importlib
 import sys
+import time
 from importlib.metadata import version
 from pathlib import Path
 from typing import Callable, Iterable, Mapping, NotRequired, TypeAlias, TypedDict, cast
@@ -11,15 +12,11 @@ from drepr.main import convert
 from joblib import Parallel, delayed
 from tqdm import tqdm
 
-from statickg.helper import (
-    import_func,
-    logger_helper,
-    remove_deleted_2nested_files,
-    remove_deleted_files,
-)
-from statickg.models.prelude import ETLOutput, RelPath, Repository
+from statickg.helper import OutputManifest, import_func, logger_helper
+from statickg.models.prelude import ETLOutput, ManifestEntry, RelPath, Repository
 from statickg.services.interface import BaseFileWithCacheService, BaseService
 from statickg.services.split import FormatOutputPath
+from statickg.store import ContentStore
 
 
 class DReprServiceConstructArgs(TypedDict):
@@ -27,6 +24,10 @@ class DReprServiceConstructArgs(TypedDict):
     format: str
     verbose: NotRequired[int]
     parallel: NotRequired[bool]
+    # reuse outputs of identical (program, input content) pairs regardless of the input paths
+    content_store: NotRequired[bool]
+    # URL of a remote store (a directory or a HTTP blob server) shared between nodes
+    remote_cache: NotRequired[str]
 
 
 class DReprServiceInvokeArgs(TypedDict):
@@ -36,7 +37,7 @@ class DReprServiceInvokeArgs(TypedDict):
     compute_missing_file_key: NotRequired[bool]
 
 
-FORWARD_EXEC_JOB_RETURN_TYPE: TypeAlias = tuple[str, str]
+FORWARD_EXEC_JOB_RETURN_TYPE: TypeAlias = tuple[str, str, float]
 
 
 class DReprService(BaseFileWithCacheService[DReprServiceConstructArgs]):
@@ -67,6 +68,7 @@ class DReprService(BaseFileWithCacheService[DReprServiceConstructArgs]):
         self.drepr_version = version("drepr-v2").strip()
         self.parallel = args.get("parallel", True)
         self.parallel_executor = Parallel(n_jobs=-1, return_as="generator_unordered")
+        self.store = ContentStore.from_args(workdir, args)
 
         if isinstance(args["path"], list):
             files = args["path"]
@@ -122,61 +124,11 @@ class DReprService(BaseFileWithCacheService[DReprServiceConstructArgs]):
         args_output = args["output"]
         if isinstance(args_output, RelPath):
             outdir = args_output.get_path()
-            outdir.mkdir(parents=True, exist_ok=True)
-
             outdir_filename_fmt = "{filestem}.{fileext}"
-
-            # detect and remove deleted files
-            remove_deleted_files(
-                {
-                    outdir_filename_fmt.format(
-                        fileparent=infile.path.parent.name,
-                        filegrandparent=infile.path.parent.parent.name,
-                        filestem=infile.path.stem,
-                        fileext=self.extension,
-                    )
-                    for infile in infiles
-                },
-                args_output,
-            )
         else:
             outdir = args_output["base"].get_path()
-            outdir.mkdir(parents=True, exist_ok=True)
-
             outdir_filename_fmt = args_output["format"]
-            # detect and remove deleted files
-            # only support two levels
-            n_levels = outdir_filename_fmt.count("/")
-            if n_levels == 0:
-                remove_deleted_files(
-                    {
-                        outdir_filename_fmt.format(
-                            fileparent=infile.path.parent.name,
-                            filegrandparent=infile.path.parent.parent.name,
-                            filestem=infile.path.stem,
-                            fileext=self.extension,
-                        )
-                        for infile in infiles
-                    },
-                    args_output["base"],
-                )
-            elif n_levels == 1:
-                remove_deleted_2nested_files(
-                    {
-                        outdir_filename_fmt.format(
-                            fileparent=infile.path.parent.name,
-                            filegrandparent=infile.path.parent.parent.name,
-                            filestem=infile.path.stem,
-                            fileext=self.extension,
-                        )
-                        for infile in infiles
-                    },
-                    outdir,
-                )
-            else:
-                raise ValueError(
-                    "Only support two levels of nested folders. Get {}", n_levels
-                )
+        outdir.mkdir(parents=True, exist_ok=True)
 
         if len(self.programs) == 1:
             first_proram = next(iter(self.programs.values()))
@@ -211,12 +163,20 @@ class DReprService(BaseFileWithCacheService[DReprServiceConstructArgs]):
                         programkey, program = self.programs[infile.path.stem]
 
                     infile_ident = infile.get_path_ident()
+                    # files without content keys (not computed) cannot be looked up in the content store
+                    store = self.store if infile.key != "" else None
                     with self.cache.auto(
                         filepath=infile_ident,
                         key=programkey + ":" + infile.key,
                         outfile=outfile,
                     ) as notfound:
-                        if notfound:
+                        if notfound and (
+                            store is None
+                            or not store.materialize(
+                                store.get_key(programkey + ":" + infile.key),
+                                {"output": outfile},
+                            )
+                        ):
                             try:
                                 output = program(infile.path)
                             except:
@@ -224,7 +184,14 @@ class DReprService(BaseFileWithCacheService[DReprServiceConstructArgs]):
                                     "Error when processing {}", infile_ident
                                 )
                                 raise
+                            # the output file may be a hardlink of a content store entry
+                            outfile.unlink(missing_ok=True)
                             outfile.write_text(output)
+                            if store is not None:
+                                store.put(
+                                    store.get_key(programkey + ":" + infile.key),
+                                    {"output": outfile},
+                                )
 
                         log(notfound, infile_ident)
             else:
@@ -251,40 +218,80 @@ class DReprService(BaseFileWithCacheService[DReprServiceConstructArgs]):
                         log(False, infile_ident)
                         continue
 
+                    # files without content keys (not computed) cannot be looked up in the content store
+                    store = self.store if infile.key != "" else None
                     jobs.append(
-                        (infile_ident, infile.path, outfile, program, cache_key)
+                        (infile_ident, infile.path, outfile, program, cache_key, store)
                     )
 
                 def exec_job(
-                    infile_ident, infile_path, cache_key, outfile, program
+                    infile_ident, infile_path, cache_key, outfile, program, store
                 ) -> FORWARD_EXEC_JOB_RETURN_TYPE:
+                    start = time.perf_counter()
+                    if store is not None and store.materialize(
+                        store.get_key(cache_key), {"output": outfile}
+                    ):
+                        return infile_ident, cache_key, time.perf_counter() - start
+
                     try:
                         output = program(infile_path)
                     except Exception as e:
                         raise Exception(f"Error when processing {infile_ident}") from e
 
+                    # the output file may be a hardlink of a content store entry
+                    outfile.unlink(missing_ok=True)
                     outfile.write_text(output)
-                    return infile_ident, cache_key
+                    if store is not None:
+                        store.put(store.get_key(cache_key), {"output": outfile})
+                    return infile_ident, cache_key, time.perf_counter() - start
 
                 # execute the jobs on parallel
                 it = self.parallel_executor(
                     delayed(exec_job)(
-                        infile_ident, infile_path, cache_key, outfile, program
+                        infile_ident,
+                        infile_path,
+                        cache_key,
+                        outfile,
+                        program,
+                        store,
                     )
-                    for infile_ident, infile_path, outfile, program, cache_key in jobs
+                    for infile_ident, infile_path, outfile, program, cache_key, store in jobs
                 )
                 assert it is not None
 
-                for infile_ident, cache_key in tqdm(
+                for infile_ident, cache_key, compute_time in tqdm(
                     cast(Iterable[FORWARD_EXEC_JOB_RETURN_TYPE], it),
                     total=len(jobs),
                     desc=readable_ptns,
                     disable=self.verbose != 1,
                 ):
                     # for infile_ident, infile_path, outfile, program, cache_key in jobs:
-                    self.cache.mark_compute_success(infile_ident, cache_key)
+                    self.cache.mark_compute_success(
+                        infile_ident, cache_key, compute_time
+                    )
                     log(True, infile_ident)
 
+        # detect and remove deleted files
+        outfiles = {}
+        for infile in infiles:
+            outfile = outdir_filename_fmt.format(
+                fileparent=infile.path.parent.name,
+                filegrandparent=infile.path.parent.parent.name,
+                filestem=infile.path.stem,
+                fileext=self.extension,
+            )
+            if len(self.programs) == 1:
+                assert first_proram is not None
+                programkey = first_proram[0]
+            else:
+                programkey = self.programs[infile.path.stem][0]
+            outfiles[str(Path(outfile))] = ManifestEntry(
+                input=infile.get_ident(),
+                key=programkey + ":" + infile.key,
+                size=(outdir / outfile).stat().st_size,
+            )
+        OutputManifest(self.workdir, outdir).update(outfiles)
+
     def setup(self, workdir: Path):
         pkgname = "gen_programs"
         pkgdir = workdir / pkgname
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import shutil
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+import orjson
+
+# size of blocks read when searching for the boundaries of chunks
+BLOCK_SIZE = 16 * 1024 * 1024
+
+
+@dataclass
+class InputChunk:
+    """A range of rows of an input file. The chunk is the bytes [start, end) of the file prefixed by the header,
+    or the whole file if end is None (the chunk has been written to its own file)."""
+
+    path: Path
+    start: int
+    end: Optional[int]
+    header: bytes = b""
+
+    @property
+    def size(self) -> int:
+        if self.end is None:
+            return self.path.stat().st_size
+        return len(self.header) + self.end - self.start
+
+    def materialize(self, outfile: Path) -> Path:
+        """Get a file containing the chunk, writing it to the given file if needed"""
+        if self.end is None:
+            return self.path
+
+        with open(self.path, "rb") as f, open(outfile, "wb") as g:
+            g.write(self.header)
+            f.seek(self.start)
+            remaining = self.end - self.start
+            while remaining > 0:
+                block = f.read(min(BLOCK_SIZE, remaining))
+                if len(block) == 0:
+                    break
+                g.write(block)
+                remaining -= len(block)
+        return outfile
+
+
+def split_file(
+    file: Path, chunk_bytes: int, tmpdir: Path, csv_header: bool = True
+) -> Optional[list[InputChunk]]:
+    """Split a row-oriented file (CSV or a JSON array) into chunks of about `chunk_bytes` bytes.
+    Rows are never split, a CSV row may contain line breaks in quoted values. Chunks that need their own
+    files (JSON arrays) are written to `tmpdir`.
+
+    Returns None if the file cannot be split (unsupported format or a single chunk).
+    """
+    ext = file.suffix.lower()
+    if ext == ".csv":
+        chunks = split_lines(file, chunk_bytes, quote=b'"', has_header=csv_header)
+    elif ext == ".json":
+        chunks = split_json_array(file, chunk_bytes, tmpdir)
+    else:
+        return None
+
+    if chunks is None or len(chunks) < 2:
+        return None
+    return chunks
+
+
+def split_lines(
+    file: Path,
+    chunk_bytes: int,
+    quote: Optional[bytes] = None,
+    has_header: bool = False,
+) -> list[InputChunk]:
+    """Split a file into chunks at line breaks. When `quote` is given, line breaks inside quoted values
+    are skipped: a line break ends a row only if the number of quotes before it is even (quotes in values
+    are escaped by doubling them)."""
+    size = file.stat().st_size
+    with open(file, "rb") as f:
+        boundaries = find_row_boundaries(f, size, chunk_bytes, quote, has_header)
+
+    if has_header:
+        if len(boundaries) == 0:
+            # the file only has the header
+            return []
+        header_end = boundaries.pop(0)
+        with open(file, "rb") as f:
+            header = f.read(header_end)
+    else:
+        header_end = 0
+        header = b""
+
+    starts = [header_end] + boundaries
+    ends = boundaries + [size]
+    return [
+        InputChunk(file, start, end, header)
+        for start, end in zip(starts, ends)
+        if end > start
+    ]
+
+
+def find_row_boundaries(
+    f: BinaryIO,
+    size: int,
+    chunk_bytes: int,
+    quote: Optional[bytes],
+    has_header: bool,
+) -> list[int]:
+    """Find the offsets right after the row breaks ending the header (if any) and each chunk"""
+    boundaries = []
+    # the next offset that a chunk should end at or after
+    target = 0 if has_header else chunk_bytes
+    # number of quotes before the current block modulo 2
+    parity = 0
+    offset = 0
+    while offset < size:
+        block = f.read(BLOCK_SIZE)
+        if len(block) == 0:
+            break
+
+        pos = max(target - offset, 0)
+        while pos < len(block):
+            idx = block.find(b"\n", pos)
+            if idx == -1:
+                break
+            if quote is not None and (parity + block.count(quote, 0, idx)) % 2 == 1:
+                # the line break is in a quoted value
+                pos = idx + 1
+                continue
+            boundaries.append(offset + idx + 1)
+            target = offset + idx + 1 + chunk_bytes
+            pos = max(target - offset, idx + 1)
+
+        if quote is not None:
+            parity = (parity + block.count(quote)) % 2
+        offset += len(block)
+    return boundaries
+
+
+def split_json_array(
+    file: Path, chunk_bytes: int, tmpdir: Path
+) -> Optional[list[InputChunk]]:
+    """Split a file containing a JSON array into files of smaller arrays. Unlike line-based formats, the
+    array is parsed to find its items, so this requires memory proportional to the file size.
+    """
+    with open(file, "rb") as f:
+        first = f.read(1024).lstrip()
+    if not first.startswith(b"["):
+        return None
+
+    items = orjson.loads(file.read_bytes())
+    size = file.stat().st_size
+    n_chunks = min(math.ceil(size / chunk_bytes), len(items))
+    if n_chunks < 2:
+        return None
+
+    chunk_size = math.ceil(len(items) / n_chunks)
+    tmpdir.mkdir(parents=True, exist_ok=True)
+    chunks = []
+    for i in range(0, len(items), chunk_size):
+        chunkfile = tmpdir / f"chunk-{len(chunks):05d}.json"
+        chunkfile.write_bytes(orjson.dumps(items[i : i + chunk_size]))
+        chunks.append(InputChunk(chunkfile, 0, None))
+    return chunks
+
+
+def read_csv_header(file: Path) -> bytes:
+    """Read the first row of a CSV file (including its line break)"""
+    with open(file, "rb") as f:
+        boundaries = find_row_boundaries(f, BLOCK_SIZE, BLOCK_SIZE, b'"', True)
+    if len(boundaries) == 0:
+        return b""
+    with open(file, "rb") as f:
+        return f.read(boundaries[0])
+
+
+@dataclass
+class FileDigest:
+    """The content hash of a file and of one of its prefixes, computed in a single pass (see `hash_file`)"""
+
+    # number of bytes that are hashed
+    size: int
+    # sha256 of the file
+    hash: str
+    # sha256 of the prefix
+    prefix_hash: str
+    # number of lines (rows unless values contain line breaks)
+    n_lines: int
+    # whether the file ends with a line break outside quoted values, i.e., appended data starts a new row
+    is_row_end: bool
+
+
+def hash_file(file: Path, prefix_size: int = 0) -> FileDigest:
+    """Hash a file and its first `prefix_size` bytes. Only the bytes present when the function starts are hashed,
+    so the digest describes a consistent snapshot of a file that is being appended."""
+    size = file.stat().st_size
+    hasher = hashlib.sha256()
+    prefix_hash = hasher.hexdigest() if prefix_size == 0 else ""
+    n_lines = 0
+    n_quotes = 0
+    last_byte = b""
+    offset = 0
+    with open(file, "rb") as f:
+        while offset < size:
+            block = f.read(min(BLOCK_SIZE, size - offset))
+            if len(block) == 0:
+                break
+            if offset < prefix_size <= offset + len(block):
+                hasher.update(block[: prefix_size - offset])
+                prefix_hash = hasher.copy().hexdigest()
+                hasher.update(block[prefix_size - offset :])
+            else:
+                hasher.update(block)
+            n_lines += block.count(b"\n")
+            n_quotes += block.count(b'"')
+            last_byte = block[-1:]
+            offset += len(block)
+
+    return FileDigest(
+        size=offset,
+        hash=hasher.hexdigest(),
+        prefix_hash=prefix_hash,
+        n_lines=n_lines,
+        is_row_end=last_byte == b"\n" and n_quotes % 2 == 0,
+    )
+
+
+def append_files(files: list[Path], outfile: Path):
+    """Append outputs of chunks to an existing output (see `merge_files`). If the output is a hardlink
+    (e.g., of a content store entry), it is copied first so that the other links are not modified.
+    """
+    if outfile.stat().st_nlink > 1:
+        tmpfile = outfile.with_name(f".{outfile.name}.{uuid.uuid4().hex}")
+        shutil.copyfile(outfile, tmpfile)
+        os.replace(tmpfile, outfile)
+    with open(outfile, "ab") as g:
+        for file in files:
+            with open(file, "rb") as f:
+                shutil.copyfileobj(f, g, BLOCK_SIZE)
+
+
+def merge_files(files: list[Path], outfile: Path):
+    """Concatenate outputs of chunks into a single output. Turtle documents can be concatenated as they
+    declare the same prefixes, and so are N-Triples/N-Quads, as well as gzip/zstd streams.
+    """
+    # the output file may be a hardlink of a content store entry, remove it instead of overwriting it
+    outfile.unlink(missing_ok=True)
+    with open(outfile, "wb") as g:
+        for file in files:
+            with open(file, "rb") as f:
+                shutil.copyfileobj(f, g, BLOCK_SIZE)
@@ -1,28 +1,106 @@
 from __future__ import annotations
 
+import hashlib
 import importlib
+import os
+import shutil
 import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass
 from importlib.metadata import version
 from pathlib import Path
-from typing import Callable, Iterable, Mapping, NotRequired, TypeAlias, TypedDict
+from typing import (
+    Callable,
+    Iterable,
+    Mapping,
+    NotRequired,
+    Optional,
+    TypeAlias,
+    TypedDict,
+)
 
+import orjson
 from drepr.main import convert
-from joblib import Parallel, delayed
+from hugedict.sqlite import SqliteDict
+from joblib import Parallel, cpu_count, delayed
 from libactor.cache import cache
 from tqdm import tqdm
 
-from statickg.helper import FileSqliteBackend, import_func
-from statickg.models.file_and_path import InputFile
+from statickg.helper import (
+    CacheWriter,
+    DeferredCacheWrites,
+    FileSqliteBackend,
+    JobScheduler,
+    OutputManifest,
+    SchedulingArgs,
+    defer_cache_writes,
+    get_cache_keyfn,
+    get_cache_stats,
+    get_compression_ext,
+    import_func,
+    open_file,
+)
+from statickg.models.file_and_path import CompressionArgs, InputFile, ManifestEntry
 from statickg.models.prelude import ETLOutput, RelPath, Repository
+from statickg.services.drepr_chunk import (
+    FileDigest,
+    InputChunk,
+    append_files,
+    hash_file,
+    merge_files,
+    read_csv_header,
+    split_file,
+)
+from statickg.services.drepr_writer import patch_program, stream_output
 from statickg.services.interface import BaseFileService, BaseService
 from statickg.services.split import FormatOutputPath
+from statickg.services.split_pack import is_pack, read_pack_index
+from statickg.store import ContentStore
 
 
 class DReprServiceConstructArgs(TypedDict):
     path: RelPath | list[RelPath]
+    # output format: turtle, ntriples, or nquads
     format: str
+    # IRI of the named graph of the outputs, required when the format is nquads
+    graph: NotRequired[str]
     verbose: NotRequired[int]
     parallel: NotRequired[bool]
+    # reuse outputs of identical (program, input content) pairs regardless of the input paths
+    content_store: NotRequired[bool]
+    # URL of a remote store (a directory or a HTTP blob server) shared between nodes
+    remote_cache: NotRequired[str]
+    # total size (in bytes) of input files processed in a single job, default is adaptive
+    # to the total size of the input files and the number of workers (see `get_batches`)
+    batch_bytes: NotRequired[int]
+    # write the output of the programs to the output files while extracting instead of
+    # keeping the whole output in memory, so the memory usage does not depend on the output size
+    streaming: NotRequired[bool]
+    # compress the outputs (the extension of the outputs is .ttl.gz, .ttl.zst, .nt.gz, etc.)
+    compression: NotRequired[CompressionArgs]
+    # directory storing generated programs shared between services and pipelines,
+    # default is $STATICKG_CACHE_DIR/drepr_programs (see `get_default_program_cache_dir`)
+    program_cache: NotRequired[str]
+    # split large input files into chunks of rows that are extracted in parallel (see `ChunkingArgs`)
+    chunking: NotRequired[ChunkingArgs]
+    # order of jobs, memory budget & recycling of the workers (see `JobScheduler`)
+    scheduling: NotRequired[SchedulingArgs]
+
+
+class ChunkingArgs(TypedDict):
+    # input files larger than this size (in bytes) are split into chunks of about this size, default is
+    # not splitting. only CSV and JSON array files are split, the outputs of chunks are concatenated
+    size: NotRequired[int]
+    # when rows are appended to a CSV file since its last extraction (the extracted part is unchanged),
+    # extract only the appended rows and append their output to the existing output
+    incremental: NotRequired[bool]
+    # whether the first row of CSV files is a header, which is repeated in every chunk
+    csv_header: NotRequired[bool]
+    # names (file stems) of models that must extract an input file as a whole, e.g., models that
+    # refer to rows by their positions or link records across rows
+    exclude: NotRequired[list[str]]
 
 
 class DReprServiceInvokeArgs(TypedDict):
@@ -32,7 +110,77 @@ class DReprServiceInvokeArgs(TypedDict):
     compute_missing_file_key: NotRequired[bool]
 
 
-FORWARD_EXEC_JOB_RETURN_TYPE: TypeAlias = tuple[str, str]
+# a job to extract a file: (program key, program path, input file, output file)
+DREPR_JOB: TypeAlias = tuple[str, str, InputFile, Path]
+# a job to extract a chunk of a file: (program key, program path, chunk, output file of the chunk)
+DREPR_CHUNK_JOB: TypeAlias = tuple[str, str, InputChunk, Path]
+# a job split into chunks: (job, chunk jobs, whether the outputs of chunks are appended to the existing output)
+DREPR_SPLIT_JOB: TypeAlias = tuple[DREPR_JOB, list[DREPR_CHUNK_JOB], bool]
+# (output files, cache writes, import time of programs imported by the worker since its last job)
+FORWARD_EXEC_JOB_RETURN_TYPE: TypeAlias = tuple[
+    list[Path], DeferredCacheWrites, dict[str, float]
+]
+
+EXEC_CACHE_SER_ARGS = {
+    "infile": lambda x: x.get_ident(),
+}
+
+# number of jobs per worker when the batch size is adaptive, more jobs balance the load
+# between workers better but have a higher dispatching overhead
+BATCHES_PER_WORKER = 4
+# minimum & maximum total size of input files in a job when the batch size is adaptive
+MIN_BATCH_BYTES = 256 * 1024
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+
+# generated programs imported in this process (see `get_program`)
+_programs: dict[str, Callable] = {}
+# import time of programs that have not been reported to the parent process yet
+_program_import_times: dict[str, float] = {}
+
+
+@dataclass
+class IncrementalState:
+    """The part of an input file that has been extracted to an output file"""
+
+    program_key: str
+    # number of bytes of the input file that have been extracted
+    size: int
+    # sha256 of the extracted bytes
+    prefix_hash: str
+    # number of lines that have been extracted
+    n_lines: int
+    # size of the output file after the extraction, to detect outputs modified by others
+    output_size: int
+
+    def can_append(self, digest: FileDigest, outfile: Path) -> bool:
+        """Check if the input file (described by its digest) only has rows appended since the extraction
+        and the output file has not been modified, so that only the appended rows need to be extracted
+        """
+        return (
+            digest.size > self.size
+            and digest.prefix_hash == self.prefix_hash
+            and outfile.exists()
+            and outfile.stat().st_size == self.output_size
+        )
+
+    def to_dict(self):
+        return {
+            "program_key": self.program_key,
+            "size": self.size,
+            "prefix_hash": self.prefix_hash,
+            "n_lines": self.n_lines,
+            "output_size": self.output_size,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            program_key=data["program_key"],
+            size=data["size"],
+            prefix_hash=data["prefix_hash"],
+            n_lines=data["n_lines"],
+            output_size=data["output_size"],
+        )
 
 
 class DReprService(BaseFileService[DReprServiceInvokeArgs]):
@@ -58,32 +206,73 @@ class DReprService(BaseFileService[DReprServiceInvokeArgs]):
 
         self.verbose = args.get("verbose", 1)
         self.format = args["format"]
-        assert self.format in {"turtle"}, self.format
-        self.extension = {"turtle": "ttl"}[self.format]
+        assert self.format in {"turtle", "ntriples", "nquads"}, self.format
+        self.graph = args.get("graph")
+        assert (
+            self.format != "nquads" or self.graph is not None
+        ), "The named graph is required to write N-Quads"
+        self.compression = args.get("compression")
+        self.extension = {"turtle": "ttl", "ntriples": "nt", "nquads": "nq"}[
+            self.format
+        ] + get_compression_ext(self.compression)
         self.drepr_version = version("drepr-v2").strip()
         self.parallel = args.get("parallel", True)
-        self.parallel_executor = Parallel(n_jobs=-1, return_as="generator_unordered")
+        self.store = ContentStore.from_args(workdir, args)
+        self.batch_bytes = args.get("batch_bytes")
+        self.streaming = args.get("streaming", False)
+        self.chunking = args.get("chunking")
+        if self.chunking is not None and self.chunking.get("incremental", False):
+            # the extracted part of each input file, keyed by the output file
+            self.increments = SqliteDict.str(
+                workdir / "incremental.sqlite",
+                ser_value=lambda x: orjson.dumps(x.to_dict()),
+                deser_value=lambda x: IncrementalState.from_dict(orjson.loads(x)),
+            )
+        else:
+            self.increments = None
+        self.get_exec_key = get_cache_keyfn(
+            DReprFn.exec, cache_ser_args=EXEC_CACHE_SER_ARGS
+        )
 
         if isinstance(args["path"], list):
             files = args["path"]
         else:
             files = [args["path"]]
 
+        self.program_cache_dir = (
+            Path(args["program_cache"])
+            if "program_cache" in args
+            else get_default_program_cache_dir()
+        )
         self.programs: dict[str, tuple[str, str]] = {}
+        gen_jobs: list[tuple[InputFile, Path]] = []
         for file in files:
             infile = InputFile.from_relpath(file)
-            outfile = pkgdir / f"{infile.path.stem}.py"
-            self.gen_program(
-                self.drepr_version,
-                repr_file=infile,
-                prog_file=outfile,
-            )
+            # programs are identified by their content (the model & the generation options), so services
+            # sharing the same model share the same program and a program is never overwritten by another
+            progident = self.get_program_ident(infile)
+            outfile = pkgdir / f"{infile.path.stem}_{progident[:16]}.py"
+            gen_jobs.append((infile, outfile))
+
             programkey = f"drepr:{self.drepr_version}:{infile.key}"
+            if self.format != "turtle":
+                programkey += f":{self.format}:{self.graph or ''}"
             assert infile.path.stem not in self.programs
             self.programs[infile.path.stem] = (
                 programkey,
                 f"{outfile.parent.name}.{outfile.stem}.main",
             )
+        self.gen_programs(gen_jobs)
+
+        # import the programs once when a worker starts instead of in its first job of each program
+        self.scheduler = JobScheduler(
+            args.get("scheduling"),
+            initializer=preload_programs,
+            initargs=(
+                str(pkgdir.parent),
+                sorted({path for _, path in self.programs.values()}),
+            ),
+        )
 
     def forward(
         self,
@@ -116,7 +305,7 @@ class DReprService(BaseFileService[DReprServiceInvokeArgs]):
 
         # now loop through the input files and extract them.
         readable_ptns = self.get_readable_patterns(args["input"])
-        jobs = []
+        jobs: list[DREPR_JOB] = []
         for infile in infiles:
             outfile = outdir / outdir_filename_fmt.format(
                 fileparent=infile.path.parent.name,
@@ -134,26 +323,397 @@ class DReprService(BaseFileService[DReprServiceInvokeArgs]):
 
             jobs.append((program_key, program_path, infile, outfile))
 
-        if self.parallel:
-            it: Iterable = self.parallel_executor(
-                delayed(drepr_exec)(
-                    self.workdir, program_key, program_path, infile, outfile
+        # resolve the cache hits in bulk so that only the missing files are sent to the workers
+        outfiles = set()
+        exec_cache = FileSqliteBackend(
+            FileSqliteBackend.get_dbfile(self.workdir, DReprFn.exec)
+        )
+        found = exec_cache.has_keys(
+            [
+                self.get_exec_key(program_key, infile, outfile)
+                for program_key, _, infile, outfile in jobs
+            ],
+            count_misses=False,
+        )
+        for (_, _, _, outfile), is_found in zip(jobs, found):
+            if is_found:
+                outfiles.add(outfile.relative_to(outdir))
+        all_jobs = jobs
+        jobs = [job for job, is_found in zip(jobs, found) if not is_found]
+        if self.verbose >= 1:
+            self.logger.info(
+                "Reuse {} files and extract {} files matching {}",
+                len(outfiles),
+                len(jobs),
+                readable_ptns,
+            )
+
+        tmpdir = None
+        try:
+            # packed files of split buckets are always extracted bucket by bucket
+            if self.chunking is not None or any(
+                is_pack(infile.path) for _, _, infile, _ in jobs
+            ):
+                tmpdir = Path(tempfile.mkdtemp(prefix=".chunks-", dir=self.workdir))
+                jobs, chunk_jobs, digests = self.split_jobs(jobs, tmpdir)
+            else:
+                chunk_jobs, digests = [], {}
+            import_times = self.exec_jobs(
+                jobs, chunk_jobs, digests, exec_cache, outdir, outfiles, readable_ptns
+            )
+        finally:
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+        if self.verbose >= 1:
+            for program_path, times in sorted(import_times.items()):
+                self.logger.info(
+                    "Import program {} in {:.3f}s on average ({} processes, max {:.3f}s)",
+                    program_path,
+                    sum(times) / len(times),
+                    len(times),
+                    max(times),
+                )
+
+        # detect and remove deleted files
+        OutputManifest(self.workdir, outdir).update(
+            {
+                str(outfile.relative_to(outdir)): ManifestEntry(
+                    input=infile.get_ident(),
+                    key=program_key + ":" + infile.key,
+                    size=outfile.stat().st_size,
                 )
-                for program_key, program_path, infile, outfile in jobs
+                for program_key, _, infile, outfile in all_jobs
+                if outfile.relative_to(outdir) in outfiles
+            }
+        )
+
+    def exec_jobs(
+        self,
+        jobs: list[DREPR_JOB],
+        chunk_jobs: list[DREPR_SPLIT_JOB],
+        digests: dict[Path, FileDigest],
+        exec_cache: FileSqliteBackend,
+        outdir: Path,
+        outfiles: set[Path],
+        desc: str,
+    ) -> dict[str, list[float]]:
+        """Execute the jobs and the chunks of the split jobs, returning the import time of programs
+        in each process. The extracted part of input files with digests is recorded for the incremental
+        extraction."""
+        # the split jobs are not executed by `DReprFn.exec`, count their cache misses here
+        exec_cache.has_keys(
+            [
+                self.get_exec_key(program_key, infile, outfile)
+                for (program_key, _, infile, outfile), _, _ in chunk_jobs
+            ]
+        )
+        program_keys = {outfile: program_key for program_key, _, _, outfile in jobs}
+
+        # group small files into batches to amortize the dispatching & caching overhead per job
+        batches = self.get_batches(jobs)
+        exec_args = [
+            (
+                drepr_exec_chunk,
+                (self.workdir, chunk_job, self.streaming, self.compression),
+            )
+            for _, split_job_chunks, _ in chunk_jobs
+            for chunk_job in split_job_chunks
+        ] + [
+            (
+                drepr_exec,
+                (
+                    self.workdir,
+                    batch,
+                    self.store,
+                    self.streaming,
+                    self.compression,
+                ),
+            )
+            for batch in batches
+        ]
+        if len(exec_args) == 0:
+            # everything is cached, do not start the workers
+            it: Iterable[FORWARD_EXEC_JOB_RETURN_TYPE] = []
+        elif self.parallel:
+            exec_sizes = [
+                chunk_job[2].size
+                for _, split_job_chunks, _ in chunk_jobs
+                for chunk_job in split_job_chunks
+            ] + [
+                sum(infile.path.stat().st_size for _, _, infile, _ in batch)
+                for batch in batches
+            ]
+            it: Iterable[FORWARD_EXEC_JOB_RETURN_TYPE] = self.scheduler.map_unordered(
+                exec_job, exec_args, exec_sizes
             )
         else:
-            it: Iterable = (
-                drepr_exec(self.workdir, program_key, program_path, infile, outfile)
-                for program_key, program_path, infile, outfile in jobs
+            it: Iterable[FORWARD_EXEC_JOB_RETURN_TYPE] = (
+                exec_job(fn, fn_args) for fn, fn_args in exec_args
             )
 
-        outfiles = set()
-        for outfile in tqdm(
-            it, total=len(jobs), desc=readable_ptns, disable=self.verbose < 1
-        ):
-            outfiles.add(outfile.relative_to(outdir))
+        # the index of the split job of each chunk output, and the number of unfinished chunks of each split job
+        chunk_parents: dict[Path, int] = {}
+        remaining_chunks: list[int] = []
+        for i, (_, split_job_chunks, _) in enumerate(chunk_jobs):
+            remaining_chunks.append(len(split_job_chunks))
+            for chunk_job in split_job_chunks:
+                chunk_parents[chunk_job[3]] = i
+
+        import_times: dict[str, list[float]] = {}
+        with CacheWriter() as cache_writer, tqdm(
+            total=len(jobs) + len(chunk_jobs), desc=desc, disable=self.verbose < 1
+        ) as pbar:
+            for batch_outfiles, cache_writes, batch_import_times in it:
+                cache_writer.add(cache_writes)
+                for program_path, import_time in batch_import_times.items():
+                    import_times.setdefault(program_path, []).append(import_time)
+                for outfile in batch_outfiles:
+                    if outfile not in chunk_parents:
+                        outfiles.add(outfile.relative_to(outdir))
+                        if outfile in digests:
+                            self.record_increment(
+                                program_keys[outfile], outfile, digests[outfile]
+                            )
+                        pbar.update(1)
+                        continue
+
+                    i = chunk_parents[outfile]
+                    remaining_chunks[i] -= 1
+                    if remaining_chunks[i] == 0:
+                        job, split_job_chunks, is_append = chunk_jobs[i]
+                        cache_writer.add(
+                            self.merge_chunks(
+                                job, split_job_chunks, is_append, exec_cache
+                            )
+                        )
+                        outfiles.add(job[3].relative_to(outdir))
+                        if job[3] in digests:
+                            self.record_increment(job[0], job[3], digests[job[3]])
+                        pbar.update(1)
+        return import_times
 
-        self.remove_unknown_files(outfiles, outdir)
+    def split_jobs(self, jobs: list[DREPR_JOB], tmpdir: Path) -> tuple[
+        list[DREPR_JOB],
+        list[DREPR_SPLIT_JOB],
+        dict[Path, FileDigest],
+    ]:
+        """Split jobs into jobs of chunks: the buckets of a packed file (see `HashSplitService`), the rows
+        appended to an input file since its last extraction (incremental extraction), or chunks of an input file
+        larger than the chunk size.
+
+        Returns the jobs that are not split, the split jobs, and the digests of input files (keyed by the
+        output files) whose extracted part is recorded for the incremental extraction after the jobs finish.
+        """
+        chunking = self.chunking or {}
+        chunk_bytes = chunking.get("size")
+        csv_header = chunking.get("csv_header", True)
+        exclude = set(chunking.get("exclude", []))
+        programs = {
+            program_path: name for name, (_, program_path) in self.programs.items()
+        }
+
+        whole_jobs = []
+        chunk_jobs: list[DREPR_SPLIT_JOB] = []
+        digests: dict[Path, FileDigest] = {}
+        n_appended = 0
+        n_packed = 0
+        for job in jobs:
+            program_key, program_path, infile, outfile = job
+            if self.materialize_output(job):
+                whole_jobs.append(job)
+                continue
+
+            jobdir = tmpdir / str(len(chunk_jobs))
+            if is_pack(infile.path):
+                # a bucket is a JSON array, the outputs of buckets are concatenated like chunks
+                (jobdir / "outputs").mkdir(parents=True, exist_ok=True)
+                chunk_jobs.append(
+                    (
+                        job,
+                        [
+                            (
+                                program_key,
+                                program_path,
+                                InputChunk(infile.path, start, end),
+                                jobdir / "outputs" / f"part-{i:05d}.{self.extension}",
+                            )
+                            for i, (_, start, end) in enumerate(
+                                read_pack_index(infile.path)
+                            )
+                        ],
+                        False,
+                    )
+                )
+                n_packed += 1
+                continue
+
+            if programs[program_path] in exclude:
+                whole_jobs.append(job)
+                continue
+            if self.increments is not None and infile.path.suffix.lower() == ".csv":
+                state = self.increments.get(str(outfile))
+                if state is not None and state.program_key != program_key:
+                    state = None
+                digest = hash_file(infile.path, state.size if state is not None else 0)
+                digests[outfile] = digest
+
+                if state is not None and state.can_append(digest, outfile):
+                    (jobdir / "outputs").mkdir(parents=True, exist_ok=True)
+                    chunk = InputChunk(
+                        infile.path,
+                        state.size,
+                        digest.size,
+                        read_csv_header(infile.path) if csv_header else b"",
+                    )
+                    chunk_jobs.append(
+                        (
+                            job,
+                            [
+                                (
+                                    program_key,
+                                    program_path,
+                                    chunk,
+                                    jobdir / "outputs" / f"part-00000.{self.extension}",
+                                )
+                            ],
+                            True,
+                        )
+                    )
+                    n_appended += 1
+                    continue
+
+            if (
+                chunk_bytes is None
+                or not self.parallel
+                or infile.path.stat().st_size <= chunk_bytes
+            ):
+                whole_jobs.append(job)
+                continue
+
+            chunks = split_file(
+                infile.path, chunk_bytes, jobdir / "inputs", csv_header=csv_header
+            )
+            if chunks is None:
+                whole_jobs.append(job)
+                continue
+
+            (jobdir / "outputs").mkdir(parents=True, exist_ok=True)
+            chunk_jobs.append(
+                (
+                    job,
+                    [
+                        (
+                            program_key,
+                            program_path,
+                            chunk,
+                            jobdir / "outputs" / f"part-{i:05d}.{self.extension}",
+                        )
+                        for i, chunk in enumerate(chunks)
+                    ],
+                    False,
+                )
+            )
+
+        if self.verbose >= 1 and n_appended > 0:
+            self.logger.info("Extract appended rows of {} files", n_appended)
+        if self.verbose >= 1 and n_packed > 0:
+            self.logger.info("Extract buckets of {} packed files", n_packed)
+        if self.verbose >= 1 and len(chunk_jobs) > n_appended + n_packed:
+            self.logger.info(
+                "Split {} files into {} chunks",
+                len(chunk_jobs) - n_appended - n_packed,
+                sum(
+                    len(chunks)
+                    for (_, _, infile, _), chunks, is_append in chunk_jobs
+                    if not is_append and not is_pack(infile.path)
+                ),
+            )
+        return whole_jobs, chunk_jobs, digests
+
+    def materialize_output(self, job: DREPR_JOB) -> bool:
+        """Check if the output of a job can be reused from the content store, the job is left to
+        the workers (which look up the store again) so that the cache records the output.
+        """
+        program_key, _, infile, outfile = job
+        store_key = get_store_key(self.store, program_key, infile, self.compression)
+        return (
+            self.store is not None
+            and store_key is not None
+            and self.store.has(store_key)
+        )
+
+    def merge_chunks(
+        self,
+        job: DREPR_JOB,
+        chunk_jobs: list[DREPR_CHUNK_JOB],
+        is_append: bool,
+        exec_cache: FileSqliteBackend,
+    ) -> DeferredCacheWrites:
+        """Concatenate outputs of chunks of a split job (appending them to the existing output if `is_append`),
+        and record the output in the cache as if the whole file was extracted by `DReprFn.exec`
+        """
+        program_key, _, infile, outfile = job
+        chunk_outfiles = [chunk_outfile for _, _, _, chunk_outfile in chunk_jobs]
+        if is_append:
+            append_files(chunk_outfiles, outfile)
+        else:
+            merge_files(chunk_outfiles, outfile)
+
+        store_key = get_store_key(self.store, program_key, infile, self.compression)
+        if store_key is not None:
+            assert self.store is not None
+            self.store.put(store_key, {"output": outfile})
+
+        with defer_cache_writes() as cache_writes:
+            exec_cache.set(self.get_exec_key(program_key, infile, outfile), outfile)
+        return cache_writes
+
+    def record_increment(self, program_key: str, outfile: Path, digest: FileDigest):
+        """Record the extracted part of an input file, so the rows appended later can be extracted
+        incrementally. Files that do not end at a row boundary are not recorded as appended data
+        would continue their last row."""
+        assert self.increments is not None
+        if not digest.is_row_end:
+            self.increments.pop(str(outfile), None)
+            return
+        self.increments[str(outfile)] = IncrementalState(
+            program_key=program_key,
+            size=digest.size,
+            prefix_hash=digest.hash,
+            n_lines=digest.n_lines,
+            output_size=outfile.stat().st_size,
+        )
+
+    def get_batches(self, jobs: list[DREPR_JOB]) -> list[list[DREPR_JOB]]:
+        """Group jobs into batches of jobs whose total input size is at most the batch size. Jobs are
+        ordered from the largest to the smallest, so a file larger than the batch size is processed in its own
+        batch and small files are grouped together."""
+        sizes = [infile.path.stat().st_size for _, _, infile, _ in jobs]
+        order = sorted(range(len(jobs)), key=lambda i: sizes[i], reverse=True)
+        jobs = [jobs[i] for i in order]
+        sizes = [sizes[i] for i in order]
+        if self.batch_bytes is not None:
+            batch_bytes = self.batch_bytes
+        elif not self.parallel:
+            batch_bytes = MAX_BATCH_BYTES
+        else:
+            batch_bytes = sum(sizes) // (cpu_count() * BATCHES_PER_WORKER)
+            batch_bytes = min(max(batch_bytes, MIN_BATCH_BYTES), MAX_BATCH_BYTES)
+
+        batches: list[list[DREPR_JOB]] = []
+        batch: list[DREPR_JOB] = []
+        total = 0
+        for job, size in zip(jobs, sizes):
+            if len(batch) > 0 and total + size > batch_bytes:
+                batches.append(batch)
+                batch = []
+                total = 0
+            batch.append(job)
+            total += size
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
 
     def setup(self, workdir: Path):
         pkgname = "gen_programs"
@@ -179,54 +739,287 @@ class DReprService(BaseFileService[DReprServiceInvokeArgs]):
 
         return pkgdir
 
-    @cache(
-        backend=FileSqliteBackend.factory(verbose="DREPR-Gen-Program"),
-        cache_ser_args={
-            "repr_file": lambda x: x.get_ident(),
-        },
-    )
-    def gen_program(self, drepr_version: str, repr_file: InputFile, prog_file: Path):
-        convert(repr=repr_file.path, resources={}, progfile=prog_file)
-        return prog_file
+    def get_program_ident(self, repr_file: InputFile) -> str:
+        """Get the identifier of the program generated from a model, which depends on the content of
+        the model, the version of DREPR, and the options of the service that affect the generated code
+        """
+        return hashlib.sha256(
+            orjson.dumps(
+                [
+                    self.drepr_version,
+                    repr_file.key,
+                    self.streaming,
+                    self.format,
+                    self.graph,
+                ]
+            )
+        ).hexdigest()
+
+    def gen_programs(self, jobs: list[tuple[InputFile, Path]]):
+        """Generate programs of the models, reusing programs in the shared program cache. Programs that
+        are not in the cache are generated in parallel and added to the cache."""
+        cache_stats = get_cache_stats(f"{self.workdir.name}/gen_program")
+        cache_files = [
+            self.program_cache_dir
+            / self.drepr_version
+            / f"{self.get_program_ident(repr_file)}.py"
+            for repr_file, _ in jobs
+        ]
+
+        start = time.perf_counter()
+        gen_jobs = {}
+        for (repr_file, _), cache_file in zip(jobs, cache_files):
+            if cache_file.exists():
+                cache_stats.hits += 1
+            elif cache_file not in gen_jobs:
+                cache_stats.add_miss("new_key")
+                gen_jobs[cache_file] = repr_file.path
+        cache_stats.lookup_time += time.perf_counter() - start
+
+        if len(gen_jobs) > 0:
+            if self.verbose >= 1:
+                self.logger.info("Generate {} DREPR programs", len(gen_jobs))
+            start = time.perf_counter()
+            args = [
+                (
+                    repr_file,
+                    cache_file,
+                    self.streaming,
+                    self.format,
+                    self.graph,
+                )
+                for cache_file, repr_file in gen_jobs.items()
+            ]
+            if self.parallel and len(args) > 1:
+                Parallel(n_jobs=-1)(delayed(gen_program)(*arg) for arg in args)
+            else:
+                for arg in args:
+                    gen_program(*arg)
+            cache_stats.compute_time += time.perf_counter() - start
+
+        for (_, prog_file), cache_file in zip(jobs, cache_files):
+            # do not rewrite an existing program so that it is not re-compiled by the workers
+            content = cache_file.read_bytes()
+            if not prog_file.exists() or prog_file.read_bytes() != content:
+                prog_file.write_bytes(content)
+
+
+def get_default_program_cache_dir() -> Path:
+    """Get the default directory of the shared program cache: $STATICKG_CACHE_DIR/drepr_programs,
+    where STATICKG_CACHE_DIR defaults to ~/.cache/statickg"""
+    cache_dir = os.environ.get("STATICKG_CACHE_DIR")
+    if cache_dir is None:
+        return Path("~/.cache/statickg/drepr_programs").expanduser()
+    return Path(cache_dir) / "drepr_programs"
+
+
+def gen_program(
+    repr_file: Path,
+    prog_file: Path,
+    streaming: bool = False,
+    format: str = "turtle",
+    graph: Optional[str] = None,
+):
+    """Generate a program from a DREPR model. The program is written to a temporary file then
+    renamed, so processes generating the same program do not see a partial program."""
+    prog_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = prog_file.parent / f".{prog_file.stem}.{uuid.uuid4().hex}.py"
+    try:
+        if not streaming:
+            convert(repr=repr_file, resources={}, progfile=tmp_file)
+            if format != "turtle":
+                tmp_file.write_text(patch_program(tmp_file.read_text(), format, graph))
+        else:
+            # generate a program writing to a file (the output file is an argument of the program)
+            convert(
+                repr=repr_file,
+                resources={},
+                progfile=tmp_file,
+                outfile=tmp_file.with_suffix(".ttl"),
+            )
+            tmp_file.write_text(patch_program(tmp_file.read_text(), format, graph))
+        os.replace(tmp_file, prog_file)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+    return prog_file
+
+
+def exec_job(
+    fn: Callable[..., FORWARD_EXEC_JOB_RETURN_TYPE], args: tuple
+) -> FORWARD_EXEC_JOB_RETURN_TYPE:
+    """Execute a job of a file batch (`drepr_exec`) or a chunk (`drepr_exec_chunk`), so that
+    both kinds of jobs are scheduled together"""
+    return fn(*args)
+
+
+def preload_programs(pkg_parent_dir: str, program_paths: list[str]):
+    """Initializer of the workers: import the generated programs and the DREPR runtime they use,
+    so the import cost is paid once per worker instead of in the jobs. As workers are spawned processes,
+    the directory containing the generated package is added to `sys.path` like in `DReprService.setup`.
+    """
+    if pkg_parent_dir not in sys.path:
+        sys.path.insert(0, pkg_parent_dir)
+    for program_path in program_paths:
+        get_program(program_path)
+
+
+def get_program(program_path: str) -> Callable:
+    """Get a generated program, importing it if it has not been imported in this process"""
+    if program_path not in _programs:
+        start = time.perf_counter()
+        _programs[program_path] = import_func(program_path)
+        _program_import_times[program_path] = time.perf_counter() - start
+    return _programs[program_path]
 
 
 def drepr_exec(
-    workdir: Path, program_key: str, program_path: str, infile: InputFile, outfile: Path
-) -> Path:
-    return DReprFn.get_instance(workdir, program_key, program_path).exec(
-        infile, outfile
+    workdir: Path,
+    jobs: list[DREPR_JOB],
+    store: Optional[ContentStore] = None,
+    streaming: bool = False,
+    compression: Optional[CompressionArgs] = None,
+) -> FORWARD_EXEC_JOB_RETURN_TYPE:
+    outfiles = []
+    with defer_cache_writes() as cache_writes:
+        for program_key, program_path, infile, outfile in jobs:
+            outfiles.append(
+                DReprFn.get_instance(
+                    workdir, program_key, program_path, store, streaming, compression
+                ).exec(program_key, infile, outfile)
+            )
+    import_times = dict(_program_import_times)
+    _program_import_times.clear()
+    return outfiles, cache_writes, import_times
+
+
+def drepr_exec_chunk(
+    workdir: Path,
+    job: DREPR_CHUNK_JOB,
+    streaming: bool = False,
+    compression: Optional[CompressionArgs] = None,
+) -> FORWARD_EXEC_JOB_RETURN_TYPE:
+    """Extract a chunk of a file. Outputs of chunks are not cached, the parent process caches
+    the output of the file after merging the outputs of its chunks."""
+    program_key, program_path, chunk, outfile = job
+    infile = chunk.materialize(
+        outfile.with_name(f"{outfile.name}.input{chunk.path.suffix}")
     )
+    try:
+        DReprFn.get_instance(
+            workdir, program_key, program_path, None, streaming, compression
+        ).extract(infile, outfile)
+    finally:
+        if infile != chunk.path:
+            infile.unlink(missing_ok=True)
+
+    import_times = dict(_program_import_times)
+    _program_import_times.clear()
+    return [outfile], DeferredCacheWrites(), import_times
+
+
+def get_store_key(
+    store: Optional[ContentStore],
+    program_key: str,
+    infile: InputFile,
+    compression: Optional[CompressionArgs] = None,
+) -> Optional[str]:
+    """Get the key of the output of a program on an input file in the content store, None if there is
+    no store or the input file does not have a content key (not computed)"""
+    if store is None or infile.key == "":
+        return None
+    store_key_parts = [program_key, infile.key]
+    if compression is not None:
+        store_key_parts.append(orjson.dumps(compression).decode())
+    return store.get_key(*store_key_parts)
 
 
 class DReprFn:
 
     instances = {}
 
-    def __init__(self, workdir: Path, program_key: str, program_path: str):
+    def __init__(
+        self,
+        workdir: Path,
+        program_key: str,
+        program_path: str,
+        store: Optional[ContentStore] = None,
+        streaming: bool = False,
+        compression: Optional[CompressionArgs] = None,
+    ):
         self.workdir = workdir
         self.program: tuple[str, Callable] = (
             program_key,
-            import_func(program_path),
+            get_program(program_path),
         )
+        self.store = store
+        # whether the program is generated in the streaming mode, which takes the output file as an argument
+        self.streaming = streaming
+        self.compression = compression
 
     @staticmethod
-    def get_instance(workdir: Path, program_key: str, program_path: str):
-        key = (workdir, program_key, program_path)
+    def get_instance(
+        workdir: Path,
+        program_key: str,
+        program_path: str,
+        store: Optional[ContentStore] = None,
+        streaming: bool = False,
+        compression: Optional[CompressionArgs] = None,
+    ):
+        key = (
+            workdir,
+            program_key,
+            program_path,
+            store is not None,
+            streaming,
+            orjson.dumps(compression),
+        )
         if key not in DReprFn.instances:
-            DReprFn.instances[key] = DReprFn(workdir, program_key, program_path)
+            DReprFn.instances[key] = DReprFn(
+                workdir, program_key, program_path, store, streaming, compression
+            )
         return DReprFn.instances[key]
 
     @cache(
         backend=FileSqliteBackend.factory(),
-        cache_ser_args={
-            "infile": lambda x: x.get_ident(),
-        },
+        cache_ser_args=EXEC_CACHE_SER_ARGS,
     )
-    def exec(self, infile: InputFile, outfile: Path):
-        try:
-            output = self.program[1](infile.path)
-        except Exception as e:
-            raise Exception(f"Error when processing {infile.path}") from e
+    def exec(self, program_key: str, infile: InputFile, outfile: Path):
+        """Extract an input file, `program_key` is the key of `self.program` and is part of the cache key
+        so the outputs are extracted again when the model, format or graph changes"""
+        store_key = get_store_key(self.store, program_key, infile, self.compression)
+        if store_key is not None:
+            assert self.store is not None
+            if self.store.materialize(store_key, {"output": outfile}):
+                return outfile
+
+        self.extract(infile.path, outfile)
 
-        outfile.write_text(output)
+        if store_key is not None:
+            assert self.store is not None
+            self.store.put(store_key, {"output": outfile})
         return outfile
+
+    def extract(self, infile: Path, outfile: Path):
+        """Run the program on an input file and write the output"""
+        compression_level = (
+            self.compression.get("level") if self.compression is not None else None
+        )
+        # the output file may be a hardlink of a content store entry, remove it instead of overwriting it
+        if self.streaming:
+            outfile.unlink(missing_ok=True)
+            try:
+                with stream_output(outfile, compression_level):
+                    self.program[1](infile, outfile)
+            except Exception as e:
+                # do not leave a partial output
+                outfile.unlink(missing_ok=True)
+                raise Exception(f"Error when processing {infile}") from e
+        else:
+            try:
+                output = self.program[1](infile)
+            except Exception as e:
+                raise Exception(f"Error when processing {infile}") from e
+
+            outfile.unlink(missing_ok=True)
+            with open_file(outfile, "wt", compression_level) as f:
+                f.write(output)
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import IO, Optional
+
+from drepr.writers.turtle_writer import TurtleWriter
+
+from statickg.helper import open_file
+
+# the file that the writers of the running DREPR program stream their output to (see `stream_output`)
+_output_stream: Optional[tuple[Path, IO[str]]] = None
+
+
+@contextmanager
+def stream_output(outfile: Path, compression_level: Optional[int] = None):
+    """Stream the output of DREPR programs generated in the streaming mode (see `patch_program`)
+    that are executed in this context to the given file, instead of keeping the whole output in memory.
+    The file is compressed if it has a compression extension (e.g., data.ttl.gz).
+    """
+    global _output_stream
+    assert _output_stream is None, "Nested stream_output is not supported"
+    with open_file(outfile, "wt", compression_level) as f:
+        _output_stream = (outfile, f)
+        try:
+            yield
+        finally:
+            _output_stream = None
+
+
+def patch_program(
+    prog: str, format: str = "turtle", graph: Optional[str] = None
+) -> str:
+    """Patch a DREPR program to use the writers in this module, which support streaming the output
+    (see `stream_output`) and writing N-Triples or N-Quads (the named graph is required) instead of Turtle.
+    """
+    line = "from drepr.writers.turtle_writer import TurtleWriter\n"
+    if line not in prog:
+        # e.g., the program is generated by a DREPR version that imports the writer differently
+        raise ValueError(
+            "Cannot patch the DREPR program as it does not import the Turtle writer with: "
+            + line.strip()
+        )
+    if format == "turtle":
+        newline = "from statickg.services.drepr_writer import StreamingTurtleWriter as TurtleWriter\n"
+    elif format == "ntriples":
+        newline = "from statickg.services.drepr_writer import StreamingNTriplesWriter as TurtleWriter\n"
+    elif format == "nquads":
+        if graph is None:
+            raise ValueError("The named graph is required to write N-Quads")
+        newline = (
+            "from statickg.services.drepr_writer import StreamingNQuadsWriter\n"
+            f"TurtleWriter = StreamingNQuadsWriter.bind_graph({graph!r})\n"
+        )
+    else:
+        raise NotImplementedError(format)
+    return prog.replace(line, newline)
+
+
+class StreamingTurtleWriter(TurtleWriter):
+    """A turtle writer that flushes the serialized records to the output stream of `stream_output` after
+    the buffer reaches `flush_size` chunks, so the memory usage does not depend on the output size.
+
+    When it is not used within `stream_output`, it buffers the whole output like `TurtleWriter`.
+    """
+
+    # number of serialized chunks (each is a term or a separator) to buffer before writing to the stream
+    flush_size = 1 << 16
+
+    def __init__(self, prefixes: dict[str, str], normalize_uri: Optional[bool] = None):
+        super().__init__(prefixes, normalize_uri)
+        self.output_stream = _output_stream
+
+    # the chunk terminating a record, which replaces the terminator of the record's last triple
+    record_end = " .\n\n"
+
+    def end_record(self):
+        is_aborted = self.subj is None
+        super().end_record()
+        if not is_aborted:
+            self.write_stream[-1] = self.record_end
+        # the stream can only be flushed after a record ends as `end_record` modifies the last chunk
+        if self.output_stream is not None and len(self.write_stream) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        assert self.output_stream is not None
+        self.output_stream[1].write("".join(self.write_stream))
+        self.write_stream = []
+
+    def write_to_file(self, filepath):
+        if self.output_stream is None:
+            return super().write_to_file(filepath)
+
+        assert Path(filepath) == self.output_stream[0], (
+            filepath,
+            self.output_stream[0],
+        )
+        self.flush()
+
+
+class StreamingNTriplesWriter(StreamingTurtleWriter):
+    """Write records as N-Triples: one triple per line with full IRIs, so the output can be split,
+    concatenated or deduplicated line by line."""
+
+    # the chunk terminating a triple
+    triple_end = " .\n"
+
+    def __init__(self, prefixes: dict[str, str], normalize_uri: Optional[bool] = None):
+        # N-Triples does not have prefixes
+        super().__init__(prefixes, normalize_uri=False)
+        self.record_end = self.triple_end
+
+    def write_triple(self, subj, pred, obj):
+        self.write_stream.append(subj.n3())
+        self.write_stream.append(" ")
+        self.write_stream.append(pred.n3())
+        self.write_stream.append(" ")
+        self.write_stream.append(obj.n3())
+        self.write_stream.append(self.triple_end)
+
+    def write_pred_obj(self, pred, obj):
+        assert self.subj is not None
+        self.write_triple(self.subj, pred, obj)
+
+
+class StreamingNQuadsWriter(StreamingNTriplesWriter):
+    """Write records as N-Quads in a named graph"""
+
+    def __init__(
+        self,
+        prefixes: dict[str, str],
+        normalize_uri: Optional[bool] = None,
+        graph: Optional[str] = None,
+    ):
+        super().__init__(prefixes, normalize_uri)
+        if graph is None:
+            raise ValueError("The named graph is required to write N-Quads")
+        self.triple_end = f" <{graph}> .\n"
+        self.record_end = self.triple_end
+
+    @classmethod
+    def bind_graph(cls, graph: str):
+        return partial(cls, graph=graph)
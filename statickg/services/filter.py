@@ -1,28 +1,70 @@
 from __future__ import annotations
 
+import math
 import os
 import pickle
-import shutil
 from dataclasses import dataclass
+from operator import itemgetter
 from pathlib import Path
-from typing import Iterable, Mapping, NotRequired, TypedDict
+from typing import Any, Callable, Iterable, Mapping, NotRequired, Optional, TypedDict
 
+import orjson
 import serde.json
 import xxhash
-from joblib import Parallel, delayed
 from libactor.cache import SqliteBackend, cache
 from tqdm import tqdm
 
-from statickg.helper import FileSqliteBackend, get_classpath, remove_deleted_files
-from statickg.models.prelude import ETLOutput, InputFile, RelPath
+from statickg.helper import (
+    CacheWriter,
+    DeferredCacheWrites,
+    FileSqliteBackend,
+    JobScheduler,
+    OutputManifest,
+    SchedulingArgs,
+    defer_cache_writes,
+    get_cache_keyfn,
+)
+from statickg.models.prelude import ETLOutput, InputFile, ManifestEntry, RelPath
 from statickg.models.repository import Repository
 from statickg.services.interface import BaseFileService, BaseService
-from statickg.services.split import HashSplitService, read_file, write_file
+from statickg.services.split import (
+    check_same_partitioning,
+    get_split_output,
+    read_file,
+    write_file,
+)
+from statickg.services.split_pack import copy_bucket, get_bucket_path, get_bucket_size
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FILTER_CACHE_ARGS = ["bucket", "outdir", "key_prop", "filter_files", "file"]
+FILTER_CACHE_SER_ARGS = {
+    "outdir": lambda x: x.get_ident(),
+    "key_prop": lambda x: x,
+    "filter_files": lambda files: "\n".join(sorted(file.get_ident() for file in files)),
+    "file": lambda x: x.get_ident(),
+}
+
+
+class FilterKeysArgs(TypedDict):
+    # store the keys of the filter files as 64-bit fingerprints in a sorted array instead of a set of keys,
+    # records matching a fingerprint are verified against the exact keys (see `CompactFilterKeySet`). numpy is required
+    compact: NotRequired[bool]
+    # check the fingerprints with a Bloom filter of this number of bits per key before searching the sorted array,
+    # default is no Bloom filter
+    bloom_bits_per_key: NotRequired[int]
 
 
 class HashFilterServiceConstructArgs(TypedDict):
     verbose: NotRequired[int]
     parallel: NotRequired[bool]
+    # order of jobs, memory budget & recycling of the workers (see `JobScheduler`)
+    scheduling: NotRequired[SchedulingArgs]
+    # how the keys of the filter files are stored for the membership tests
+    keys: NotRequired[FilterKeysArgs]
 
 
 class HashFilterServiceInvokeArgs(TypedDict):
@@ -46,32 +88,28 @@ class HashFilterService(BaseService[HashFilterServiceInvokeArgs]):
         self.services = services
         self.verbose = args.get("verbose", 1)
         self.parallel = args.get("parallel", True)
-        self.parallel_executor = Parallel(n_jobs=-1, return_as="generator_unordered")
+        self.scheduler = JobScheduler(args.get("scheduling"))
+        self.keys_args = args.get("keys", {})
+        if self.keys_args.get("compact", False) and np is None:
+            raise ImportError("numpy is required to store the keys compactly")
+        self.get_filter_key = get_cache_keyfn(
+            FilterFn.filter,
+            cache_args=FILTER_CACHE_ARGS,
+            cache_ser_args=FILTER_CACHE_SER_ARGS,
+        )
 
     def forward(
         self, repo: Repository, args: HashFilterServiceInvokeArgs, tracker: ETLOutput
     ):
-        hashsplit_service = get_classpath(HashSplitService)
-
-        assert len(tracker.invoke_args[hashsplit_service]) == 2
-        (all_idx,) = [
-            idx
-            for idx, split_args in enumerate(tracker.invoke_args[hashsplit_service])
-            if split_args["output"]["base"] == args["all_output"]
-        ]
-        (filter_idx,) = [
-            idx
-            for idx, split_args in enumerate(tracker.invoke_args[hashsplit_service])
-            if split_args["output"]["base"] == args["filter_output"]
-        ]
-        assert all_idx != filter_idx
-
-        all_output: dict[str, list[InputFile]] = tracker.output[hashsplit_service][
-            all_idx
-        ]
-        filter_output: dict[str, list[InputFile]] = tracker.output[hashsplit_service][
-            filter_idx
-        ]
+        assert args["all_output"] != args["filter_output"]
+        all_output = get_split_output(tracker, args["all_output"])
+        filter_output = get_split_output(tracker, args["filter_output"])
+        check_same_partitioning(
+            {
+                args["all_output"].get_ident(): all_output,
+                args["filter_output"].get_ident(): filter_output,
+            }
+        )
 
         outdir_base = args["output"]
         outdir_path = outdir_base.get_path()
@@ -79,30 +117,82 @@ class HashFilterService(BaseService[HashFilterServiceInvokeArgs]):
 
         key_prop = args["key_prop"]
 
+        # resolve the cache hits of all buckets first, so the filter keys are only read for
+        # the buckets that have files to filter
+        filter_cache = FileSqliteBackend(
+            FileSqliteBackend.get_dbfile(self.workdir, FilterFn.filter)
+        )
+        cache_keys = []
+        for bucket, files in all_output.items():
+            filter_files = filter_output.get(bucket, [])
+            for file in files:
+                cache_keys.append(
+                    self.get_filter_key(
+                        bucket, outdir_base, key_prop, filter_files, file
+                    )
+                )
+        found = iter(filter_cache.has_keys(cache_keys, count_misses=False))
+
         jobs = []
         # they should be in the group, so we can just loop through them and apply filtering
         for bucket, files in all_output.items():
-            jobs.append((bucket, filter_output.get(bucket, []), files))
+            (outdir_path / bucket).mkdir(parents=True, exist_ok=True)
+            files = [file for file in files if not next(found)]
+            if len(files) > 0:
+                jobs.append((bucket, filter_output.get(bucket, []), files))
 
         if self.parallel:
-            it: Iterable = self.parallel_executor(
-                delayed(filter_file)(
-                    self.workdir, bucket, outdir_base, key_prop, filter_files, files
-                )
-                for bucket, filter_files, files in jobs
-            )  # type: ignore
+            it: Iterable = self.scheduler.map_unordered(
+                filter_file,
+                [
+                    (
+                        self.workdir,
+                        bucket,
+                        outdir_base,
+                        key_prop,
+                        filter_files,
+                        files,
+                        self.keys_args,
+                    )
+                    for bucket, filter_files, files in jobs
+                ],
+                [
+                    sum(get_bucket_size(file) for file in filter_files + files)
+                    for _, filter_files, files in jobs
+                ],
+            )
         else:
             it: Iterable = (
                 filter_file(
-                    self.workdir, bucket, outdir_base, key_prop, filter_files, files
+                    self.workdir,
+                    bucket,
+                    outdir_base,
+                    key_prop,
+                    filter_files,
+                    files,
+                    self.keys_args,
                 )
                 for bucket, filter_files, files in jobs
             )
 
-        for tmp in tqdm(
-            it, total=len(jobs), desc="Filter files", disable=self.verbose != 1
-        ):
-            pass
+        with CacheWriter() as cache_writer:
+            for cache_writes in tqdm(
+                it, total=len(jobs), desc="Filter files", disable=self.verbose != 1
+            ):
+                cache_writer.add(cache_writes)
+
+        # we do not skip empty files -- so the outputs are the files of all buckets
+        outfiles = {}
+        it_keys = iter(cache_keys)
+        for bucket, files in all_output.items():
+            for file in files:
+                relpath = str(Path(bucket) / get_bucket_path(file).name)
+                outfiles[relpath] = ManifestEntry(
+                    input=file.get_ident(),
+                    key=next(it_keys),
+                    size=(outdir_path / relpath).stat().st_size,
+                )
+        OutputManifest(self.workdir, outdir_path).update(outfiles)
 
 
 def filter_file(
@@ -112,31 +202,178 @@ def filter_file(
     key_prop: str | list[str],
     filter_files: list[InputFile],
     files: list[InputFile],
+    keys_args: Optional[FilterKeysArgs] = None,
+) -> DeferredCacheWrites:
+    with defer_cache_writes() as cache_writes:
+        _filter_file(workdir, bucket, outdir, key_prop, filter_files, files, keys_args)
+    return cache_writes
+
+
+def _filter_file(
+    workdir: Path,
+    bucket: str,
+    outdir: RelPath,
+    key_prop: str | list[str],
+    filter_files: list[InputFile],
+    files: list[InputFile],
+    keys_args: Optional[FilterKeysArgs] = None,
 ):
     # read the filter files
-    keys = set()
+    keys_args = keys_args or {}
+    get_key = get_key_fn(key_prop)
+    if keys_args.get("compact", False):
+        keys = CompactFilterKeySet(
+            get_key, filter_files, keys_args.get("bloom_bits_per_key")
+        )
+    else:
+        keys = FilterKeySet(get_key, filter_files)
+
+    filter_fn = FilterFn.get_instance(workdir)
+    for file in files:
+        filter_fn.filter(bucket, outdir, key_prop, filter_files, file, keys)
 
-    (outdir.get_path() / bucket).mkdir(parents=True, exist_ok=True)
-    # we do not skip empty files -- so this code should be fine
-    remove_deleted_files({file.path.name for file in files}, outdir / bucket)
 
+def get_key_fn(key_prop: str | list[str]) -> Callable[[dict], Any]:
+    """Get the function that returns the key of a record: the value of the field if `key_prop` is a string,
+    otherwise the tuple of values of the fields"""
     if isinstance(key_prop, str):
-        for file in filter_files:
-            keys.update((record[key_prop] for record in read_file(file.path)))
+        return itemgetter(key_prop)
+    if len(key_prop) == 1:
+        prop = key_prop[0]
+        return lambda record: (record[prop],)
+    return itemgetter(*key_prop)
+
 
-        filter_fn = FilterFn.get_instance(workdir)
+class FilterKeySet:
+    """The set of keys of records in the filter files of a bucket"""
+
+    def __init__(self, get_key: Callable[[dict], Any], files: list[InputFile]):
+        self.get_key = get_key
+        self.keys = set()
         for file in files:
-            filter_fn.filter(bucket, outdir, key_prop, filter_files, file, keys)
-    else:
-        for file in filter_files:
-            keys.update(
-                tuple(record[prop] for prop in key_prop)
-                for record in read_file(file.path)
+            self.keys.update(map(get_key, read_file(file)))
+
+    def contains(self, records: list) -> list[bool]:
+        """Check if the keys of records are in the set"""
+        return self.contains_keys([self.get_key(record) for record in records])
+
+    def contains_keys(self, keys: list) -> list[bool]:
+        """Check if keys are in the set"""
+        return [key in self.keys for key in keys]
+
+
+class CompactFilterKeySet(FilterKeySet):
+    """The set of keys of records in the filter files of a bucket, stored as a sorted array of their 64-bit
+    fingerprints (xxh3), which takes 8 bytes per key. As different keys may have the same fingerprint, the keys
+    of records matching a fingerprint are verified against the exact keys of the fingerprint, which are read
+    from the filter files again (only the first time the fingerprint is matched).
+    """
+
+    def __init__(
+        self,
+        get_key: Callable[[dict], Any],
+        files: list[InputFile],
+        bloom_bits_per_key: Optional[int] = None,
+    ):
+        self.get_key = get_key
+        self.files = files
+        self.fingerprints = np.unique(
+            np.fromiter(
+                (
+                    get_fingerprint(get_key(record))
+                    for file in files
+                    for record in read_file(file)
+                ),
+                dtype=np.uint64,
             )
+        )
+        if bloom_bits_per_key is not None:
+            self.bloom = BloomFilter(len(self.fingerprints), bloom_bits_per_key)
+            self.bloom.add(self.fingerprints)
+        else:
+            self.bloom = None
+        # the exact keys of the fingerprints that have been matched
+        self.exact_keys: dict[int, set] = {}
 
-        filter_fn = FilterFn.get_instance(workdir)
-        for file in files:
-            filter_fn.filter(bucket, outdir, key_prop, filter_files, file, keys)
+    def contains_keys(self, keys: list) -> list[bool]:
+        fingerprints = np.fromiter(
+            map(get_fingerprint, keys), dtype=np.uint64, count=len(keys)
+        )
+
+        if self.bloom is not None:
+            (candidates,) = np.nonzero(self.bloom.contains(fingerprints))
+        else:
+            candidates = np.arange(len(keys))
+        if len(self.fingerprints) > 0 and len(candidates) > 0:
+            idx = np.searchsorted(self.fingerprints, fingerprints[candidates])
+            idx[idx == len(self.fingerprints)] = 0
+            matches = candidates[
+                self.fingerprints[idx] == fingerprints[candidates]
+            ].tolist()
+        else:
+            matches = []
+
+        output = [False] * len(keys)
+        if len(matches) == 0:
+            return output
+
+        match_fingerprints = fingerprints[matches].tolist()
+        self.load_exact_keys(set(match_fingerprints))
+        for i, fingerprint in zip(matches, match_fingerprints):
+            output[i] = keys[i] in self.exact_keys[fingerprint]
+        return output
+
+    def load_exact_keys(self, fingerprints: set[int]):
+        """Read the exact keys of the given fingerprints from the filter files if they have not been read"""
+        fingerprints = fingerprints.difference(self.exact_keys)
+        if len(fingerprints) == 0:
+            return
+        for fingerprint in fingerprints:
+            self.exact_keys[fingerprint] = set()
+        for file in self.files:
+            for record in read_file(file):
+                key = self.get_key(record)
+                fingerprint = get_fingerprint(key)
+                if fingerprint in fingerprints:
+                    self.exact_keys[fingerprint].add(key)
+
+
+def get_fingerprint(key) -> int:
+    return xxhash.xxh3_64_intdigest(orjson.dumps(key))
+
+
+class BloomFilter:
+    """A Bloom filter of 64-bit fingerprints, the positions of a fingerprint are derived from its two halves
+    (double hashing), so the keys are not hashed again"""
+
+    def __init__(self, n_keys: int, bits_per_key: int):
+        self.n_bits = max(n_keys * bits_per_key, 64)
+        self.n_hashes = max(round(bits_per_key * math.log(2)), 1)
+        self.bits = np.zeros((self.n_bits + 7) // 8, dtype=np.uint8)
+
+    def get_positions(self, fingerprints):
+        h1 = fingerprints & np.uint64(0xFFFFFFFF)
+        h2 = (fingerprints >> np.uint64(32)) | np.uint64(1)
+        return [
+            (h1 + np.uint64(i) * h2) % np.uint64(self.n_bits)
+            for i in range(self.n_hashes)
+        ]
+
+    def add(self, fingerprints):
+        for pos in self.get_positions(fingerprints):
+            np.bitwise_or.at(
+                self.bits,
+                pos >> np.uint64(3),
+                np.left_shift(1, pos & np.uint64(7)).astype(np.uint8),
+            )
+
+    def contains(self, fingerprints):
+        output = np.ones(len(fingerprints), dtype=bool)
+        for pos in self.get_positions(fingerprints):
+            output &= (
+                self.bits[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)
+            ) & 1 == 1
+        return output
 
 
 class FilterFn:
@@ -153,15 +390,8 @@ class FilterFn:
 
     @cache(
         backend=FileSqliteBackend.factory(),
-        cache_args=["bucket", "outdir", "key_prop", "filter_files", "file"],
-        cache_ser_args={
-            "outdir": lambda x: x.get_ident(),
-            "key_prop": lambda x: x,
-            "filter_files": lambda files: "\n".join(
-                file.get_ident() for file in sorted(files)
-            ),
-            "file": lambda x: x.get_ident(),
-        },  # type: ignore
+        cache_args=FILTER_CACHE_ARGS,
+        cache_ser_args=FILTER_CACHE_SER_ARGS,  # type: ignore
     )
     def filter(
         self,
@@ -170,24 +400,24 @@ class FilterFn:
         key_prop: str | list[str],
         filter_files: list[InputFile],
         file: InputFile,
-        filter_keys: set[str],
+        filter_keys: FilterKeySet,
     ):
-        outfile = outdir.get_path() / bucket / file.path.name
+        outfile = outdir.get_path() / bucket / get_bucket_path(file).name
 
         if len(filter_files) == 0:
-            shutil.copy(file.path, outfile)
+            copy_bucket(file, outfile)
             return outfile
 
-        old_records = read_file(file.path)
+        old_records = read_file(file)
         records = [
             r
-            for r in old_records
-            if tuple(r[prop] for prop in key_prop) not in filter_keys
+            for r, is_filtered in zip(old_records, filter_keys.contains(old_records))
+            if not is_filtered
         ]
 
         if len(records) != len(old_records):
             write_file(records, outfile)
         else:
-            shutil.copy(file.path, outfile)
+            copy_bucket(file, outfile)
 
         return outfile
@@ -4,7 +4,9 @@ import os
 import re
 import shutil
 import subprocess
+import tempfile
 import time
+from contextlib import contextmanager
 from copy import deepcopy
 from dataclasses import dataclass
 from functools import cached_property
@@ -13,10 +15,16 @@ from typing import Mapping, NotRequired, Optional, TypedDict
 
 import requests
 import serde.json
-from rdflib import Graph
+from rdflib import Dataset, Graph
 from tqdm import tqdm
 
-from statickg.helper import find_available_port, get_latest_version, logger_helper
+from statickg.helper import (
+    find_available_port,
+    get_latest_version,
+    logger_helper,
+    open_file,
+    strip_compression_ext,
+)
 from statickg.models.prelude import (
     ETLOutput,
     InputFile,
@@ -29,6 +37,12 @@ from statickg.models.prelude import (
 from statickg.services.interface import BaseFileWithCacheService, BaseService
 
 DBINFO_METADATA_FILE = "_METADATA"
+# supported RDF formats: extension -> (rdflib format, content type)
+RDF_FORMATS = {
+    ".ttl": ("turtle", "text/turtle"),
+    ".nt": ("nt", "application/n-triples"),
+    ".nq": ("nquads", "application/n-quads"),
+}
 
 
 class FusekiEndpoint(TypedDict):
@@ -467,49 +481,93 @@ class FusekiDataLoaderService(
                 basedir = basedir.get_path()
 
             load_cmd = self.get_load_command(args)
-            if load_cmd.find("mytdbloader") != -1:
-                with open(Path(basedir) / "fuseki_input_files.txt", "w") as f:
-                    for file in files:
-                        f.write(str(file.path.relative_to(basedir)) + "\n")
-
-                (
-                    subprocess.check_output
-                    if self.capture_output
-                    else subprocess.check_call
-                )(
-                    load_cmd.format(
-                        DB_DIR=dbinfo.dir,
-                        FILES="fuseki_input_files.txt",
-                    ),
-                    shell=True,
-                )
-            else:
-                (
-                    subprocess.check_output
-                    if self.capture_output
-                    else subprocess.check_call
-                )(
-                    load_cmd.format(
-                        DB_DIR=dbinfo.dir,
-                        FILES=" ".join(
-                            [str(file.path.relative_to(basedir)) for file in files]
+            with self.get_loader_files(Path(basedir), files) as loader_files:
+                if load_cmd.find("mytdbloader") != -1:
+                    with open(Path(basedir) / "fuseki_input_files.txt", "w") as f:
+                        for file in loader_files:
+                            f.write(file + "\n")
+
+                    (
+                        subprocess.check_output
+                        if self.capture_output
+                        else subprocess.check_call
+                    )(
+                        load_cmd.format(
+                            DB_DIR=dbinfo.dir,
+                            FILES="fuseki_input_files.txt",
                         ),
-                    ),
-                    shell=True,
-                )
+                        shell=True,
+                    )
+                else:
+                    (
+                        subprocess.check_output
+                        if self.capture_output
+                        else subprocess.check_call
+                    )(
+                        load_cmd.format(
+                            DB_DIR=dbinfo.dir,
+                            FILES=" ".join(loader_files),
+                        ),
+                        shell=True,
+                    )
+
+    @contextmanager
+    def get_loader_files(self, basedir: Path, files: list[InputFile]):
+        """Get the paths (relative to the basedir) of the files passed to the load command.
+
+        The loader reads gzip files (.gz) directly but not zstd files (.zst), which are
+        decompressed to a temporary directory in the basedir and removed after loading.
+        """
+        tmpdir = None
+        loader_files = []
+        try:
+            for file in files:
+                if file.path.suffix == ".zst":
+                    if tmpdir is None:
+                        tmpdir = Path(tempfile.mkdtemp(prefix=".load-", dir=basedir))
+                    tmpfile = (
+                        tmpdir
+                        / f"{len(loader_files)}_{strip_compression_ext(file.path).name}"
+                    )
+                    with open_file(file.path, "rb") as f, open(tmpfile, "wb") as g:
+                        shutil.copyfileobj(f, g)
+                    loader_files.append(str(tmpfile.relative_to(basedir)))
+                else:
+                    loader_files.append(str(file.path.relative_to(basedir)))
+            yield loader_files
+        finally:
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir)
 
     def upload_file(self, hostname: str, endpoint: FusekiEndpoint, file: Path):
-        resp = requests.post(
-            hostname + endpoint["gsp"],
-            data=file.read_text(),
-            headers={"Content-Type": f"text/{self.detect_format(file)}; charset=utf-8"},
-            verify=False,
-        )
+        headers = {
+            "Content-Type": f"{RDF_FORMATS[self.get_rdf_ext(file)][1]}; charset=utf-8"
+        }
+        if file.suffix == ".gz":
+            # Fuseki decompresses gzip request bodies, so we send the file as it is
+            headers["Content-Encoding"] = "gzip"
+            f = open(file, "rb")
+        else:
+            f = open_file(file, "rb")
+
+        with f:
+            resp = requests.post(
+                hostname + endpoint["gsp"],
+                data=f,
+                headers=headers,
+                verify=False,
+            )
         assert resp.status_code == 200, (resp.status_code, resp.text)
 
     def remove_file(self, hostname: str, endpoint: FusekiEndpoint, file: Path):
-        g = Graph()
-        g.parse(file, format=self.detect_format(file))
+        # quads are parsed into a dataset whose default graph is the union of all graphs
+        g = Graph() if self.get_rdf_ext(file) != ".nq" else Dataset(default_union=True)
+        with open_file(file, "rb") as f:
+            g.parse(
+                data=f.read(),
+                format=self.detect_format(file),
+                publicID=file.absolute().as_uri(),
+            )
         resp = requests.post(
             url=hostname + endpoint["update"],
             data={
@@ -525,8 +583,15 @@ class FusekiDataLoaderService(
         assert resp.status_code == 200, (resp.status_code, resp.text)
 
     def detect_format(self, file: Path):
-        assert file.suffix == ".ttl", f"Only turtle files (.ttl) are supported: {file}"
-        return "turtle"
+        """Get the rdflib format of a file"""
+        return RDF_FORMATS[self.get_rdf_ext(file)][0]
+
+    def get_rdf_ext(self, file: Path):
+        ext = strip_compression_ext(file).suffix
+        assert (
+            ext in RDF_FORMATS
+        ), f"Only Turtle (.ttl), N-Triples (.nt), and N-Quads (.nq) files (can be compressed with .gz or .zst) are supported: {file}"
+        return ext
 
     def get_load_command(self, args: FusekiDataLoaderServiceInvokeArgs):
         cmd = args["load"]["command"]
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import hashlib
+import warnings
 from collections import Counter
 from pathlib import Path
 from typing import Any, Generic, Mapping, TypeVar, cast
@@ -103,6 +104,12 @@ class BaseFileService(BaseService[A]):
         return files
 
     def remove_unknown_files(self, known_files: set[str] | set[Path], outdir: Path):
+        """Deprecated: use `OutputManifest`. Remove files in the output directory that are not known"""
+        warnings.warn(
+            "BaseFileService.remove_unknown_files is deprecated, use OutputManifest instead",
+            DeprecationWarning,
+            stacklevel=2,
+        )
         if len(known_files) > 0:
             file = next(iter(known_files))
             if isinstance(file, Path):
@@ -0,0 +1,425 @@
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Literal, Mapping, NotRequired, Optional, TypedDict
+
+import orjson
+from libactor.cache import cache
+from tqdm import tqdm
+
+from statickg.helper import (
+    CacheWriter,
+    DeferredCacheWrites,
+    FileSqliteBackend,
+    JobScheduler,
+    OutputManifest,
+    SchedulingArgs,
+    defer_cache_writes,
+    get_cache_keyfn,
+)
+from statickg.models.prelude import ETLOutput, InputFile, ManifestEntry, RelPath
+from statickg.models.repository import Repository
+from statickg.services.filter import (
+    CompactFilterKeySet,
+    FilterKeysArgs,
+    FilterKeySet,
+    get_key_fn,
+)
+from statickg.services.interface import BaseService
+from statickg.services.split import (
+    SplitOutput,
+    check_same_partitioning,
+    get_split_output,
+    read_file,
+    write_file,
+)
+from statickg.services.split_pack import copy_bucket, get_bucket_path, get_bucket_size
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class HashJoinServiceConstructArgs(TypedDict):
+    verbose: NotRequired[int]
+    parallel: NotRequired[bool]
+    # order of jobs, memory budget & recycling of the workers (see `JobScheduler`)
+    scheduling: NotRequired[SchedulingArgs]
+    # how the keys of the sources of semi & anti joins are stored for the membership tests
+    keys: NotRequired[FilterKeysArgs]
+
+
+class JoinSourceArgs(TypedDict):
+    # output of the split (or of another partitioned service, e.g., HashJoinService) joined with the records
+    input: RelPath
+    # "semi": keep records that have a matching record in the source, "anti": keep records that do not have a
+    # matching record in the source, "left": keep all records and add the fields of their first matching record
+    how: Literal["semi", "anti", "left"]
+    # fields of the key of records of the source (a string if the key of the joined records is a string, otherwise
+    # a list of the same length), default is the key of the joined records
+    key_prop: NotRequired[str | list[str]]
+    # fields added by a left join, either a list of fields or a mapping from fields of the source to fields of
+    # the output, default is all fields except the key. records without a match are not modified
+    fields: NotRequired[list[str] | dict[str, str]]
+
+
+class HashJoinServiceInvokeArgs(TypedDict):
+    key_prop: str | list[str]
+    # output of the split whose records are joined
+    input: RelPath
+    # sources that are joined with the records in order, they must be split by the same key into the same
+    # buckets (the same number of buckets, partitioning & output format) as the input
+    sources: list[JoinSourceArgs]
+    output: RelPath
+
+
+@dataclass
+class JoinSource:
+    """A source joined with the records of a bucket: its files in the bucket and how it is joined"""
+
+    how: Literal["semi", "anti", "left"]
+    key_prop: str | list[str]
+    fields: Optional[list[str] | dict[str, str]]
+    files: list[InputFile]
+
+    def get_ident(self):
+        return orjson.dumps(
+            [
+                self.how,
+                self.key_prop,
+                self.fields,
+                sorted(file.get_ident() for file in self.files),
+            ]
+        ).decode()
+
+
+JOIN_CACHE_ARGS = ["bucket", "outdir", "key_prop", "sources", "file"]
+JOIN_CACHE_SER_ARGS = {
+    "outdir": lambda x: x.get_ident(),
+    "key_prop": lambda x: x,
+    "sources": lambda sources: [source.get_ident() for source in sources],
+    "file": lambda x: x.get_ident(),
+}
+
+
+class HashJoinService(BaseService[HashJoinServiceInvokeArgs]):
+    """A service that joins records with records of other sources that have the same key. The records and
+    the sources are split into the same buckets (see `HashSplitService`), so each bucket is joined
+    independently (in parallel) and the output of each file of a bucket is cached.
+
+    The output is a mapping from a bucket to its output files, like the output of `HashSplitService`, so
+    it can be joined again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        workdir: Path,
+        args: HashJoinServiceConstructArgs,
+        services: Mapping[str, BaseService],
+    ):
+        self.name = name
+        self.workdir = workdir
+        self.services = services
+        self.verbose = args.get("verbose", 1)
+        self.parallel = args.get("parallel", True)
+        self.scheduler = JobScheduler(args.get("scheduling"))
+        self.keys_args = args.get("keys", {})
+        if self.keys_args.get("compact", False) and np is None:
+            raise ImportError("numpy is required to store the keys compactly")
+        self.get_join_key = get_cache_keyfn(
+            JoinFn.join, cache_args=JOIN_CACHE_ARGS, cache_ser_args=JOIN_CACHE_SER_ARGS
+        )
+
+    def forward(
+        self, repo: Repository, args: HashJoinServiceInvokeArgs, tracker: ETLOutput
+    ) -> dict[str, list[InputFile]]:
+        key_prop = args["key_prop"]
+        input_output = get_split_output(tracker, args["input"])
+        source_outputs = [
+            get_split_output(tracker, source["input"]) for source in args["sources"]
+        ]
+        check_same_partitioning(
+            {
+                args["input"].get_ident(): input_output,
+                **{
+                    source["input"].get_ident(): source_output
+                    for source, source_output in zip(args["sources"], source_outputs)
+                },
+            }
+        )
+
+        outdir_base = args["output"]
+        outdir_path = outdir_base.get_path()
+        outdir_path.mkdir(parents=True, exist_ok=True)
+
+        buckets: list[tuple[str, list[JoinSource], list[InputFile]]] = []
+        for bucket, files in input_output.items():
+            sources = [
+                JoinSource(
+                    how=source["how"],
+                    key_prop=source.get("key_prop", key_prop),
+                    fields=source.get("fields"),
+                    files=source_output.get(bucket, []),
+                )
+                for source, source_output in zip(args["sources"], source_outputs)
+            ]
+            buckets.append((bucket, sources, files))
+
+        # resolve the cache hits of all buckets first, so the sources are only read for
+        # the buckets that have files to join
+        join_cache = FileSqliteBackend(
+            FileSqliteBackend.get_dbfile(self.workdir, JoinFn.join)
+        )
+        cache_keys = [
+            self.get_join_key(bucket, outdir_base, key_prop, sources, file)
+            for bucket, sources, files in buckets
+            for file in files
+        ]
+        found = join_cache.has_keys(cache_keys, count_misses=False)
+        records = join_cache.get_records(
+            [key for key, is_found in zip(cache_keys, found) if is_found]
+        )
+
+        output: dict[str, list[InputFile]] = {}
+        jobs = []
+        it_found = iter(zip(cache_keys, found))
+        for bucket, sources, files in buckets:
+            (outdir_path / bucket).mkdir(parents=True, exist_ok=True)
+            output[bucket] = []
+            missing_files = []
+            for file in files:
+                key, is_found = next(it_found)
+                if is_found:
+                    output[bucket].append(records[key][0])
+                else:
+                    missing_files.append(file)
+            if len(missing_files) > 0:
+                jobs.append((bucket, sources, missing_files))
+
+        if self.parallel:
+            it: Iterable[tuple[list[InputFile], DeferredCacheWrites]] = (
+                self.scheduler.map_unordered(
+                    join_bucket,
+                    [
+                        (
+                            self.workdir,
+                            bucket,
+                            outdir_base,
+                            key_prop,
+                            sources,
+                            files,
+                            self.keys_args,
+                        )
+                        for bucket, sources, files in jobs
+                    ],
+                    [
+                        sum(
+                            get_bucket_size(file)
+                            for file in files
+                            + [file for source in sources for file in source.files]
+                        )
+                        for _, sources, files in jobs
+                    ],
+                )
+            )
+        else:
+            it: Iterable[tuple[list[InputFile], DeferredCacheWrites]] = (
+                join_bucket(
+                    self.workdir,
+                    bucket,
+                    outdir_base,
+                    key_prop,
+                    sources,
+                    files,
+                    self.keys_args,
+                )
+                for bucket, sources, files in jobs
+            )
+
+        with CacheWriter() as cache_writer:
+            for outfiles, cache_writes in tqdm(
+                it, total=len(jobs), desc="Join files", disable=self.verbose != 1
+            ):
+                cache_writer.add(cache_writes)
+                for outfile in outfiles:
+                    output[str(outfile.path.parent.relative_to(outdir_path))].append(
+                        outfile
+                    )
+
+        # the output of each file has the same name as the file
+        infiles = {
+            str(Path(bucket) / get_bucket_path(file).name): file
+            for bucket, _, files in buckets
+            for file in files
+        }
+        outfiles = {}
+        for bucket_outfiles in output.values():
+            for outfile in bucket_outfiles:
+                relpath = str(outfile.path.relative_to(outdir_path))
+                outfiles[relpath] = ManifestEntry(
+                    input=infiles[relpath].get_ident(),
+                    key=outfile.key,
+                    size=outfile.path.stat().st_size,
+                )
+        OutputManifest(self.workdir, outdir_path).update(outfiles)
+
+        if isinstance(input_output, SplitOutput):
+            return input_output.with_buckets(output)
+        return output
+
+
+def join_bucket(
+    workdir: Path,
+    bucket: str,
+    outdir: RelPath,
+    key_prop: str | list[str],
+    sources: list[JoinSource],
+    files: list[InputFile],
+    keys_args: Optional[FilterKeysArgs] = None,
+) -> tuple[list[InputFile], DeferredCacheWrites]:
+    with defer_cache_writes() as cache_writes:
+        tables = [JoinTable(source, keys_args or {}) for source in sources]
+        join_fn = JoinFn.get_instance(workdir)
+        outfiles = [
+            join_fn.join(bucket, outdir, key_prop, sources, file, tables)
+            for file in files
+        ]
+    return outfiles, cache_writes
+
+
+class JoinTable:
+    """The records of a source in a bucket that are looked up by the joined records. The source is read
+    when it is first looked up."""
+
+    def __init__(self, source: JoinSource, keys_args: FilterKeysArgs):
+        self.source = source
+        self.keys_args = keys_args
+        self.keys: Optional[FilterKeySet] = None
+        self.values: Optional[dict] = None
+
+    def get_keys(self) -> FilterKeySet:
+        if self.keys is None:
+            get_key = get_key_fn(self.source.key_prop)
+            if self.keys_args.get("compact", False):
+                self.keys = CompactFilterKeySet(
+                    get_key,
+                    self.source.files,
+                    self.keys_args.get("bloom_bits_per_key"),
+                )
+            else:
+                self.keys = FilterKeySet(get_key, self.source.files)
+        return self.keys
+
+    def get_values(self) -> dict:
+        """Get the fields added by a left join of each key, from the first record of the key"""
+        if self.values is None:
+            get_key = get_key_fn(self.source.key_prop)
+            fields = self.source.fields
+            if fields is None:
+                key_props = (
+                    {self.source.key_prop}
+                    if isinstance(self.source.key_prop, str)
+                    else set(self.source.key_prop)
+                )
+            elif isinstance(fields, list):
+                fields = {field: field for field in fields}
+
+            self.values = {}
+            for file in self.source.files:
+                for record in read_file(file):
+                    key = get_key(record)
+                    if key in self.values:
+                        continue
+                    if fields is None:
+                        self.values[key] = {
+                            k: v for k, v in record.items() if k not in key_props
+                        }
+                    else:
+                        self.values[key] = {
+                            target: record[field]
+                            for field, target in fields.items()
+                            if field in record
+                        }
+        return self.values
+
+    def join(self, records: list, get_key) -> tuple[list, bool]:
+        """Join records with the source, returning the output records and whether they are modified"""
+        if self.source.how == "left":
+            values = self.get_values()
+            output = []
+            is_modified = False
+            for record in records:
+                value = values.get(get_key(record))
+                if value is not None and len(value) > 0:
+                    record = {**record, **value}
+                    is_modified = True
+                output.append(record)
+            return output, is_modified
+
+        if len(self.source.files) == 0:
+            matches = [False] * len(records)
+        else:
+            # the keys of the records are looked up in the keys of the source, which may be different fields
+            matches = self.get_keys().contains_keys(
+                [get_key(record) for record in records]
+            )
+        keep = self.source.how == "semi"
+        output = [
+            record for record, is_match in zip(records, matches) if is_match == keep
+        ]
+        return output, len(output) != len(records)
+
+
+class JoinFn:
+    instances = {}
+
+    def __init__(self, workdir: Path):
+        self.workdir = workdir
+
+    @staticmethod
+    def get_instance(workdir: Path):
+        if workdir not in JoinFn.instances:
+            JoinFn.instances[workdir] = JoinFn(workdir)
+        return JoinFn.instances[workdir]
+
+    @cache(
+        backend=FileSqliteBackend.factory(),
+        cache_args=JOIN_CACHE_ARGS,
+        cache_ser_args=JOIN_CACHE_SER_ARGS,  # type: ignore
+    )
+    def join(
+        self,
+        bucket: str,
+        outdir: RelPath,
+        key_prop: str | list[str],
+        sources: list[JoinSource],
+        file: InputFile,
+        tables: list[JoinTable],
+    ) -> InputFile:
+        outfile_relpath = outdir / bucket / get_bucket_path(file).name
+        outfile = outfile_relpath.get_path()
+
+        records = read_file(file)
+        is_modified = False
+        get_key = get_key_fn(key_prop)
+        for table in tables:
+            records, is_table_modified = table.join(records, get_key)
+            is_modified = is_modified or is_table_modified
+
+        if is_modified:
+            write_file(records, outfile)
+        else:
+            copy_bucket(file, outfile)
+
+        with open(outfile, "rb") as f:
+            key = hashlib.file_digest(f, "sha256").hexdigest()
+        return InputFile(
+            basetype=outfile_relpath.basetype,
+            key=key,
+            relpath=outfile_relpath.relpath,
+            path=outfile,
+        )
@@ -1,33 +1,128 @@
 from __future__ import annotations
 
+import csv
 import hashlib
-import pickle
+import math
+import os
+import shutil
+import tempfile
 from collections import defaultdict
+from dataclasses import dataclass
+from itertools import islice
+from operator import itemgetter
 from pathlib import Path
-from typing import Iterable, Mapping, NotRequired, TypedDict
-
-import serde.json
+from typing import (
+    Iterable,
+    Iterator,
+    Literal,
+    Mapping,
+    NotRequired,
+    Optional,
+    TypeAlias,
+    TypedDict,
+)
+
+import orjson
 import xxhash
-from joblib import Parallel, delayed
-from libactor.cache import SqliteBackend, cache
+from hugedict.sqlite import SqliteDict, SqliteDictFieldType
+from libactor.cache import cache
 from tqdm import tqdm
 
+from statickg.helper import (
+    COMPRESSION_EXTENSIONS,
+    CacheWriter,
+    DeferredCacheWrites,
+    FileSqliteBackend,
+    JobScheduler,
+    OutputManifest,
+    SchedulingArgs,
+    defer_cache_writes,
+    get_compression_ext,
+    open_file,
+    strip_compression_ext,
+    write_cache_entry,
+)
 from statickg.models.etl import ETLOutput
-from statickg.models.file_and_path import FormatOutputPath, InputFile, RelPath
+from statickg.models.file_and_path import (
+    CompressionArgs,
+    FormatOutputPath,
+    InputFile,
+    ManifestEntry,
+    RelPath,
+)
 from statickg.models.repository import Repository
 from statickg.services.interface import BaseFileService, BaseService
+from statickg.services.split_pack import (
+    PACK_EXTENSION,
+    PackedBucketFile,
+    get_bucket_path,
+    read_bucket,
+    write_pack,
+)
+from statickg.store import ContentStore
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SPLIT_FILE_RETURN_TYPE: TypeAlias = tuple[
+    InputFile, list[InputFile], DeferredCacheWrites
+]
+
+# default size (in bytes) of the buffer of each bucket (see `BucketWriter`)
+DEFAULT_BUFFER_SIZE = 64 * 1024
+# number of records that are assigned to buckets at once (see `get_bucketnos`)
+BATCH_SIZE = 8192
+# default size (in bytes) of the input data per bucket when the number of buckets is chosen automatically
+DEFAULT_BUCKET_BYTES = 16 * 1024 * 1024
+# digests of the records of buckets are sums of 128-bit hashes modulo 2^128 (see `BucketWriter`)
+DIGEST_MASK = (1 << 128) - 1
 
 
 class HashSplitServiceConstructArgs(TypedDict):
     verbose: NotRequired[int]
     parallel: NotRequired[bool]
+    # reuse buckets of files with identical content regardless of the input paths
+    content_store: NotRequired[bool]
+    # URL of a remote store (a directory or a HTTP blob server) shared between nodes
+    remote_cache: NotRequired[str]
+    # compress the buckets (the extension of the buckets is .json.gz or .json.zst)
+    compression: NotRequired[CompressionArgs]
+    # order of jobs, memory budget & recycling of the workers (see `JobScheduler`)
+    scheduling: NotRequired[SchedulingArgs]
+    # size (in bytes) of the buffer of each bucket, the memory usage of splitting a JSON Lines or CSV
+    # file is about the number of buckets times the buffer size (see `BucketWriter`)
+    buffer_size: NotRequired[int]
+    # write the buckets of each input file to a single packed file (see `write_pack`) instead of a file per
+    # bucket. the packed file is named by the output format with `packed` as the bucket number and
+    # the .jsonpack extension. packed buckets cannot be compressed as they are read from memory-mapped files
+    packed: NotRequired[bool]
+    # when an input file changes, keep the bucket files of its previous version whose records are unchanged
+    # (compared as multisets, see `BucketWriter`) instead of rewriting them, so editing a record of an input only
+    # rewrites the bucket of the record and the keys of the other buckets are unchanged. packed files are
+    # always rewritten
+    incremental: NotRequired[bool]
 
 
 class HashSplitServiceInvokeArgs(TypedDict):
     key_prop: str | list[str]
     input: RelPath | list[RelPath]
     output: FormatOutputPath
-    num_buckets: NotRequired[int]
+    # number of buckets, default is 1024. if it is "auto", the number of buckets is the total size of the input
+    # files divided by `bucket_bytes` and the linear partitioning is used, so the buckets grow with the data.
+    # splits whose buckets are joined (e.g., by HashFilterService) must have the same number of buckets, so
+    # an automatic number of buckets should be chosen by a single split and shared with `same_buckets_as`
+    num_buckets: NotRequired[int | Literal["auto"]]
+    # size (in bytes) of the input data per bucket when the number of buckets is "auto", default is 16MB
+    bucket_bytes: NotRequired[int]
+    # how records are assigned to buckets (see `get_bucketnos`): "modulo" (default for a fixed number of
+    # buckets) moves almost every record when the number of buckets changes, "linear" (linear hashing) only
+    # moves the records of the buckets that are split or merged
+    partitioning: NotRequired[Literal["modulo", "linear"]]
+    # output base of a split invoked before in the pipeline, use its number of buckets and partitioning
+    # instead of `num_buckets` and `partitioning`
+    same_buckets_as: NotRequired[RelPath]
     optional: NotRequired[bool]
     compute_missing_file_key: NotRequired[bool]
 
@@ -52,14 +147,22 @@ class HashSplitService(BaseFileService[HashSplitServiceInvokeArgs]):
         super().__init__(name, workdir, args, services)
         self.verbose = args.get("verbose", 1)
         self.parallel = args.get("parallel", True)
-        self.parallel_executor = Parallel(n_jobs=-1, return_as="generator_unordered")
+        self.scheduler = JobScheduler(args.get("scheduling"))
+        self.store = ContentStore.from_args(workdir, args)
+        self.compression = args.get("compression")
+        self.buffer_size = args.get("buffer_size", DEFAULT_BUFFER_SIZE)
+        self.packed = args.get("packed", False)
+        self.incremental = args.get("incremental", False)
+        assert not (
+            self.packed and self.compression is not None
+        ), "Packed buckets cannot be compressed"
 
     def forward(
         self,
         repo: Repository,
         args: HashSplitServiceInvokeArgs,
         tracker: ETLOutput,
-    ) -> dict[str, list[InputFile]]:
+    ) -> SplitOutput:
         infiles = self.list_files(
             repo,
             args["input"],
@@ -74,6 +177,27 @@ class HashSplitService(BaseFileService[HashSplitServiceInvokeArgs]):
 
         key_prop = args["key_prop"]
         num_buckets = args.get("num_buckets", 1024)
+        if "same_buckets_as" in args:
+            assert (
+                "num_buckets" not in args and "partitioning" not in args
+            ), "Cannot set the number of buckets or the partitioning of a split that has the buckets of another split"
+            other_output = get_split_output(tracker, args["same_buckets_as"])
+            assert isinstance(
+                other_output, SplitOutput
+            ), f"{args['same_buckets_as']} is not written by a split"
+            num_buckets = other_output.num_buckets
+            partitioning = other_output.partitioning
+        elif num_buckets == "auto":
+            bucket_bytes = args.get("bucket_bytes", DEFAULT_BUCKET_BYTES)
+            total_bytes = sum(infile.path.stat().st_size for infile in infiles)
+            num_buckets = max(math.ceil(total_bytes / bucket_bytes), 1)
+            partitioning = args.get("partitioning", "linear")
+            if self.verbose >= 1:
+                self.logger.info(
+                    "Split {} bytes into {} buckets", total_bytes, num_buckets
+                )
+        else:
+            partitioning = args.get("partitioning", "modulo")
 
         # split records into buckets
         jobs = []
@@ -81,66 +205,165 @@ class HashSplitService(BaseFileService[HashSplitServiceInvokeArgs]):
             jobs.append((infile, key_prop, num_buckets))
 
         if self.parallel:
-            it: Iterable[list[InputFile]] = self.parallel_executor(
-                delayed(split_file)(
-                    self.workdir, file, outdir_base, outdir_fmt, key_prop, num_buckets
-                )
-                for file, key_prop, num_buckets in jobs
-            )  # type: ignore
+            it: Iterable[SPLIT_FILE_RETURN_TYPE] = self.scheduler.map_unordered(
+                split_file,
+                [
+                    (
+                        self.workdir,
+                        file,
+                        outdir_base,
+                        outdir_fmt,
+                        key_prop,
+                        num_buckets,
+                        self.store,
+                        self.compression,
+                        self.buffer_size,
+                        self.packed,
+                        partitioning,
+                        self.incremental,
+                    )
+                    for file, key_prop, num_buckets in jobs
+                ],
+                [file.path.stat().st_size for file, _, _ in jobs],
+            )
         else:
-            it: Iterable[list[InputFile]] = (
+            it: Iterable[SPLIT_FILE_RETURN_TYPE] = (
                 split_file(
-                    self.workdir, file, outdir_base, outdir_fmt, key_prop, num_buckets
+                    self.workdir,
+                    file,
+                    outdir_base,
+                    outdir_fmt,
+                    key_prop,
+                    num_buckets,
+                    self.store,
+                    self.compression,
+                    self.buffer_size,
+                    self.packed,
+                    partitioning,
+                    self.incremental,
                 )
                 for file, key_prop, num_buckets in jobs
             )
 
         # get list of all output files and remove unknown files
-        outfiles = set()
+        buckets = set()
+        outfiles: dict[str, ManifestEntry] = {}
         output = defaultdict(list)
-        for tmp in tqdm(
-            it, total=len(jobs), desc="Splitting files", disable=self.verbose != 1
-        ):
-            for outfile in tmp:
-                tmp = outfile.path.relative_to(outdir_path)
-                assert tmp not in outfiles
-                outfiles.add(tmp)
-                output[str(tmp.parent)].append(outfile)
-
-        for x in outdir_path.glob("**/*.json"):
-            if x.relative_to(outdir_path) not in outfiles:
-                # remove unknown files
-                x.unlink()
-
-        return dict(output)
-
+        with CacheWriter() as cache_writer:
+            for infile, tmp, cache_writes in tqdm(
+                it, total=len(jobs), desc="Splitting files", disable=self.verbose != 1
+            ):
+                cache_writer.add(cache_writes)
+                for outfile in tmp:
+                    bucket = get_bucket_path(outfile).relative_to(outdir_path)
+                    assert bucket not in buckets
+                    buckets.add(bucket)
+                    output[str(bucket.parent)].append(outfile)
+                    relpath = str(outfile.path.relative_to(outdir_path))
+                    if relpath not in outfiles:
+                        outfiles[relpath] = ManifestEntry(
+                            input=infile.get_ident(),
+                            key=outfile.key,
+                            size=outfile.path.stat().st_size,
+                        )
+                if self.packed and len(tmp) > 0:
+                    # buckets of the same input are in the same packed file, whose content is identified
+                    # by the keys of its buckets
+                    outfiles[str(tmp[0].path.relative_to(outdir_path))].key = (
+                        hashlib.sha256(
+                            "".join(outfile.key for outfile in tmp).encode()
+                        ).hexdigest()
+                    )
+
+        OutputManifest(self.workdir, outdir_path).update(
+            outfiles,
+            [
+                "**/*.json",
+                *(f"**/*.json{ext}" for ext in COMPRESSION_EXTENSIONS.values()),
+                f"**/*{PACK_EXTENSION}",
+            ],
+        )
 
-def split_file(workdir, file, outdir_base, outdir_fmt, key_prop, num_buckets):
-    return SplitFn.get_instance(workdir).split_file(
-        file, outdir_base, outdir_fmt, key_prop, num_buckets
-    )
+        return SplitOutput(output, num_buckets, partitioning)
+
+
+def split_file(
+    workdir,
+    file,
+    outdir_base,
+    outdir_fmt,
+    key_prop,
+    num_buckets,
+    store=None,
+    compression=None,
+    buffer_size=DEFAULT_BUFFER_SIZE,
+    packed=False,
+    partitioning="modulo",
+    incremental=False,
+) -> SPLIT_FILE_RETURN_TYPE:
+    with defer_cache_writes() as cache_writes:
+        outfiles = SplitFn.get_instance(
+            workdir, store, buffer_size, incremental
+        ).split_file(
+            file,
+            outdir_base,
+            outdir_fmt,
+            key_prop,
+            num_buckets,
+            compression,
+            packed,
+            partitioning,
+        )
+    return file, outfiles, cache_writes
 
 
 class SplitFn:
     instances = {}
 
-    def __init__(self, workdir: Path):
+    def __init__(
+        self,
+        workdir: Path,
+        store: Optional[ContentStore] = None,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        incremental: bool = False,
+    ):
         self.workdir = workdir
+        self.store = store
+        # the buffer size does not change the outputs, so it is not a part of the cache key
+        self.buffer_size = buffer_size
+        # the bucket files written by the previous splits, keyed by their paths & compression. keeping
+        # the files of unchanged buckets does not change the records of the outputs, so it is not a part
+        # of the cache key either
+        if incremental:
+            self.buckets: Optional[SqliteDict[str, BucketState]] = SqliteDict(
+                workdir / "buckets.sqlite",
+                keytype=SqliteDictFieldType.str,
+                ser_value=lambda x: orjson.dumps(x.to_dict()),
+                deser_value=lambda x: BucketState.from_dict(orjson.loads(x)),
+                timeout=30,
+            )
+        else:
+            self.buckets = None
 
     @staticmethod
-    def get_instance(workdir: Path):
-        if workdir not in SplitFn.instances:
-            SplitFn.instances[workdir] = SplitFn(workdir)
-        return SplitFn.instances[workdir]
+    def get_instance(
+        workdir: Path,
+        store: Optional[ContentStore] = None,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        incremental: bool = False,
+    ):
+        key = (workdir, store is not None, buffer_size, incremental)
+        if key not in SplitFn.instances:
+            SplitFn.instances[key] = SplitFn(workdir, store, buffer_size, incremental)
+        return SplitFn.instances[key]
 
     @cache(
-        backend=lambda slf, fn, arghelper: SqliteBackend(
-            func=fn, ser=pickle.dumps, deser=pickle.loads, dbdir=slf.workdir
-        ),
+        backend=FileSqliteBackend.factory(multi_files=True),
         cache_ser_args={
             "infile": lambda x: x.get_ident(),
             "outdir": lambda x: x.get_ident(),
             "key_prop": lambda x: x,
+            "compression": lambda x: x,
         },  # type: ignore
     )
     def split_file(
@@ -150,64 +373,545 @@ class SplitFn:
         outdir_fmt: str,
         key_prop: str | tuple[str, ...],
         num_buckets: int,
+        compression: Optional[CompressionArgs] = None,
+        packed: bool = False,
+        partitioning: str = "modulo",
     ) -> list[InputFile]:
         """Split a file into multiple buckets based on the hash of a record's field.
 
         This function returns the list of output files' relative paths.
         """
-        records = read_file(infile.path)
-        buckets = [[] for _ in range(num_buckets)]
-
-        if isinstance(key_prop, str):
-            for record in records:
-                key = record[key_prop]
-                bucketno = xxhash.xxh32(key).intdigest() % num_buckets
-                buckets[bucketno].append(record)
-        else:
-            for record in records:
-                key = "---".join(str(record[x]) for x in key_prop)
-                bucketno = xxhash.xxh32(key).intdigest() % num_buckets
-                buckets[bucketno].append(record)
-
-        # write the buckets and return the buckets id
-        outfiles: list[InputFile] = []
-        for bucketno, bucket in enumerate(buckets):
-            if len(bucket) == 0:
-                continue
-            outfile_relpath = outdir / outdir_fmt.format(
-                fileparent=infile.path.parent.name,
-                filegrandparent=infile.path.parent.parent.name,
-                bucketno=bucketno,
-                filename=f"{infile.path.stem}.json",
+        # files without content keys (not computed) cannot be looked up in the content store
+        store_key = None
+        if self.store is not None and infile.key != "":
+            store_key_parts = [orjson.dumps(key_prop).decode(), str(num_buckets)]
+            if compression is not None:
+                store_key_parts.append(orjson.dumps(compression).decode())
+            if packed:
+                store_key_parts.append("packed")
+            if partitioning != "modulo":
+                store_key_parts.append(partitioning)
+            store_key = self.store.get_key("split", infile.key, *store_key_parts)
+            metadata = self.store.get_metadata(store_key)
+            if metadata is not None and packed:
+                pack_relpath = get_pack_relpath(infile, outdir, outdir_fmt)
+                if self.store.materialize(store_key, {"pack": pack_relpath.get_path()}):
+                    return [
+                        get_packed_bucket(
+                            infile, outdir, outdir_fmt, pack_relpath, *bucket
+                        )
+                        for bucket in metadata["buckets"]
+                    ]
+            elif metadata is not None:
+                outfiles = []
+                for bucketno, bucketkey in metadata["buckets"]:
+                    outfile_relpath = get_bucket_relpath(
+                        infile, outdir, outdir_fmt, bucketno, compression
+                    )
+                    outfiles.append(
+                        InputFile(
+                            basetype=outfile_relpath.basetype,
+                            key=bucketkey,
+                            relpath=outfile_relpath.relpath,
+                            path=outfile_relpath.get_path(),
+                        )
+                    )
+                if self.store.materialize(
+                    store_key,
+                    {
+                        str(bucketno): outfile.path
+                        for (bucketno, _), outfile in zip(metadata["buckets"], outfiles)
+                    },
+                ):
+                    return outfiles
+
+        # the buckets are written to a temporary directory next to the outputs (so they can be moved to
+        # the outputs) while the input is read, the outputs are not modified if the split fails
+        tmpdir = Path(tempfile.mkdtemp(prefix=".split-", dir=outdir.get_path()))
+        try:
+            writer = BucketWriter(
+                tmpdir,
+                num_buckets,
+                self.buffer_size,
+                digest=self.buckets is not None and not packed,
             )
-            outfile_path = outfile_relpath.get_path()
-            outfile_path.parent.mkdir(parents=True, exist_ok=True)
-            serde.json.ser(bucket, outfile_path)
-
-            outfiles.append(
-                InputFile(
-                    basetype=outfile_relpath.basetype,
-                    key=hashlib.sha256(outfile_path.read_bytes()).hexdigest(),
-                    relpath=outfile_relpath.relpath,
-                    path=outfile_path,
+            records = iter_records(infile.path)
+            while batch := list(islice(records, BATCH_SIZE)):
+                bucketnos = get_bucketnos(
+                    get_keys(batch, key_prop), num_buckets, partitioning
+                )
+                for bucketno, bucket in group_by_bucket(batch, bucketnos, num_buckets):
+                    writer.write_many(bucketno, bucket)
+
+            if packed:
+                return self.write_pack(infile, outdir, outdir_fmt, writer, store_key)
+
+            # move the buckets to the outputs and return the buckets id
+            outfiles: list[InputFile] = []
+            bucketnos: list[int] = []
+            for bucketno in writer.close():
+                outfile_relpath = get_bucket_relpath(
+                    infile, outdir, outdir_fmt, bucketno, compression
                 )
+                outfile_path = outfile_relpath.get_path()
+                outfile_key = self.get_unchanged_bucket(
+                    outfile_relpath, compression, writer.get_digest(bucketno)
+                )
+                if outfile_key is None:
+                    outfile_path.parent.mkdir(parents=True, exist_ok=True)
+                    # the output file may be a hardlink of a content store entry, remove it instead of overwriting it
+                    outfile_path.unlink(missing_ok=True)
+                    if compression is None:
+                        os.replace(writer.get_file(bucketno), outfile_path)
+                    else:
+                        with open(writer.get_file(bucketno), "rb") as f, open_file(
+                            outfile_path, "wb", compression.get("level")
+                        ) as g:
+                            shutil.copyfileobj(f, g)
+
+                    with open(outfile_path, "rb") as f:
+                        outfile_key = hashlib.file_digest(f, "sha256").hexdigest()
+                    self.set_bucket(
+                        outfile_relpath,
+                        compression,
+                        writer.get_digest(bucketno),
+                        outfile_key,
+                    )
+                outfiles.append(
+                    InputFile(
+                        basetype=outfile_relpath.basetype,
+                        key=outfile_key,
+                        relpath=outfile_relpath.relpath,
+                        path=outfile_path,
+                    )
+                )
+                bucketnos.append(bucketno)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        if store_key is not None:
+            assert self.store is not None
+            self.store.put(
+                store_key,
+                {
+                    str(bucketno): outfile.path
+                    for bucketno, outfile in zip(bucketnos, outfiles)
+                },
+                metadata={
+                    "buckets": [
+                        (bucketno, outfile.key)
+                        for bucketno, outfile in zip(bucketnos, outfiles)
+                    ]
+                },
             )
 
         return outfiles
 
+    def get_unchanged_bucket(
+        self,
+        outfile: RelPath,
+        compression: Optional[CompressionArgs],
+        digest: Optional[str],
+    ) -> Optional[str]:
+        """Get the key of the existing bucket file if it has the same records (see `set_bucket`) and has not been
+        modified since it was written, otherwise None"""
+        if self.buckets is None or digest is None:
+            return None
+        state = self.buckets.get(get_bucket_state_key(outfile, compression))
+        if state is None or state.digest != digest:
+            return None
+        try:
+            stat = outfile.get_path().stat()
+        except FileNotFoundError:
+            return None
+        if stat.st_size != state.size or stat.st_mtime_ns != state.mtime_ns:
+            return None
+        return state.key
+
+    def set_bucket(
+        self,
+        outfile: RelPath,
+        compression: Optional[CompressionArgs],
+        digest: Optional[str],
+        key: str,
+    ):
+        """Record the records (digest) and the key of a bucket file that has been written"""
+        if self.buckets is None or digest is None:
+            return
+        stat = outfile.get_path().stat()
+        # the state is written by the parent process like the cache entries, so workers do not write to the database
+        write_cache_entry(
+            self.buckets,
+            get_bucket_state_key(outfile, compression),
+            BucketState(
+                key=key, digest=digest, size=stat.st_size, mtime_ns=stat.st_mtime_ns
+            ),
+        )
 
-def read_file(file: Path):
-    if file.suffix == ".json":
-        records = serde.json.deser(file)
+    def write_pack(
+        self,
+        infile: InputFile,
+        outdir: RelPath,
+        outdir_fmt: str,
+        writer: BucketWriter,
+        store_key: Optional[str],
+    ) -> list[InputFile]:
+        """Write the buckets of an input file to a packed file, returning the buckets in the packed file"""
+        bucketnos = writer.close()
+        if len(bucketnos) == 0:
+            return []
+
+        keys = {}
+        for bucketno in bucketnos:
+            with open(writer.get_file(bucketno), "rb") as f:
+                keys[bucketno] = hashlib.file_digest(f, "sha256").hexdigest()
+
+        pack_relpath = get_pack_relpath(infile, outdir, outdir_fmt)
+        pack_path = pack_relpath.get_path()
+        pack_path.parent.mkdir(parents=True, exist_ok=True)
+        buckets = [
+            (bucketno, keys[bucketno], start, end)
+            for bucketno, start, end in write_pack(
+                [(bucketno, writer.get_file(bucketno)) for bucketno in bucketnos],
+                pack_path,
+            )
+        ]
+
+        if store_key is not None:
+            assert self.store is not None
+            self.store.put(
+                store_key, {"pack": pack_path}, metadata={"buckets": buckets}
+            )
+
+        return [
+            get_packed_bucket(infile, outdir, outdir_fmt, pack_relpath, *bucket)
+            for bucket in buckets
+        ]
+
+
+class SplitOutput(dict[str, list[InputFile]]):
+    """The buckets of a split (a mapping from a bucket to its files) and how records are assigned to the buckets.
+    Services whose outputs are partitioned by the buckets of a split (e.g., HashJoinService) keep the partitioning
+    of their inputs."""
+
+    def __init__(
+        self,
+        buckets: Mapping[str, list[InputFile]],
+        num_buckets: int,
+        partitioning: str,
+    ):
+        super().__init__(buckets)
+        self.num_buckets = num_buckets
+        self.partitioning = partitioning
+
+    def with_buckets(self, buckets: Mapping[str, list[InputFile]]) -> SplitOutput:
+        """Get an output of other files in buckets of the same partitioning"""
+        return SplitOutput(buckets, self.num_buckets, self.partitioning)
+
+
+def check_same_partitioning(outputs: dict[str, dict[str, list[InputFile]]]):
+    """Check that splits whose buckets are processed together assign records to the same buckets, i.e., they
+    have the same number of buckets (which may differ when it is chosen automatically) and partitioning.
+    Outputs whose partitioning is unknown are not checked."""
+    partitionings = {
+        name: (output.num_buckets, output.partitioning)
+        for name, output in outputs.items()
+        if isinstance(output, SplitOutput)
+    }
+    if len(set(partitionings.values())) > 1:
+        raise ValueError(
+            "Splits whose buckets are processed together must have the same number of buckets and partitioning "
+            "(an automatic number of buckets can be shared with `same_buckets_as`). Get "
+            + ", ".join(
+                f"{name}: {num_buckets} buckets ({partitioning})"
+                for name, (num_buckets, partitioning) in partitionings.items()
+            )
+        )
+
+
+def get_split_output(tracker: ETLOutput, output: RelPath) -> dict[str, list[InputFile]]:
+    """Get the buckets (a mapping from a bucket to its files) written to the given output by a split or
+    by a service whose outputs are partitioned by the buckets of splits (e.g., HashJoinService)
+    that has been invoked in the pipeline"""
+    matches = []
+    for service, service_invoke_args in tracker.invoke_args.items():
+        for invoke_args, invoke_output in zip(
+            service_invoke_args, tracker.output[service]
+        ):
+            # a service invoked with a list of arguments returns a list of outputs
+            if not isinstance(invoke_args, list):
+                invoke_args = [invoke_args]
+                invoke_output = [invoke_output]
+            for args, args_output in zip(invoke_args, invoke_output):
+                if not isinstance(args, dict) or not isinstance(args_output, dict):
+                    continue
+                base = args.get("output")
+                if isinstance(base, dict):
+                    base = base.get("base")
+                if base == output:
+                    matches.append(args_output)
+    assert len(matches) == 1, f"Expect exactly one split writing to {output}"
+    return matches[0]
+
+
+def get_pack_relpath(infile: InputFile, outdir: RelPath, outdir_fmt: str) -> RelPath:
+    """Get the path of the packed file of an input file (see `HashSplitServiceConstructArgs.packed`)"""
+    return outdir / outdir_fmt.format(
+        fileparent=infile.path.parent.name,
+        filegrandparent=infile.path.parent.parent.name,
+        bucketno="packed",
+        filename=f"{strip_compression_ext(infile.path).stem}{PACK_EXTENSION}",
+    )
+
+
+def get_packed_bucket(
+    infile: InputFile,
+    outdir: RelPath,
+    outdir_fmt: str,
+    pack_relpath: RelPath,
+    bucketno: int,
+    key: str,
+    start: int,
+    end: int,
+) -> PackedBucketFile:
+    bucket_relpath = get_bucket_relpath(infile, outdir, outdir_fmt, bucketno)
+    return PackedBucketFile(
+        basetype=bucket_relpath.basetype,
+        key=key,
+        relpath=bucket_relpath.relpath,
+        path=pack_relpath.get_path(),
+        bucket_path=bucket_relpath.get_path(),
+        start=start,
+        end=end,
+    )
+
+
+def get_bucket_relpath(
+    infile: InputFile,
+    outdir: RelPath,
+    outdir_fmt: str,
+    bucketno: int,
+    compression: Optional[CompressionArgs] = None,
+) -> RelPath:
+    return outdir / outdir_fmt.format(
+        fileparent=infile.path.parent.name,
+        filegrandparent=infile.path.parent.parent.name,
+        bucketno=bucketno,
+        filename=f"{strip_compression_ext(infile.path).stem}.json{get_compression_ext(compression)}",
+    )
+
+
+@dataclass
+class BucketState:
+    """A bucket file written by `SplitFn.split_file` when splitting incrementally"""
+
+    # sha256 of the file
+    key: str
+    # digest of the records of the bucket (see `BucketWriter`)
+    digest: str
+    # size & modification time (ns) of the file, to detect files modified after they were written
+    size: int
+    mtime_ns: int
+
+    def to_dict(self):
+        return {
+            "key": self.key,
+            "digest": self.digest,
+            "size": self.size,
+            "mtime_ns": self.mtime_ns,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            key=data["key"],
+            digest=data["digest"],
+            size=data["size"],
+            mtime_ns=data["mtime_ns"],
+        )
+
+
+def get_bucket_state_key(outfile: RelPath, compression: Optional[CompressionArgs]):
+    return orjson.dumps([outfile.get_ident(), compression]).decode()
+
+
+class BucketWriter:
+    """Write records to buckets (files of JSON arrays) incrementally. Serialized records are buffered
+    per bucket and appended to the bucket's file when the buffer reaches `buffer_size` bytes, so the memory
+    usage is proportional to the number of buckets times the buffer size instead of the input size.
+
+    The content of a bucket is the same as writing its records with `write_file` (without compression).
+
+    If `digest` is True, the writer also computes a digest of the records of each bucket: the sum of the
+    xxh3_128 hashes of the serialized records modulo 2^128, which does not depend on the order of the records.
+    """
+
+    def __init__(
+        self, outdir: Path, num_buckets: int, buffer_size: int, digest: bool = False
+    ):
+        self.outdir = outdir
+        self.buffer_size = buffer_size
+        self.buffers: list[list[bytes]] = [[] for _ in range(num_buckets)]
+        self.buffer_sizes = [0] * num_buckets
+        self.n_records = [0] * num_buckets
+        self.digests: Optional[list[int]] = [0] * num_buckets if digest else None
+
+    def get_file(self, bucketno: int) -> Path:
+        return self.outdir / f"{bucketno}.json"
+
+    def get_digest(self, bucketno: int) -> Optional[str]:
+        if self.digests is None:
+            return None
+        return f"{self.digests[bucketno]:032x}"
+
+    def write(self, bucketno: int, record):
+        self.write_many(bucketno, [record])
+
+    def write_many(self, bucketno: int, records: list):
+        if len(records) == 0:
+            return
+        data = [
+            orjson.dumps(record, option=orjson.OPT_NON_STR_KEYS) for record in records
+        ]
+        buffer = self.buffers[bucketno]
+        buffer.append(b"," if self.n_records[bucketno] > 0 else b"[")
+        buffer.append(b",".join(data))
+        self.n_records[bucketno] += len(records)
+        if self.digests is not None:
+            self.digests[bucketno] = (
+                self.digests[bucketno] + sum(map(xxhash.xxh3_128_intdigest, data))
+            ) & DIGEST_MASK
+        self.buffer_sizes[bucketno] += sum(len(x) for x in data) + len(records)
+        if self.buffer_sizes[bucketno] >= self.buffer_size:
+            self.flush(bucketno)
+
+    def flush(self, bucketno: int):
+        with open(self.get_file(bucketno), "ab") as f:
+            f.write(b"".join(self.buffers[bucketno]))
+        self.buffers[bucketno] = []
+        self.buffer_sizes[bucketno] = 0
+
+    def close(self) -> list[int]:
+        """Finish writing the buckets, returning the non-empty buckets"""
+        bucketnos = []
+        for bucketno, n_records in enumerate(self.n_records):
+            if n_records == 0:
+                continue
+            self.buffers[bucketno].append(b"]")
+            self.flush(bucketno)
+            bucketnos.append(bucketno)
+        return bucketnos
+
+
+def get_keys(records: list, key_prop: str | tuple[str, ...]) -> list:
+    """Get the keys of records that are hashed to assign them to buckets: the value of the field if `key_prop`
+    is a string, otherwise the string values of the fields joined by `---`."""
+    if isinstance(key_prop, str):
+        return [record[key_prop] for record in records]
+    if len(key_prop) == 1:
+        return [str(record[key_prop[0]]) for record in records]
+    getter = itemgetter(*key_prop)
+    return ["---".join(map(str, getter(record))) for record in records]
+
+
+def get_bucketnos(
+    keys: list,
+    num_buckets: int,
+    partitioning: Literal["modulo", "linear"] = "modulo",
+):
+    """Assign keys to buckets. The hashes are computed in a single pass over the keys and the bucket numbers
+    are vectorized if numpy is available.
+
+    With the "modulo" partitioning, a key belongs to the bucket `xxh32(key) % num_buckets`.
+
+    With the "linear" partitioning (linear hashing), let `2^L <= num_buckets < 2^(L+1)`: a key belongs to
+    the bucket `h = xxh32(key) % 2^L`, or `xxh32(key) % 2^(L+1)` if `h < num_buckets - 2^L`. Adding a bucket
+    splits a single bucket (the records of bucket `num_buckets - 2^L` are divided between it and
+    the new bucket), so the other buckets are unchanged. It is the same as "modulo" when
+    the number of buckets is a power of two.
+    """
+    hashes = map(xxhash.xxh32_intdigest, keys)
+    if partitioning == "modulo":
+        if np is None:
+            return [h % num_buckets for h in hashes]
+        return np.fromiter(hashes, dtype=np.uint32, count=len(keys)) % num_buckets
+
+    assert partitioning == "linear", partitioning
+    level = num_buckets.bit_length() - 1
+    low_mask = (1 << level) - 1
+    high_mask = (1 << (level + 1)) - 1
+    n_split = num_buckets - (1 << level)
+    if np is None:
+        bucketnos = []
+        for h in hashes:
+            bucketno = h & low_mask
+            bucketnos.append(h & high_mask if bucketno < n_split else bucketno)
+        return bucketnos
+
+    hashes = np.fromiter(hashes, dtype=np.uint32, count=len(keys))
+    bucketnos = hashes & np.uint32(low_mask)
+    is_split = bucketnos < n_split
+    bucketnos[is_split] = hashes[is_split] & np.uint32(high_mask)
+    return bucketnos
+
+
+def group_by_bucket(
+    records: list, bucketnos, num_buckets: int
+) -> Iterator[tuple[int, list]]:
+    """Group records by their buckets (see `get_bucketnos`), preserving the order of records in each bucket"""
+    if np is None:
+        buckets = defaultdict(list)
+        for bucketno, record in zip(bucketnos, records):
+            buckets[bucketno].append(record)
+        yield from sorted(buckets.items())
+        return
+
+    order = np.argsort(bucketnos, kind="stable")
+    ends = np.cumsum(np.bincount(bucketnos, minlength=num_buckets))
+    start = 0
+    for bucketno, end in enumerate(ends.tolist()):
+        if end > start:
+            yield bucketno, [records[i] for i in order[start:end].tolist()]
+        start = end
+
+
+def iter_records(file: Path) -> Iterator:
+    """Iterate over records of a file, which can be compressed (e.g., data.jsonl.gz). JSON Lines and CSV
+    files are read in a streaming fashion, while a JSON file (an array of records) is read at once.
+    """
+    suffix = strip_compression_ext(file).suffix
+    if suffix == ".json":
+        with open_file(file, "rb") as f:
+            records = orjson.loads(f.read())
         assert isinstance(records, list)
+        yield from records
+    elif suffix == ".jsonl":
+        with open_file(file, "rb") as f:
+            for line in f:
+                if line.strip():
+                    yield orjson.loads(line)
+    elif suffix == ".csv":
+        # line breaks in quoted values are kept as is
+        with open_file(file, "rt", newline="") as f:
+            yield from csv.DictReader(f)
     else:
-        raise NotImplementedError(file.suffix)
+        raise NotImplementedError(suffix)
+
 
-    return records
+def read_file(file: Path | InputFile) -> list:
+    """Read records from a file, which can be compressed (e.g., data.json.gz), or a bucket of a split file"""
+    if isinstance(file, PackedBucketFile):
+        return read_bucket(file)
+    if isinstance(file, InputFile):
+        file = file.path
+    return list(iter_records(file))
 
 
-def write_file(data: list, file: Path):
-    if file.suffix == ".json":
-        serde.json.ser(data, file)
+def write_file(data: list, file: Path, compression_level: Optional[int] = None):
+    """Write records to a file, which is compressed if it has a compression extension (e.g., data.json.gz)"""
+    suffix = strip_compression_ext(file).suffix
+    if suffix == ".json":
+        with open_file(file, "wb", compression_level) as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS))
     else:
-        raise NotImplementedError(file.suffix)
+        raise NotImplementedError(suffix)
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import mmap
+import os
+import shutil
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+
+import orjson
+
+from statickg.models.file_and_path import InputFile
+
+# extension of packed files, which store all buckets of an input file (see `write_pack`)
+PACK_EXTENSION = ".jsonpack"
+# the last bytes of a packed file, preceded by the size of the index (8 bytes, little endian)
+PACK_MAGIC = b"SKGPACK1"
+PACK_FOOTER = struct.Struct("<Q8s")
+
+
+@dataclass
+class PackedBucketFile(InputFile):
+    """A bucket stored in a packed file: `path` is the packed file, the bucket is the bytes [start, end) of it.
+    `relpath` and `bucket_path` are the paths of the bucket as if it was written to its own file,
+    and `key` is the sha256 of the bucket, so they are the same as the unpacked bucket.
+    """
+
+    bucket_path: Path
+    start: int
+    end: int
+
+
+def is_pack(file: Path) -> bool:
+    return file.name.endswith(PACK_EXTENSION)
+
+
+def write_pack(
+    buckets: list[tuple[int, Path]], outfile: Path
+) -> list[tuple[int, int, int]]:
+    """Concatenate files of buckets (JSON arrays) into a packed file followed by an index of the buckets and
+    the footer. Returns the bucket numbers and byte ranges of the buckets in the packed file.
+    """
+    index = []
+    # the output file may be a hardlink of a content store entry, remove it instead of overwriting it
+    outfile.unlink(missing_ok=True)
+    with open(outfile, "wb") as g:
+        for bucketno, file in buckets:
+            start = g.tell()
+            with open(file, "rb") as f:
+                shutil.copyfileobj(f, g)
+            index.append((bucketno, start, g.tell()))
+        data = orjson.dumps(index)
+        g.write(data)
+        g.write(PACK_FOOTER.pack(len(data), PACK_MAGIC))
+    return index
+
+
+def read_pack_index(file: Path) -> list[tuple[int, int, int]]:
+    """Read the bucket numbers and byte ranges of the buckets in a packed file (see `write_pack`)"""
+    with open(file, "rb") as f:
+        f.seek(-PACK_FOOTER.size, os.SEEK_END)
+        index_size, magic = PACK_FOOTER.unpack(f.read(PACK_FOOTER.size))
+        assert magic == PACK_MAGIC, f"{file} is not a packed file"
+        f.seek(-PACK_FOOTER.size - index_size, os.SEEK_END)
+        return [tuple(x) for x in orjson.loads(f.read(index_size))]
+
+
+def read_bucket(file: PackedBucketFile):
+    """Parse the records of a bucket, the bucket is parsed from the memory-mapped packed file without copying it"""
+    with open(file.path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        view = memoryview(mm)
+        try:
+            return orjson.loads(view[file.start : file.end])
+        finally:
+            view.release()
+
+
+def copy_bucket(file: InputFile, outfile: Path):
+    """Write a bucket to its own file"""
+    if not isinstance(file, PackedBucketFile):
+        shutil.copy(file.path, outfile)
+        return
+    with open(file.path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm, open(outfile, "wb") as g:
+        view = memoryview(mm)
+        try:
+            g.write(view[file.start : file.end])
+        finally:
+            view.release()
+
+
+def get_bucket_path(file: InputFile) -> Path:
+    """Get the path of a bucket as if it was written to its own file"""
+    if isinstance(file, PackedBucketFile):
+        return file.bucket_path
+    return file.path
+
+
+def get_bucket_size(file: InputFile) -> int:
+    if isinstance(file, PackedBucketFile):
+        return file.end - file.start
+    return file.path.stat().st_size
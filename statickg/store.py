@@ -0,0 +1,419 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Mapping, Optional
+
+import orjson
+import requests
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request to clone a file (reflink) on Linux filesystems that support copy-on-write (btrfs, xfs)
+FICLONE = 0x40049409
+METADATA_FILE = "_METADATA"
+# file listing the sha256 of the files of an entry in a remote store, it is uploaded last so
+# an entry is only visible to other nodes once all of its files are uploaded
+MANIFEST_FILE = "_MANIFEST"
+# environment variable to set the remote store of all services that use a content store
+REMOTE_STORE_ENV = "STATICKG_REMOTE_CACHE"
+
+
+class ContentStore:
+    """A content-addressable store of output files. An entry is a directory of files identified by the key of
+    the content that produces them (e.g., the program key and the content key of the input file), so identical
+    content is computed and stored once regardless of where the input file lives (renamed, moved, reverted, or
+    duplicated files).
+
+    Files are materialized into output directories using hardlinks (or reflinks/copies when hardlinks are not
+    possible), so writers must remove an output file before writing to it instead of truncating it; otherwise,
+    they would modify the stored files.
+
+    When a remote store is given, entries missing locally are pulled from the remote store (e.g., computed by another
+    node sharing the same build cache), and new entries are pushed to it.
+    """
+
+    def __init__(self, root: Path, remote: Optional[RemoteStore] = None):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.remote = remote
+
+    @staticmethod
+    def from_args(workdir: Path, args: Mapping[str, Any]) -> Optional[ContentStore]:
+        """Create the content store of a service from its `content_store` and `remote_cache` arguments. The remote
+        store can also be set for every service using the environment variable STATICKG_REMOTE_CACHE.
+        Return None if the service does not use a content store."""
+        remote_url = args.get("remote_cache", os.environ.get(REMOTE_STORE_ENV))
+        if not args.get("content_store", False) and remote_url is None:
+            return None
+        return ContentStore(
+            workdir / "cas",
+            RemoteStore.from_url(remote_url) if remote_url is not None else None,
+        )
+
+    @staticmethod
+    def get_key(*parts: str) -> str:
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    def get_entry_dir(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def has(self, key: str) -> bool:
+        return self.pull(key)
+
+    def get_metadata(self, key: str) -> Optional[dict]:
+        """Get metadata of an entry, returning None if the entry does not exist"""
+        if not self.pull(key):
+            return None
+        try:
+            return orjson.loads((self.get_entry_dir(key) / METADATA_FILE).read_bytes())
+        except FileNotFoundError:
+            return None
+
+    def pull(self, key: str) -> bool:
+        """Make sure the entry is available locally, pulling it from the remote store if needed.
+        Return False if the entry does not exist."""
+        entry_dir = self.get_entry_dir(key)
+        if entry_dir.exists():
+            return True
+        if self.remote is None:
+            return False
+
+        tmpdir = self.root / "tmp" / str(uuid.uuid4())
+        tmpdir.mkdir(parents=True)
+        try:
+            try:
+                found = self.remote.fetch(key, tmpdir)
+            except (OSError, requests.RequestException) as e:
+                logger.warning("Failed to fetch {} from {}: {}", key, self.remote, e)
+                found = False
+
+            if found:
+                entry_dir.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    tmpdir.rename(entry_dir)
+                except OSError:
+                    # another process has stored the entry
+                    if not entry_dir.exists():
+                        raise
+        finally:
+            if tmpdir.exists():
+                shutil.rmtree(tmpdir)
+        return found
+
+    def put(self, key: str, files: Mapping[str, Path], metadata: Optional[dict] = None):
+        """Store files (name -> path) of an entry. If the entry already exists (e.g., another worker has stored it),
+        the existing entry is kept."""
+        entry_dir = self.get_entry_dir(key)
+        if entry_dir.exists():
+            return
+
+        tmpdir = self.root / "tmp" / str(uuid.uuid4())
+        tmpdir.mkdir(parents=True)
+        try:
+            for name, file in files.items():
+                link_file(file, tmpdir / name)
+            (tmpdir / METADATA_FILE).write_bytes(orjson.dumps(metadata or {}))
+
+            entry_dir.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                tmpdir.rename(entry_dir)
+            except OSError:
+                # another process has stored the entry
+                if not entry_dir.exists():
+                    raise
+                return
+        finally:
+            if tmpdir.exists():
+                shutil.rmtree(tmpdir)
+
+        if self.remote is not None:
+            try:
+                self.remote.push(key, entry_dir)
+            except (OSError, requests.RequestException) as e:
+                logger.warning("Failed to push {} to {}: {}", key, self.remote, e)
+
+    def materialize(self, key: str, files: Mapping[str, Path]) -> bool:
+        """Materialize files (name -> output path) of an entry, replacing the existing output files.
+        Return False if the entry does not exist."""
+        if not self.pull(key):
+            return False
+        entry_dir = self.get_entry_dir(key)
+
+        for name, outfile in files.items():
+            outfile.parent.mkdir(parents=True, exist_ok=True)
+            tmpfile = outfile.parent / f".{outfile.name}.{uuid.uuid4().hex}.tmp"
+            try:
+                link_file(entry_dir / name, tmpfile)
+            except FileNotFoundError:
+                logger.warning("Content store entry {} is incomplete", key)
+                return False
+            os.replace(tmpfile, outfile)
+
+        # record the last access so that unused entries can be pruned
+        os.utime(entry_dir)
+        return True
+
+    def prune(self, max_age: float):
+        """Remove entries that have not been stored or materialized in the last `max_age` seconds"""
+        deadline = time.time() - max_age
+        for subdir in self.root.iterdir():
+            if not subdir.is_dir() or subdir.name == "tmp":
+                continue
+            for entry_dir in subdir.iterdir():
+                if entry_dir.stat().st_mtime < deadline:
+                    shutil.rmtree(entry_dir)
+                    logger.info("Remove unused content store entry {}", entry_dir.name)
+
+
+def prune_content_stores(workdir: Path, max_age: float):
+    """Prune the content stores of all services in the working directory of a pipeline (see `ContentStore.prune`)"""
+    for root in sorted(workdir.glob("**/cas")):
+        if root.is_dir():
+            ContentStore(root).prune(max_age)
+
+
+def link_file(src: Path, dst: Path):
+    """Create `dst` with the same content as `src` using a hardlink, falling back to a reflink and then a copy when
+    `src` and `dst` are on different filesystems or the filesystem does not support hardlinks.
+    """
+    try:
+        os.link(src, dst)
+        return
+    except FileNotFoundError:
+        raise
+    except OSError:
+        pass
+
+    if fcntl is not None:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass
+
+    shutil.copyfile(src, dst)
+
+
+class RemoteStore(ABC):
+    """A remote tier of content stores shared between nodes. An entry is a set of files and a manifest containing
+    their sha256, which is uploaded after the files and verified when the entry is downloaded.
+    """
+
+    @staticmethod
+    def from_url(url: str) -> RemoteStore:
+        """Create a remote store from a URL: http(s)://... for a blob server (see `serve_content_store`),
+        otherwise a directory (optionally prefixed with file://) such as a NFS mount."""
+        if url.startswith("http://") or url.startswith("https://"):
+            return HTTPRemoteStore(url)
+        if url.startswith("file://"):
+            url = url[len("file://") :]
+        return DirRemoteStore(Path(url))
+
+    def fetch(self, key: str, entry_dir: Path) -> bool:
+        """Download files of an entry to `entry_dir`. Return False if the entry does not exist
+        or its files do not match the manifest."""
+        manifest = self.read_manifest(key)
+        if manifest is None:
+            return False
+
+        for name, digest in manifest.items():
+            self.download(key, name, entry_dir / name)
+            if sha256_file(entry_dir / name) != digest:
+                logger.warning(
+                    "File {} of entry {} in {} is corrupted, ignore the entry",
+                    name,
+                    key,
+                    self,
+                )
+                return False
+        return True
+
+    def push(self, key: str, entry_dir: Path):
+        """Upload files of a local entry, the manifest is uploaded last."""
+        manifest = {}
+        for file in sorted(entry_dir.iterdir()):
+            self.upload(key, file.name, file)
+            manifest[file.name] = sha256_file(file)
+        self.write_manifest(key, manifest)
+
+    @abstractmethod
+    def read_manifest(self, key: str) -> Optional[dict[str, str]]: ...
+
+    @abstractmethod
+    def write_manifest(self, key: str, manifest: dict[str, str]): ...
+
+    @abstractmethod
+    def download(self, key: str, name: str, outfile: Path): ...
+
+    @abstractmethod
+    def upload(self, key: str, name: str, infile: Path): ...
+
+
+class DirRemoteStore(RemoteStore):
+    """A remote store in a directory shared between nodes, such as a NFS mount."""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def get_entry_dir(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def read_manifest(self, key: str) -> Optional[dict[str, str]]:
+        try:
+            return orjson.loads((self.get_entry_dir(key) / MANIFEST_FILE).read_bytes())
+        except FileNotFoundError:
+            return None
+
+    def write_manifest(self, key: str, manifest: dict[str, str]):
+        write_file_atomic(
+            self.get_entry_dir(key) / MANIFEST_FILE, orjson.dumps(manifest)
+        )
+
+    def download(self, key: str, name: str, outfile: Path):
+        shutil.copyfile(self.get_entry_dir(key) / name, outfile)
+
+    def upload(self, key: str, name: str, infile: Path):
+        outfile = self.get_entry_dir(key) / name
+        outfile.parent.mkdir(parents=True, exist_ok=True)
+        tmpfile = outfile.parent / f".{name}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(infile, tmpfile)
+        os.replace(tmpfile, outfile)
+
+    def __str__(self):
+        return str(self.root)
+
+
+class HTTPRemoteStore(RemoteStore):
+    """A remote store served by a HTTP blob server that supports GET and PUT of /<key>/<name>,
+    such as the one started by `serve_content_store`."""
+
+    def __init__(self, url: str, timeout: float = 60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def read_manifest(self, key: str) -> Optional[dict[str, str]]:
+        resp = self.session.get(
+            f"{self.url}/{key}/{MANIFEST_FILE}", timeout=self.timeout
+        )
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return orjson.loads(resp.content)
+
+    def write_manifest(self, key: str, manifest: dict[str, str]):
+        resp = self.session.put(
+            f"{self.url}/{key}/{MANIFEST_FILE}",
+            data=orjson.dumps(manifest),
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+
+    def download(self, key: str, name: str, outfile: Path):
+        with self.session.get(
+            f"{self.url}/{key}/{name}", stream=True, timeout=self.timeout
+        ) as resp:
+            resp.raise_for_status()
+            with open(outfile, "wb") as f:
+                for chunk in resp.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+
+    def upload(self, key: str, name: str, infile: Path):
+        with open(infile, "rb") as f:
+            resp = self.session.put(
+                f"{self.url}/{key}/{name}", data=f, timeout=self.timeout
+            )
+        resp.raise_for_status()
+
+    def __getstate__(self):
+        # sessions are not shared between processes
+        return {"url": self.url, "timeout": self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __str__(self):
+        return self.url
+
+
+def serve_content_store(root: Path, hostname: str = "127.0.0.1", port: int = 8080):
+    """Start a simple HTTP blob server storing entries of a remote content store in a directory."""
+    store = DirRemoteStore(root)
+    valid_name = re.compile(r"^[a-zA-Z0-9_.-]+$")
+
+    class Handler(BaseHTTPRequestHandler):
+        def get_file(self) -> Optional[tuple[str, str]]:
+            parts = self.path.strip("/").split("/")
+            if len(parts) != 2 or not all(
+                valid_name.match(part) and part not in (".", "..") for part in parts
+            ):
+                self.send_error(400, "Invalid path")
+                return None
+            return parts[0], parts[1]
+
+        def do_GET(self):
+            if (file := self.get_file()) is None:
+                return
+            path = store.get_entry_dir(file[0]) / file[1]
+            if not path.exists():
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(path.stat().st_size))
+            self.end_headers()
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, self.wfile)
+
+        def do_PUT(self):
+            if (file := self.get_file()) is None:
+                return
+            outfile = store.get_entry_dir(file[0]) / file[1]
+            outfile.parent.mkdir(parents=True, exist_ok=True)
+            tmpfile = outfile.parent / f".{file[1]}.{uuid.uuid4().hex}.tmp"
+            remaining = int(self.headers.get("Content-Length", 0))
+            with open(tmpfile, "wb") as f:
+                while remaining > 0:
+                    chunk = self.rfile.read(min(remaining, 1 << 20))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            if remaining > 0:
+                tmpfile.unlink()
+                self.send_error(400, "Incomplete upload")
+                return
+            os.replace(tmpfile, outfile)
+            self.send_response(201)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    logger.info("Serving content store {} at http://{}:{}", root, hostname, port)
+    ThreadingHTTPServer((hostname, port), Handler).serve_forever()
+
+
+def sha256_file(file: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(file, "rb") as f:
+        while chunk := f.read(1 << 20):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def write_file_atomic(file: Path, content: bytes):
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmpfile = file.parent / f".{file.name}.{uuid.uuid4().hex}.tmp"
+    tmpfile.write_bytes(content)
+    os.replace(tmpfile, file)
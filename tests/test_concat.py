@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+from statickg.helper import open_file
+from statickg.models.prelude import BaseType, ETLOutput, RelPath
+from statickg.services.concat import ConcatTTLService
+
+
+def concat(tmp_path: Path, output: str, args: Optional[dict] = None):
+    service = ConcatTTLService("concat", tmp_path / "wd", args or {}, {})
+    service(
+        None,
+        {
+            "input": RelPath(BaseType.DATA_DIR, tmp_path / "data", "in/*"),
+            "output": RelPath(BaseType.DATA_DIR, tmp_path / "data", output),
+            "optional": False,
+        },
+        ETLOutput(),
+    )
+
+
+def write_file(file: Path, content: str):
+    file.parent.mkdir(parents=True, exist_ok=True)
+    with open_file(file, "wt") as f:
+        f.write(content)
+
+
+def test_concat_compressed_turtle(tmp_path: Path):
+    prefix = "@prefix schema: <http://schema.org/> .\n"
+    write_file(
+        tmp_path / "data" / "in" / "a.ttl.gz",
+        prefix + "\n<http://example.org/a> schema:name 'A' .\n",
+    )
+    write_file(
+        tmp_path / "data" / "in" / "b.ttl",
+        prefix + "\n<http://example.org/b> schema:name 'B' .\n",
+    )
+
+    # the compression extension is appended to the output file
+    concat(tmp_path, "all.ttl", {"compression": {"format": "gzip"}})
+    with open_file(tmp_path / "data" / "all.ttl.gz", "rt") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == prefix.strip()
+    assert prefix.strip() not in lines[1:]
+    assert "<http://example.org/a> schema:name 'A' ." in lines
+    assert "<http://example.org/b> schema:name 'B' ." in lines
+
+
+def test_concat_ntriples_adds_missing_newlines(tmp_path: Path):
+    triples = [
+        f'<http://example.org/{name}> <http://schema.org/name> "{name}" .'
+        for name in "abc"
+    ]
+    write_file(tmp_path / "data" / "in" / "a.nt", triples[0])
+    write_file(tmp_path / "data" / "in" / "b.nt.gz", triples[1] + "\n")
+    write_file(tmp_path / "data" / "in" / "c.nt", triples[2])
+
+    concat(tmp_path, "all.nt")
+    assert (tmp_path / "data" / "all.nt").read_text() == "".join(
+        triple + "\n" for triple in triples
+    )
+
+
+def test_concat_rejects_mixed_formats(tmp_path: Path):
+    write_file(
+        tmp_path / "data" / "in" / "a.nt",
+        '<http://example.org/a> <http://schema.org/name> "a" .\n',
+    )
+    write_file(
+        tmp_path / "data" / "in" / "b.ttl",
+        '<http://example.org/b> <http://schema.org/name> "b" .\n',
+    )
+    with pytest.raises(AssertionError, match="different formats"):
+        concat(tmp_path, "all.nt")
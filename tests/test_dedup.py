@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import random
+from pathlib import Path
+from typing import Optional
+
+import orjson
+import pytest
+
+from statickg.helper import get_classpath
+from statickg.models.prelude import BaseType, ETLOutput, RelPath
+from statickg.services.dedup import HashDedupService
+from statickg.services.split import HashSplitService, read_file
+
+rng = random.Random(0)
+# records of each input file, a key appears multiple times in and across the files
+FILES = [
+    [
+        {"id": f"k{rng.randrange(40)}", "n": i * 100 + j, "ts": rng.randrange(10)}
+        for j in range(60)
+    ]
+    for i in range(3)
+]
+
+
+def dedup(tmp_path: Path, keep: str, order_by: Optional[str]) -> list[dict]:
+    indir = tmp_path / "data" / "in"
+    indir.mkdir(parents=True)
+    for i, records in enumerate(FILES):
+        (indir / f"file{i}.json").write_bytes(orjson.dumps(records))
+
+    tracker = ETLOutput()
+    split_args = {
+        "key_prop": "id",
+        "input": RelPath(BaseType.DATA_DIR, tmp_path / "data", "in/*.json"),
+        "output": {
+            "base": RelPath(BaseType.DATA_DIR, tmp_path / "data", "split"),
+            "format": "{bucketno}/{filename}",
+        },
+        "num_buckets": 4,
+    }
+    service = HashSplitService(
+        "split", tmp_path / "wd" / "split", {"parallel": False, "verbose": 0}, {}
+    )
+    tracker.track(
+        get_classpath(HashSplitService),
+        split_args,
+        service(None, split_args, tracker),
+    )
+
+    args = {
+        "key_prop": "id",
+        "input": split_args["output"]["base"],
+        "output": RelPath(BaseType.DATA_DIR, tmp_path / "data", "dedup"),
+        "keep": keep,
+    }
+    if order_by is not None:
+        args["order_by"] = order_by
+    service = HashDedupService(
+        "dedup", tmp_path / "wd" / "dedup", {"parallel": False, "verbose": 0}, {}
+    )
+    output = service(None, args, tracker)
+    return sorted(
+        (
+            record
+            for files in output.values()
+            for file in files
+            for record in read_file(file)
+        ),
+        key=lambda record: record["n"],
+    )
+
+
+def naive_dedup(keep: str, order_by: Optional[str]) -> list[dict]:
+    kept = {}
+    for records in FILES:
+        for record in records:
+            prev = kept.get(record["id"])
+            if prev is None:
+                kept[record["id"]] = record
+            elif order_by is None:
+                if keep == "last":
+                    kept[record["id"]] = record
+            elif (keep == "first" and record[order_by] < prev[order_by]) or (
+                keep == "last" and record[order_by] >= prev[order_by]
+            ):
+                kept[record["id"]] = record
+    return sorted(kept.values(), key=lambda record: record["n"])
+
+
+@pytest.mark.parametrize("keep", ["first", "last"])
+@pytest.mark.parametrize("order_by", [None, "ts"])
+def test_dedup(tmp_path: Path, keep: str, order_by: Optional[str]):
+    assert dedup(tmp_path, keep, order_by) == naive_dedup(keep, order_by)
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional
+
+import pytest
+from rdflib import Graph
+
+from statickg.helper import open_file
+from statickg.models.prelude import BaseType, ETLOutput, InputFile, RelPath
+from statickg.services.drepr_chunk import split_file
+from statickg.services.drepr_upd import DReprService
+from statickg.services.drepr_writer import StreamingTurtleWriter
+
+MODEL = """
+version: "2"
+resources: csv
+attributes:
+  id: [1.., 0]
+  name: [1.., 1]
+alignments:
+  - type: dimension
+    value: id:0 <-> name:0
+semantic_model:
+  schema:Person:1:
+    properties:
+      - [drepr:uri, id]
+      - [schema:name, name]
+  prefixes:
+    schema: http://schema.org/
+"""
+
+
+@pytest.fixture(scope="session")
+def drepr_workdir(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """The generated programs are imported from the package in the workdir of the first DReprService
+    of the process, so all services in the tests share the same workdir"""
+    workdir = tmp_path_factory.mktemp("drepr")
+    (workdir / "model").mkdir()
+    return workdir
+
+
+def drepr(
+    workdir: Path,
+    datadir: Path,
+    service_args: dict,
+    output: str = "out",
+    model: str = "people",
+) -> dict[str, bytes]:
+    """Extract the CSV files in `datadir/in` and return the content of the outputs. Services generating
+    different programs must use different model names, as a program imported by the process is not reloaded
+    """
+    (workdir / "model" / f"{model}.yml").write_text(MODEL)
+    service = DReprService(
+        "drepr",
+        workdir / "wd",
+        {
+            "path": RelPath(BaseType.CFG_DIR, workdir / "model", f"{model}.yml"),
+            "format": "turtle",
+            "verbose": 0,
+            "program_cache": str(workdir / "programs"),
+            **service_args,
+        },
+        {},
+    )
+    service(
+        None,
+        {
+            "input": RelPath(BaseType.DATA_DIR, datadir, "in/*.csv"),
+            "output": RelPath(BaseType.DATA_DIR, datadir, output),
+        },
+        ETLOutput(),
+    )
+    return {
+        file.name: file.read_bytes()
+        for file in sorted((datadir / output).iterdir())
+        if file.is_file()
+    }
+
+
+def write_people(datadir: Path, n_files: int = 3, n_rows: int = 20):
+    (datadir / "in").mkdir(parents=True, exist_ok=True)
+    for i in range(n_files):
+        (datadir / "in" / f"people{i}.csv").write_text(
+            "id,name\n"
+            + "".join(
+                f'http://example.org/{i}_{j},"Name {j}\nof {i}"\n'
+                for j in range(n_rows)
+            )
+        )
+
+
+def parse_outputs(datadir: Path, output: str) -> dict[str, set]:
+    graphs = {}
+    for file in sorted((datadir / output).iterdir()):
+        with open_file(file, "rt") as f:
+            graphs[file.name.split(".", 1)[0]] = set(
+                Graph().parse(data=f.read(), format="turtle")
+            )
+    return graphs
+
+
+def get_batches(
+    tmp_path: Path, sizes: list[int], batch_bytes: Optional[int], parallel: bool
+):
+    jobs = []
+    for i, size in enumerate(sizes):
+        file = tmp_path / f"file{i}.csv"
+        file.write_bytes(b"x" * size)
+        infile = InputFile(BaseType.DATA_DIR, f"key{i}", file.name, file)
+        jobs.append(("program", "gen_programs.program", infile, file))
+
+    # the batches only depend on the batch size & the parallel mode, so they are computed without
+    # creating the service (which generates the programs)
+    service = DReprService.__new__(DReprService)
+    service.batch_bytes = batch_bytes
+    service.parallel = parallel
+    return [
+        [sizes[jobs.index(job)] for job in batch] for batch in service.get_batches(jobs)
+    ]
+
+
+def test_batches_are_within_batch_bytes(tmp_path: Path):
+    sizes = [100, 700, 20, 300, 50, 2000, 10, 400]
+    batches = get_batches(tmp_path, sizes, 1000, True)
+    assert sorted(size for batch in batches for size in batch) == sorted(sizes)
+    for batch in batches:
+        # a file larger than the batch size is processed in its own batch
+        assert sum(batch) <= 1000 or len(batch) == 1
+    assert [2000] in batches
+
+
+def test_sequential_jobs_are_batched_together(tmp_path: Path):
+    sizes = [100, 700, 20, 300]
+    batches = get_batches(tmp_path, sizes, None, False)
+    assert len(batches) == 1 and sorted(batches[0]) == sorted(sizes)
+
+
+def test_streaming_outputs_equal_in_memory_outputs(
+    drepr_workdir: Path, tmp_path: Path, monkeypatch
+):
+    write_people(tmp_path)
+    outputs = drepr(drepr_workdir, tmp_path, {"parallel": False}, "in_memory")
+    # flush the output to the file after every few chunks
+    monkeypatch.setattr(StreamingTurtleWriter, "flush_size", 8)
+    streaming_outputs = drepr(
+        drepr_workdir,
+        tmp_path,
+        {"parallel": False, "streaming": True},
+        "streaming",
+        model="people_streaming",
+    )
+    assert len(outputs) == 3
+    assert streaming_outputs == outputs
+
+
+def test_changing_graph_rewrites_outputs(drepr_workdir: Path, tmp_path: Path):
+    write_people(tmp_path)
+    args = {"format": "nquads", "parallel": False}
+    outputs = drepr(drepr_workdir, tmp_path, {**args, "graph": "http://example.org/g1"})
+    assert len(outputs) == 3
+    assert all(b"<http://example.org/g1> .\n" in output for output in outputs.values())
+
+    outputs = drepr(drepr_workdir, tmp_path, {**args, "graph": "http://example.org/g2"})
+    assert len(outputs) == 3
+    for output in outputs.values():
+        assert b"<http://example.org/g1>" not in output
+        assert b"<http://example.org/g2> .\n" in output
+
+
+@pytest.mark.parametrize("compression", [None, {"format": "gzip"}])
+def test_chunked_outputs_equal_whole_outputs(
+    drepr_workdir: Path, tmp_path: Path, compression: Optional[dict]
+):
+    write_people(tmp_path, n_files=2, n_rows=300)
+    chunks = split_file(tmp_path / "in" / "people0.csv", 2048, tmp_path / "chunks")
+    assert chunks is not None and len(chunks) > 2
+    args = {} if compression is None else {"compression": compression}
+    drepr(drepr_workdir, tmp_path, {"parallel": False, **args}, "whole")
+    outputs = drepr(
+        drepr_workdir,
+        tmp_path,
+        {"parallel": True, "chunking": {"size": 2048}, **args},
+        "chunked",
+    )
+    assert all(
+        name.endswith(".ttl.gz" if compression is not None else ".ttl")
+        for name in outputs
+    )
+
+    whole = parse_outputs(tmp_path, "whole")
+    assert [len(triples) for triples in whole.values()] == [600, 600]
+    assert parse_outputs(tmp_path, "chunked") == whole
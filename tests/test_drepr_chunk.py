@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import csv
+import io
+import os
+from pathlib import Path
+
+from statickg.services.drepr_chunk import (
+    append_files,
+    hash_file,
+    read_csv_header,
+    split_file,
+)
+
+ROWS = [
+    {"id": str(i), "text": f'line 1\nline "2" of {i}' if i % 3 == 0 else f"text {i}"}
+    for i in range(200)
+]
+
+
+def write_csv(file: Path, rows: list[dict], header: bool = True, mode: str = "w"):
+    with open(file, mode, newline="") as f:
+        writer = csv.DictWriter(f, ["id", "text"], lineterminator="\n")
+        if header:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def test_split_csv_keeps_quoted_line_breaks(tmp_path: Path):
+    file = tmp_path / "data.csv"
+    write_csv(file, ROWS)
+
+    chunks = split_file(file, 512, tmp_path / "chunks")
+    assert chunks is not None and len(chunks) > 2
+
+    rows = []
+    for i, chunk in enumerate(chunks):
+        content = chunk.materialize(tmp_path / f"chunk{i}.csv").read_text()
+        assert content.startswith("id,text\n")
+        rows.extend(csv.DictReader(io.StringIO(content, newline="")))
+    assert rows == ROWS
+
+
+def test_hash_file_of_appended_csv(tmp_path: Path):
+    file = tmp_path / "data.csv"
+    write_csv(file, ROWS[:100])
+    before = hash_file(file)
+    assert before.is_row_end
+    assert read_csv_header(file) == b"id,text\n"
+
+    write_csv(file, ROWS[100:], header=False, mode="a")
+    after = hash_file(file, before.size)
+    assert after.prefix_hash == before.hash
+    assert after.hash != before.hash
+    assert after.size == file.stat().st_size
+    assert after.n_lines == file.read_bytes().count(b"\n")
+    assert after.is_row_end
+
+    # a file ending inside a quoted value does not end with a complete row
+    with open(file, "a") as f:
+        f.write('300,"line 1\n')
+    assert not hash_file(file).is_row_end
+
+
+def test_append_files_does_not_modify_hardlinks(tmp_path: Path):
+    entry = tmp_path / "entry.ttl"
+    entry.write_bytes(b"a\n")
+    outfile = tmp_path / "output.ttl"
+    os.link(entry, outfile)
+    chunk = tmp_path / "chunk.ttl"
+    chunk.write_bytes(b"b\n")
+
+    append_files([chunk], outfile)
+    assert outfile.read_bytes() == b"a\nb\n"
+    assert entry.read_bytes() == b"a\n"
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+from drepr.writers.turtle_writer import TurtleWriter
+
+from statickg.services.drepr_writer import (
+    StreamingNQuadsWriter,
+    StreamingNTriplesWriter,
+    StreamingTurtleWriter,
+    patch_program,
+    stream_output,
+)
+
+SCHEMA = "http://schema.org/"
+
+
+def write_people(writer: TurtleWriter):
+    for i, is_buffered in enumerate([False, True]):
+        writer.begin_record(
+            SCHEMA + "Person", f"http://example.org/p{i}", False, is_buffered
+        )
+        writer.write_data_property(SCHEMA + "name", f"Person {i}", None)
+        writer.write_data_property(
+            SCHEMA + "age", str(30 + i), "http://www.w3.org/2001/XMLSchema#integer"
+        )
+        writer.end_record()
+
+
+def test_streaming_turtle_writer(tmp_path: Path, monkeypatch):
+    writer = TurtleWriter({"schema": SCHEMA})
+    write_people(writer)
+
+    # flush the output to the stream after every few chunks
+    monkeypatch.setattr(StreamingTurtleWriter, "flush_size", 4)
+    outfile = tmp_path / "people.ttl"
+    with stream_output(outfile):
+        streaming_writer = StreamingTurtleWriter({"schema": SCHEMA})
+        write_people(streaming_writer)
+        streaming_writer.write_to_file(outfile)
+    assert outfile.read_text() == writer.write_to_string()
+
+
+PEOPLE_NT = "".join(
+    f"<http://example.org/p{i}> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://schema.org/Person> .\n"
+    f'<http://example.org/p{i}> <http://schema.org/name> "Person {i}" .\n'
+    f'<http://example.org/p{i}> <http://schema.org/age> "{30 + i}"^^<http://www.w3.org/2001/XMLSchema#integer> .\n'
+    for i in range(2)
+)
+
+
+def test_ntriples_writer():
+    # prefixes are not used in N-Triples
+    writer = StreamingNTriplesWriter({"schema": SCHEMA})
+    write_people(writer)
+    assert writer.write_to_string() == PEOPLE_NT
+
+
+def test_nquads_writer():
+    writer = StreamingNQuadsWriter.bind_graph("http://example.org/graph")(
+        {"schema": SCHEMA}
+    )
+    write_people(writer)
+    assert writer.write_to_string() == PEOPLE_NT.replace(
+        " .\n", " <http://example.org/graph> .\n"
+    )
+
+
+def test_patch_program():
+    prog = "from drepr.writers.turtle_writer import TurtleWriter\n\ndef main(): ...\n"
+    assert patch_program(prog, "ntriples") == (
+        "from statickg.services.drepr_writer import StreamingNTriplesWriter as TurtleWriter\n"
+        "\ndef main(): ...\n"
+    )
+    with pytest.raises(ValueError, match="named graph"):
+        patch_program(prog, "nquads")
+    with pytest.raises(ValueError, match="does not import the Turtle writer"):
+        patch_program("from drepr.writers import TurtleWriter\n", "turtle")
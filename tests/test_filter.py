@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import orjson
+import pytest
+
+from statickg.helper import get_classpath
+from statickg.models.prelude import BaseType, ETLOutput, RelPath
+from statickg.services.filter import HashFilterService
+from statickg.services.split import HashSplitService, read_file
+
+
+def split(
+    tmp_path: Path, tracker: ETLOutput, name: str, records: list, **kwargs
+) -> RelPath:
+    infile = tmp_path / "data" / name / f"{name}.json"
+    infile.parent.mkdir(parents=True)
+    infile.write_bytes(orjson.dumps(records))
+
+    args = {
+        "key_prop": "id",
+        "input": RelPath(BaseType.DATA_DIR, tmp_path / "data", f"{name}/*.json"),
+        "output": {
+            "base": RelPath(BaseType.DATA_DIR, tmp_path / "data", f"split_{name}"),
+            "format": "{bucketno}/{filename}",
+        },
+        **kwargs,
+    }
+    service = HashSplitService(
+        "split", tmp_path / "wd" / "split", {"parallel": False, "verbose": 0}, {}
+    )
+    tracker.track(get_classpath(HashSplitService), args, service(None, args, tracker))
+    return args["output"]["base"]
+
+
+def test_filter_rejects_splits_with_different_buckets(tmp_path: Path):
+    tracker = ETLOutput()
+    all_output = split(
+        tmp_path,
+        tracker,
+        "all",
+        [{"id": f"r{i}", "value": "x" * 100} for i in range(100)],
+        num_buckets="auto",
+        bucket_bytes=2048,
+    )
+    filter_output = split(
+        tmp_path,
+        tracker,
+        "flt",
+        [{"id": f"r{i}"} for i in range(0, 100, 7)],
+        num_buckets="auto",
+        bucket_bytes=2048,
+    )
+
+    service = HashFilterService(
+        "filter", tmp_path / "wd" / "filter", {"parallel": False, "verbose": 0}, {}
+    )
+    with pytest.raises(ValueError, match="same number of buckets"):
+        service(
+            None,
+            {
+                "key_prop": "id",
+                "all_output": all_output,
+                "filter_output": filter_output,
+                "output": RelPath(BaseType.DATA_DIR, tmp_path / "data", "filtered"),
+            },
+            tracker,
+        )
+
+
+def test_filter_splits_sharing_automatic_buckets(tmp_path: Path):
+    tracker = ETLOutput()
+    all_output = split(
+        tmp_path,
+        tracker,
+        "all",
+        [{"id": f"r{i}", "value": "x" * 100} for i in range(100)],
+        num_buckets="auto",
+        bucket_bytes=2048,
+    )
+    filter_output = split(
+        tmp_path,
+        tracker,
+        "flt",
+        [{"id": f"r{i}"} for i in range(0, 100, 7)],
+        same_buckets_as=all_output,
+    )
+    assert len(list(filter_output.get_path().iterdir())) == len(
+        list(all_output.get_path().iterdir())
+    )
+
+    service = HashFilterService(
+        "filter", tmp_path / "wd" / "filter", {"parallel": False, "verbose": 0}, {}
+    )
+    outdir = RelPath(BaseType.DATA_DIR, tmp_path / "data", "filtered")
+    service(
+        None,
+        {
+            "key_prop": "id",
+            "all_output": all_output,
+            "filter_output": filter_output,
+            "output": outdir,
+        },
+        tracker,
+    )
+    assert sorted(
+        record["id"]
+        for file in outdir.get_path().rglob("*.json")
+        for record in read_file(file)
+    ) == sorted(f"r{i}" for i in range(100) if i % 7 != 0)
+
+
+@pytest.mark.parametrize("keys_args", [{}, {"bloom_bits_per_key": 10}])
+def test_compact_filter_equals_exact_filter(tmp_path: Path, keys_args: dict):
+    pytest.importorskip("numpy")
+    tracker = ETLOutput()
+    all_output = split(
+        tmp_path,
+        tracker,
+        "all",
+        [{"id": f"r{i}", "value": i} for i in range(1000)],
+        num_buckets=4,
+    )
+    filter_output = split(
+        tmp_path,
+        tracker,
+        "flt",
+        [{"id": f"r{i}"} for i in range(0, 1500, 7)],
+        num_buckets=4,
+    )
+
+    outputs = []
+    for name, keys in [("exact", {}), ("compact", {"compact": True, **keys_args})]:
+        service = HashFilterService(
+            name,
+            tmp_path / "wd" / name,
+            {"parallel": False, "verbose": 0, "keys": keys},
+            {},
+        )
+        outdir = RelPath(BaseType.DATA_DIR, tmp_path / "data", name)
+        service(
+            None,
+            {
+                "key_prop": "id",
+                "all_output": all_output,
+                "filter_output": filter_output,
+                "output": outdir,
+            },
+            tracker,
+        )
+        outputs.append(
+            {
+                str(file.relative_to(outdir.get_path())): read_file(file)
+                for file in outdir.get_path().rglob("*.json")
+            }
+        )
+
+    assert outputs[0] == outputs[1]
+    assert sorted(
+        record["id"] for records in outputs[0].values() for record in records
+    ) == sorted(f"r{i}" for i in range(1000) if i % 7 != 0)
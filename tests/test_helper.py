@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from statickg.helper import FileSqliteBackend, OutputManifest
+from statickg.models.prelude import ManifestEntry
+from statickg.services.interface import BaseFileService
+
+
+def test_file_sqlite_backend_does_not_return_stale_values(tmp_path: Path):
+    backend = FileSqliteBackend(tmp_path / "cache.sqlite")
+    file1 = tmp_path / "file1.txt"
+    file2 = tmp_path / "file2.txt"
+    file1.write_text("1")
+    file2.write_text("2")
+
+    backend.set("key", file1)
+    assert backend.has_key("key")
+    backend.set("key", file2)
+    assert backend.get("key") == file2
+
+    assert backend.has_key("key")
+    backend.clear()
+    assert not backend.has_key("key")
+
+
+def test_output_manifest_removes_stale_files(tmp_path: Path):
+    outdir = tmp_path / "out"
+    for relpath in ["a.json", "sub/b.json", "sub/c.json", "notes.txt"]:
+        (outdir / relpath).parent.mkdir(parents=True, exist_ok=True)
+        (outdir / relpath).write_text(relpath)
+
+    def entries(*relpaths: str):
+        return {
+            relpath: ManifestEntry(input=relpath, key=relpath, size=len(relpath))
+            for relpath in relpaths
+        }
+
+    # without a manifest, the output directory is scanned once for files matching the patterns
+    manifest = OutputManifest(tmp_path / "wd", outdir)
+    assert manifest.update(entries("a.json", "sub/b.json"), ["**/*.json"]) == [
+        "sub/c.json"
+    ]
+    assert (outdir / "notes.txt").exists()
+
+    # files written by others are not in the manifest, so they are kept
+    (outdir / "d.json").write_text("d")
+    manifest = OutputManifest(tmp_path / "wd", outdir)
+    assert manifest.update(entries("a.json"), ["**/*.json"]) == ["sub/b.json"]
+    assert sorted(str(file.relative_to(outdir)) for file in outdir.rglob("*")) == [
+        "a.json",
+        "d.json",
+        "notes.txt",
+    ]
+
+
+def test_deprecated_remove_unknown_files_scans_output_directory(tmp_path: Path):
+    outdir = tmp_path / "out"
+    for relpath in ["a.json", "sub/b.json", "notes.txt"]:
+        (outdir / relpath).parent.mkdir(parents=True, exist_ok=True)
+        (outdir / relpath).write_text(relpath)
+
+    service = BaseFileService("test", tmp_path / "wd", {}, {})
+    with pytest.warns(DeprecationWarning):
+        service.remove_unknown_files({outdir / "a.json"}, outdir)
+    assert sorted(str(file.relative_to(outdir)) for file in outdir.rglob("*")) == [
+        "a.json",
+        "sub",
+    ]
+    assert not (tmp_path / "wd").exists()
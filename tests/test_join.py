@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import orjson
+
+from statickg.helper import get_classpath
+from statickg.models.prelude import BaseType, ETLOutput, RelPath
+from statickg.services.join import HashJoinService
+from statickg.services.split import HashSplitService, read_file
+
+PEOPLE = [{"id": f"p{i:02d}", "org": f"o{i % 7}"} for i in range(60)]
+ORGS = [{"ref": f"o{i}", "name": f"Org {i}"} for i in range(5)]
+
+
+def split(tmp_path: Path, tracker: ETLOutput, name: str, records: list, key_prop: str):
+    indir = tmp_path / "data" / name
+    indir.mkdir(parents=True)
+    for i in range(2):
+        (indir / f"{name}{i}.json").write_bytes(orjson.dumps(records[i::2]))
+
+    args = {
+        "key_prop": key_prop,
+        "input": RelPath(BaseType.DATA_DIR, tmp_path / "data", f"{name}/*.json"),
+        "output": {
+            "base": RelPath(BaseType.DATA_DIR, tmp_path / "data", f"split_{name}"),
+            "format": "{bucketno}/{filename}",
+        },
+        "num_buckets": 4,
+    }
+    service = HashSplitService(
+        "split", tmp_path / "wd" / "split", {"parallel": False, "verbose": 0}, {}
+    )
+    tracker.track(get_classpath(HashSplitService), args, service(None, args, tracker))
+    return args["output"]["base"]
+
+
+def join(tmp_path: Path, how: str, fields=None):
+    tracker = ETLOutput()
+    people = split(tmp_path, tracker, "people", PEOPLE, "org")
+    orgs = split(tmp_path, tracker, "orgs", ORGS, "ref")
+    source = {"input": orgs, "how": how, "key_prop": "ref"}
+    if fields is not None:
+        source["fields"] = fields
+
+    service = HashJoinService(
+        "join", tmp_path / "wd" / "join", {"parallel": False, "verbose": 0}, {}
+    )
+    output = service(
+        None,
+        {
+            "key_prop": "org",
+            "input": people,
+            "sources": [source],
+            "output": RelPath(BaseType.DATA_DIR, tmp_path / "data", "joined"),
+        },
+        tracker,
+    )
+    return sorted(
+        (
+            record
+            for files in output.values()
+            for file in files
+            for record in read_file(file)
+        ),
+        key=lambda record: record["id"],
+    )
+
+
+def test_semi_join_with_different_key_fields(tmp_path: Path):
+    orgs = {org["ref"] for org in ORGS}
+    assert join(tmp_path, "semi") == [p for p in PEOPLE if p["org"] in orgs]
+
+
+def test_anti_join_with_different_key_fields(tmp_path: Path):
+    orgs = {org["ref"] for org in ORGS}
+    assert join(tmp_path, "anti") == [p for p in PEOPLE if p["org"] not in orgs]
+
+
+def test_left_join(tmp_path: Path):
+    names = {org["ref"]: org["name"] for org in ORGS}
+    assert join(tmp_path, "left", {"name": "org_name"}) == [
+        {**p, "org_name": names[p["org"]]} if p["org"] in names else p for p in PEOPLE
+    ]
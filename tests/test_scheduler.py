@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import os
+import time
+
+import pytest
+
+from statickg.helper import JobScheduler
+
+
+def job(name: str, sleep: float):
+    start = time.time()
+    time.sleep(sleep)
+    return name, os.getpid(), start, time.time()
+
+
+def test_scheduler_executes_all_jobs():
+    scheduler = JobScheduler({"max_tasks_per_worker": 1})
+    jobs = [(f"job{i}", 0.0) for i in range(20)]
+    results = list(scheduler.map_unordered(job, jobs, list(range(20))))
+    assert sorted(name for name, *_ in results) == sorted(name for name, _ in jobs)
+
+
+def test_scheduler_runs_largest_jobs_first_within_memory_budget():
+    # the budget only fits one job at a time, so the jobs are executed sequentially by size
+    scheduler = JobScheduler({"memory_budget": 1000, "memory_factor": 10})
+    sizes = [10, 50, 30, 80, 20]
+    jobs = [(f"job{size}", 0.05) for size in sizes]
+    results = list(scheduler.map_unordered(job, jobs, sizes))
+
+    assert [name for name, *_ in results] == [
+        f"job{size}" for size in sorted(sizes, reverse=True)
+    ]
+    for prev, cur in zip(results, results[1:]):
+        assert prev[3] <= cur[2]
+
+
+worker_name = None
+
+
+def init_worker(name: str):
+    global worker_name
+    worker_name = name
+
+
+def get_worker_name(i: int):
+    return worker_name, os.getpid()
+
+
+def fail(i: int):
+    raise ValueError(i)
+
+
+def test_schedulers_keep_their_own_workers():
+    schedulers = [
+        JobScheduler(initializer=init_worker, initargs=(name,)) for name in ["a", "b"]
+    ]
+    jobs = [(i,) for i in range(8)]
+    executors = []
+    for _ in range(2):
+        for scheduler, name in zip(schedulers, ["a", "b"]):
+            results = list(scheduler.map_unordered(get_worker_name, jobs, [1] * 8))
+            assert {worker for worker, _ in results} == {name}
+            executors.append(scheduler.executor)
+
+    # the workers of a scheduler are not restarted by the other scheduler
+    assert executors[0] is executors[2] and executors[1] is executors[3]
+    assert executors[0] is not executors[1]
+
+    # the workers are restarted after a job fails
+    with pytest.raises(ValueError):
+        list(schedulers[0].map_unordered(fail, jobs, [1] * 8))
+    results = list(schedulers[0].map_unordered(get_worker_name, jobs, [1] * 8))
+    assert {worker for worker, _ in results} == {"a"}
+    for scheduler in schedulers:
+        scheduler.shutdown()
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import csv
+import random
+from pathlib import Path
+
+import orjson
+import pytest
+
+from statickg.helper import COMPRESSION_EXTENSIONS, collect_cache_stats, open_file
+from statickg.models.prelude import BaseType, ETLOutput, RelPath
+from statickg.services.split import HashSplitService, read_file
+from statickg.services.split_pack import PackedBucketFile, read_pack_index, write_pack
+
+
+def split(
+    tmp_path: Path,
+    service_args: dict,
+    num_buckets: int = 8,
+    pattern: str = "in/*.json",
+    output: str = "split",
+    **kwargs,
+):
+    service = HashSplitService(
+        "split", tmp_path / "wd", {"verbose": 0, **service_args}, {}
+    )
+    outfiles = service(
+        None,
+        {
+            "key_prop": "id",
+            "input": RelPath(BaseType.DATA_DIR, tmp_path / "data", pattern),
+            "output": {
+                "base": RelPath(BaseType.DATA_DIR, tmp_path / "data", output),
+                "format": "{bucketno}/{filename}",
+            },
+            "num_buckets": num_buckets,
+            **kwargs,
+        },
+        ETLOutput(),
+    )
+    return {
+        file.relpath: (file.key, file.path.stat().st_mtime_ns)
+        for files in outfiles.values()
+        for file in files
+    }
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_incremental_split_rewrites_changed_buckets(tmp_path: Path, parallel: bool):
+    records = [{"id": f"k{i}", "value": i} for i in range(500)]
+    infile = tmp_path / "data" / "in" / "records.json"
+    infile.parent.mkdir(parents=True)
+    infile.write_bytes(orjson.dumps(records))
+    args = {"parallel": parallel, "incremental": True}
+    before = split(tmp_path, args)
+
+    # editing a record only rewrites its bucket
+    records[10]["value"] = -1
+    infile.write_bytes(orjson.dumps(records))
+    after = split(tmp_path, args)
+    changed = [file for file in before if before[file] != after[file]]
+    assert changed == [f"split/{find_bucket(tmp_path, 'k10')}/records.json"]
+
+    # reordering the records does not rewrite any bucket
+    random.Random(0).shuffle(records)
+    infile.write_bytes(orjson.dumps(records))
+    assert split(tmp_path, args) == after
+
+
+def find_bucket(tmp_path: Path, key: str) -> str:
+    for file in (tmp_path / "data" / "split").glob("*/records.json"):
+        if any(record["id"] == key for record in orjson.loads(file.read_bytes())):
+            return file.parent.name
+    raise KeyError(key)
+
+
+def test_split_streams_jsonl_and_csv(tmp_path: Path):
+    # values with quotes, commas and line breaks must survive the CSV round trip
+    records = [
+        {"id": f"k{i}", "value": 'a,"b"\nc' if i % 5 == 0 else str(i)}
+        for i in range(2000)
+    ]
+    indir = tmp_path / "data" / "in"
+    indir.mkdir(parents=True)
+    (indir / "a.json").write_bytes(orjson.dumps(records))
+    (indir / "b.jsonl").write_bytes(
+        b"".join(orjson.dumps(record) + b"\n" for record in records)
+    )
+    with open(indir / "c.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, ["id", "value"])
+        writer.writeheader()
+        writer.writerows(records)
+
+    split(tmp_path, {"parallel": False, "buffer_size": 64}, pattern="in/*")
+    for bucketdir in (tmp_path / "data" / "split").iterdir():
+        content = (bucketdir / "a.json").read_bytes()
+        assert (bucketdir / "b.json").read_bytes() == content
+        assert (bucketdir / "c.json").read_bytes() == content
+
+
+@pytest.mark.parametrize("filename", ["data.csv", "data.csv.gz"])
+def test_split_csv_keeps_crlf_in_quoted_values(tmp_path: Path, filename: str):
+    indir = tmp_path / "data" / "in"
+    indir.mkdir(parents=True)
+    with open_file(indir / filename, "wt", newline="") as f:
+        writer = csv.writer(f, lineterminator="\r\n")
+        writer.writerow(["id", "value"])
+        writer.writerows([[f"k{i}", f"line 1\r\nline {i}"] for i in range(20)])
+
+    split(tmp_path, {"parallel": False}, pattern="in/*")
+    records = [
+        record
+        for records in read_buckets(tmp_path / "data" / "split").values()
+        for record in records
+    ]
+    assert sorted(records, key=lambda record: int(record["id"][1:])) == [
+        {"id": f"k{i}", "value": f"line 1\r\nline {i}"} for i in range(20)
+    ]
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_split_rerun_hits_cache(tmp_path: Path, parallel: bool):
+    indir = tmp_path / "data" / "in"
+    indir.mkdir(parents=True)
+    for i in range(3):
+        (indir / f"file{i}.json").write_bytes(
+            orjson.dumps([{"id": f"k{i}_{j}", "value": j} for j in range(200)])
+        )
+    before = split(tmp_path, {"parallel": parallel})
+
+    collect_cache_stats(reset=True)
+    assert split(tmp_path, {"parallel": parallel}) == before
+    stats = collect_cache_stats(reset=True)
+    assert sum(stat.hits for stat in stats.values()) == 3
+    assert all(sum(stat.misses.values()) == 0 for stat in stats.values())
+
+
+def read_buckets(outdir: Path) -> dict[int, list]:
+    return {
+        int(file.parent.name): read_file(file)
+        for file in sorted(outdir.glob("*/*.json*"))
+    }
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_split(tmp_path: Path, compression: str):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    infile = tmp_path / "data" / "in" / "records.json"
+    infile.parent.mkdir(parents=True)
+    infile.write_bytes(orjson.dumps([{"id": f"k{i}", "value": i} for i in range(500)]))
+
+    split(tmp_path, {"parallel": False})
+    args = {"parallel": False, "compression": {"format": compression}}
+    compressed = split(tmp_path, args, output="compressed")
+    assert all(
+        file.endswith(".json" + COMPRESSION_EXTENSIONS[compression])
+        for file in compressed
+    )
+    assert read_buckets(tmp_path / "data" / "compressed") == read_buckets(
+        tmp_path / "data" / "split"
+    )
+
+    # compressed files are deterministic so their keys are stable
+    (tmp_path / "wd").rename(tmp_path / "wd0")
+    recompressed = split(tmp_path, args, output="recompressed")
+    assert [key for key, _ in recompressed.values()] == [
+        key for key, _ in compressed.values()
+    ]
+    for file in (tmp_path / "data" / "compressed").glob("*/*"):
+        assert (
+            tmp_path / "data" / "recompressed" / file.parent.name / file.name
+        ).read_bytes() == file.read_bytes()
+
+
+def test_packed_split(tmp_path: Path):
+    indir = tmp_path / "data" / "in"
+    indir.mkdir(parents=True)
+    for i in range(2):
+        (indir / f"file{i}.json").write_bytes(
+            orjson.dumps([{"id": f"k{i}_{j}", "value": j} for j in range(300)])
+        )
+
+    unpacked = {
+        file: key for file, (key, _) in split(tmp_path, {"parallel": False}).items()
+    }
+    service = HashSplitService(
+        "split",
+        tmp_path / "wd_packed",
+        {"verbose": 0, "parallel": False, "packed": True},
+        {},
+    )
+    output = service(
+        None,
+        {
+            "key_prop": "id",
+            "input": RelPath(BaseType.DATA_DIR, tmp_path / "data", "in/*.json"),
+            "output": {
+                "base": RelPath(BaseType.DATA_DIR, tmp_path / "data", "packed"),
+                "format": "{bucketno}/{filename}",
+            },
+            "num_buckets": 8,
+        },
+        ETLOutput(),
+    )
+
+    files = [file for files in output.values() for file in files]
+    assert all(isinstance(file, PackedBucketFile) for file in files)
+    # a packed bucket has the same path & key as the unpacked bucket
+    packed = {
+        str(file.bucket_path.relative_to(tmp_path / "data" / "packed")): file
+        for file in files
+    }
+    assert {file.replace("split/", "", 1): key for file, key in unpacked.items()} == {
+        file: bucket.key for file, bucket in packed.items()
+    }
+    for file, bucket in packed.items():
+        assert read_file(bucket) == read_file(tmp_path / "data" / "split" / file)
+
+
+def test_pack_index_with_empty_bucket(tmp_path: Path):
+    buckets = []
+    for bucketno, content in enumerate([b'[{"id":"a"}]', b"", b'[{"id":"b"}]']):
+        file = tmp_path / f"{bucketno}.json"
+        file.write_bytes(content)
+        buckets.append((bucketno, file))
+
+    index = write_pack(buckets, tmp_path / "data.jsonpack")
+    assert index == [(0, 0, 12), (1, 12, 12), (2, 12, 24)]
+    assert read_pack_index(tmp_path / "data.jsonpack") == index
+
+
+@pytest.mark.parametrize("num_buckets", [5, 7, 8])
+def test_linear_partitioning_only_splits_one_bucket(tmp_path: Path, num_buckets: int):
+    infile = tmp_path / "data" / "in" / "records.json"
+    infile.parent.mkdir(parents=True)
+    infile.write_bytes(orjson.dumps([{"id": f"k{i}"} for i in range(1000)]))
+
+    outputs = []
+    for n in [num_buckets, num_buckets + 1]:
+        split(
+            tmp_path,
+            {"parallel": False},
+            num_buckets=n,
+            output=f"split{n}",
+            partitioning="linear",
+        )
+        outputs.append(read_buckets(tmp_path / "data" / f"split{n}"))
+
+    # the records of bucket `n - 2^L` (2^L <= n < 2^(L+1)) are divided between it and the new bucket n
+    split_bucket = num_buckets - 2 ** (num_buckets.bit_length() - 1)
+    changed = {
+        bucketno
+        for bucketno in outputs[1]
+        if outputs[0].get(bucketno) != outputs[1][bucketno]
+    }
+    assert changed == {split_bucket, num_buckets}
+    assert sorted(
+        record["id"] for bucketno in changed for record in outputs[1][bucketno]
+    ) == sorted(record["id"] for record in outputs[0][split_bucket])
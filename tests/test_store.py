@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import errno
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import orjson
+import pytest
+import requests
+
+from statickg.models.prelude import BaseType, ETLOutput, RelPath
+from statickg.services.split import HashSplitService
+from statickg.store import (
+    ContentStore,
+    DirRemoteStore,
+    prune_content_stores,
+    serve_content_store,
+)
+
+
+def test_materialize_hardlinks_entries(tmp_path: Path):
+    outfile = tmp_path / "out.ttl"
+    outfile.write_bytes(b"<a> <b> <c> .\n")
+    store = ContentStore(tmp_path / "cas")
+    store.put("key1", {"out.ttl": outfile})
+
+    copy = tmp_path / "copy" / "out.ttl"
+    assert store.materialize("key1", {"out.ttl": copy})
+    entry = store.get_entry_dir("key1") / "out.ttl"
+    assert copy.stat().st_ino == entry.stat().st_ino == outfile.stat().st_ino
+
+
+def test_materialize_falls_back_to_copies(tmp_path: Path, monkeypatch):
+    outfile = tmp_path / "out.ttl"
+    outfile.write_bytes(b"<a> <b> <c> .\n")
+    store = ContentStore(tmp_path / "cas")
+
+    # e.g., the store and the outputs are on different filesystems
+    def link(src, dst):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(os, "link", link)
+    store.put("key1", {"out.ttl": outfile})
+    copy = tmp_path / "copy.ttl"
+    assert store.materialize("key1", {"out.ttl": copy})
+    assert copy.read_bytes() == outfile.read_bytes()
+    assert copy.stat().st_ino != outfile.stat().st_ino
+
+
+def test_prune_removes_unused_entries(tmp_path: Path):
+    outfile = tmp_path / "out.ttl"
+    outfile.write_bytes(b"<a> <b> <c> .\n")
+    stores = [ContentStore(tmp_path / "wd" / name / "cas") for name in ["s1", "s2"]]
+    for store in stores:
+        store.put("old", {"out.ttl": outfile})
+        store.put("used", {"out.ttl": outfile})
+        past = time.time() - 7200
+        for key in ["old", "used"]:
+            os.utime(store.get_entry_dir(key), (past, past))
+        assert store.materialize("used", {"out.ttl": tmp_path / "used.ttl"})
+
+    prune_content_stores(tmp_path / "wd", 3600)
+    for store in stores:
+        assert not store.has("old")
+        assert store.has("used")
+    assert outfile.read_bytes() == b"<a> <b> <c> .\n"
+
+
+@pytest.mark.parametrize("compression", [None, {"format": "gzip"}])
+def test_rewriting_outputs_does_not_modify_entries(
+    tmp_path: Path, compression: Optional[dict]
+):
+    infile = tmp_path / "data" / "in" / "records.json"
+    infile.parent.mkdir(parents=True)
+    service = HashSplitService(
+        "split",
+        tmp_path / "wd",
+        {
+            "parallel": False,
+            "verbose": 0,
+            "content_store": True,
+            "compression": compression,
+        },
+        {},
+    )
+    args = {
+        "key_prop": "id",
+        "input": RelPath(BaseType.DATA_DIR, tmp_path / "data", "in/*.json"),
+        "output": {
+            "base": RelPath(BaseType.DATA_DIR, tmp_path / "data", "split"),
+            "format": "{bucketno}/{filename}",
+        },
+        "num_buckets": 4,
+    }
+
+    def split(records: list) -> dict[str, bytes]:
+        infile.write_bytes(orjson.dumps(records))
+        service(None, args, ETLOutput())
+        return {
+            str(file.relative_to(tmp_path / "data" / "split")): file.read_bytes()
+            for file in (tmp_path / "data" / "split").glob("*/*.json*")
+        }
+
+    records = [{"id": f"k{i}", "value": i} for i in range(100)]
+    before = split(records)
+    # the outputs are hardlinks of the entries, rewriting them must not change the entries
+    assert all(
+        file.stat().st_nlink > 1
+        for file in (tmp_path / "data" / "split").glob("*/*.json*")
+    )
+    split([{**record, "value": -1} for record in records])
+    assert split(records) == before
+
+
+@pytest.fixture(params=["dir", "http"])
+def remote_url(request, tmp_path: Path) -> str:
+    if request.param == "dir":
+        return f"file://{tmp_path / 'remote'}"
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    threading.Thread(
+        target=serve_content_store,
+        args=(tmp_path / "remote", "127.0.0.1", port),
+        daemon=True,
+    ).start()
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(50):
+        try:
+            requests.get(url, timeout=1)
+            break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    return url
+
+
+def test_remote_store_shares_entries_between_nodes(tmp_path: Path, remote_url: str):
+    outfile = tmp_path / "node1" / "out.ttl"
+    outfile.parent.mkdir()
+    outfile.write_bytes(b"<a> <b> <c> .\n")
+    node1 = ContentStore.from_args(tmp_path / "node1", {"remote_cache": remote_url})
+    assert node1 is not None
+    node1.put("key1", {"out.ttl": outfile}, {"program": "p1"})
+
+    node2 = ContentStore.from_args(tmp_path / "node2", {"remote_cache": remote_url})
+    assert node2 is not None
+    assert not node2.materialize("key2", {"out.ttl": tmp_path / "node2" / "x.ttl"})
+    assert node2.materialize("key1", {"out.ttl": tmp_path / "node2" / "out.ttl"})
+    assert (tmp_path / "node2" / "out.ttl").read_bytes() == outfile.read_bytes()
+    assert node2.get_metadata("key1") == {"program": "p1"}
+
+
+def test_remote_store_ignores_corrupted_entries(tmp_path: Path):
+    remote = DirRemoteStore(tmp_path / "remote")
+    outfile = tmp_path / "out.ttl"
+    outfile.write_bytes(b"<a> <b> <c> .\n")
+    ContentStore(tmp_path / "node1", remote).put("key1", {"out.ttl": outfile})
+
+    (remote.get_entry_dir("key1") / "out.ttl").write_bytes(b"corrupted")
+    node2 = ContentStore(tmp_path / "node2", remote)
+    assert not node2.materialize("key1", {"out.ttl": tmp_path / "node2.ttl"})
+    assert not (tmp_path / "node2.ttl").exists()